@@ -0,0 +1,329 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.paginator import InvalidPage, Page
+from django.db.models import QuerySet
+from django.http import HttpResponse, HttpResponseRedirect
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+
+from recipes.models import Ingredient, Recipe, Tag
+from .authentication import CachedTokenAuthentication
+from .changes import recipe_changes
+from .db.postgresql.base import finish_task, start_task
+from .events import broker, read_ticket
+from .fast_serializers import serialize_recipes
+from .pagination import LimitPageNumberPagination
+from .serializers import IngredientSerializer, TagSerializer
+from .views import (
+    BootstrapView, IngredientDetailView, IngredientListView,
+    RecipeBatchView, RecipeChangesView, RecipeCookableView,
+    RecipeDetailView, RecipeListView, RecipeSimilarView,
+    ShortLinkRedirectView, TagDetailView, TagListView, batch_response_data,
+    cookable_page, current_user_data, filtered_recipe_ids, ids_param,
+    shopping_cart_count, similar_recipes_data, tags_data,
+    with_recipe_list_links)
+
+# Потоки для запросов к БД из асинхронных представлений: у каждого потока
+# своё соединение, поэтому размер ограничивает число соединений процесса
+executor = ThreadPoolExecutor(
+    settings.ASYNC_DB_THREADS, thread_name_prefix='async-db')
+# Запрос, которому принадлежат задачи db_task: соединение потока
+# проверяется (CONN_HEALTH_CHECKS) один раз за запрос, а не перед каждой
+# задачей. Контекст передаётся в поток задачи через sync_to_async
+request_scope = ContextVar('request_scope', default=None)
+
+
+def db_task(function):
+    """Синхронная функция с запросами к БД как корутина: выполняется
+    в отдельном потоке, поэтому несколько таких задач идут параллельно.
+    После выполнения соединение потока закрывается или возвращается
+    в пул, если этого требует его возраст, как в конце обычного запроса"""
+
+    def task(*args, **kwargs):
+        start_task(request_scope.get())
+        try:
+            return function(*args, **kwargs)
+        finally:
+            finish_task()
+    return sync_to_async(task, thread_sensitive=False, executor=executor)
+
+
+def render(data, status=200):
+    return HttpResponse(
+        JSONRenderer().render(data), status=status,
+        content_type='application/json')
+
+
+def error_response(exc, request):
+    if isinstance(exc, (
+            exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        exc.auth_header = 'Token'
+    response = exception_handler(exc, {'request': request})
+    result = render(response.data, response.status_code)
+    for header, value in response.items():
+        if header != 'Content-Type':
+            result[header] = value
+    return result
+
+
+async def authenticate(request):
+    """DRF Request с пользователем, определённым по заголовку
+    Authorization, как в синхронных представлениях"""
+
+    drf_request = Request(request, authenticators=[
+        authentication()
+        for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    await db_task(getattr)(drf_request, 'user')
+    return drf_request
+
+
+def async_read_view(sync_view):
+    """Асинхронный вариант представления для GET-запросов, остальные
+    методы обрабатывает синхронное представление sync_view"""
+
+    def decorator(read):
+        async def view(request, **kwargs):
+            if request.method != 'GET':
+                return await sync_to_async(sync_view)(request, **kwargs)
+            request_scope.set(object())
+            try:
+                drf_request = await authenticate(request)
+                return await read(drf_request, **kwargs)
+            except exceptions.APIException as exc:
+                return error_response(exc, request)
+        # как и у представлений DRF, аутентификация выполняется по токену
+        view.csrf_exempt = True
+        return view
+    return decorator
+
+
+class ConcurrentPageNumberPagination(LimitPageNumberPagination):
+    """Постраничный вывод, при котором количество объектов и объекты
+    страницы запрашиваются параллельно"""
+
+    async def apaginate_queryset(self, queryset, request):
+        if not isinstance(queryset, QuerySet):
+            # список id уже загружен, например результатами поиска
+            return self.paginate_queryset(queryset, request)
+        paginator = self.django_paginator_class(
+            queryset, self.get_page_size(request))
+        number = str(request.query_params.get(self.page_query_param, 1))
+        if not number.isdigit() or int(number) < 1:
+            # номер последней страницы зависит от количества объектов
+            return await db_task(self.paginate_queryset)(queryset, request)
+        bottom = (int(number) - 1) * paginator.per_page
+        paginator.count, objects = await asyncio.gather(
+            db_task(queryset.count)(),
+            db_task(list)(queryset[bottom:bottom + paginator.per_page]))
+        try:
+            paginator.validate_number(number)
+        except InvalidPage as exc:
+            raise exceptions.NotFound(self.invalid_page_message.format(
+                page_number=number, message=str(exc)))
+        self.page = Page(objects, int(number), paginator)
+        self.request = request
+        return objects
+
+
+@async_read_view(TagListView.as_view())
+async def tag_list(request):
+    return render(await db_task(
+        lambda: TagSerializer(Tag.objects.all(), many=True).data)())
+
+
+@async_read_view(TagDetailView.as_view())
+async def tag_detail(request, id):
+    try:
+        tag = await db_task(Tag.objects.get)(pk=id)
+    except Tag.DoesNotExist:
+        return render({'detail': 'Тег не найден.'}, 404)
+    return render(TagSerializer(tag).data)
+
+
+@async_read_view(IngredientListView.as_view())
+async def ingredient_list(request):
+    ingredients = Ingredient.objects.all()
+    search_query = request.query_params.get('name')
+    if search_query:
+        ingredients = ingredients.filter(name__istartswith=search_query)
+    return render(await db_task(
+        lambda: IngredientSerializer(ingredients, many=True).data)())
+
+
+@async_read_view(IngredientDetailView.as_view())
+async def ingredient_detail(request, id):
+    try:
+        ingredient = await db_task(Ingredient.objects.get)(pk=id)
+    except Ingredient.DoesNotExist:
+        return render({'detail': 'Ингредиент не найден.'}, 404)
+    return render(IngredientSerializer(ingredient).data)
+
+
+async def recipe_page_data(request):
+    paginator = ConcurrentPageNumberPagination()
+    ids = await paginator.apaginate_queryset(
+        await db_task(filtered_recipe_ids)(request), request)
+    return paginator.get_paginated_response(
+        await db_task(serialize_recipes)(ids, request)).data
+
+
+@async_read_view(RecipeListView.as_view())
+async def recipe_list(request):
+    return render(await recipe_page_data(request))
+
+
+@async_read_view(RecipeBatchView.as_view())
+async def recipe_batch(request):
+    return render(await db_task(batch_response_data)(
+        ids_param(request, 'ids'), request))
+
+
+@async_read_view(RecipeChangesView.as_view())
+async def recipe_changes_feed(request):
+    return render(await db_task(recipe_changes)(request))
+
+
+@async_read_view(RecipeCookableView.as_view())
+async def recipe_cookable(request):
+    paginator, data = await db_task(cookable_page)(request)
+    return render(paginator.get_paginated_response(data).data)
+
+
+@async_read_view(RecipeDetailView.as_view())
+async def recipe_detail(request, id):
+    recipes = await db_task(serialize_recipes)([id], request)
+    if not recipes:
+        raise exceptions.NotFound(detail='Рецепт не найден.')
+    return render(recipes[0])
+
+
+@async_read_view(RecipeSimilarView.as_view())
+async def recipe_similar(request, id):
+    return render(await db_task(similar_recipes_data)(id, request))
+
+
+@async_read_view(ShortLinkRedirectView.as_view())
+async def short_link_redirect(request, short_hash):
+    recipe_id = await db_task(Recipe.objects.filter(
+        id=short_hash).values_list('id', flat=True).first)()
+    if recipe_id is None:
+        raise exceptions.NotFound
+    return HttpResponseRedirect(f'/recipes/{recipe_id}/')
+
+
+@async_read_view(BootstrapView.as_view())
+async def bootstrap(request):
+    # части ответа загружаются параллельно
+    user, tags, recipes, cart_count = await asyncio.gather(
+        db_task(current_user_data)(request), db_task(tags_data)(),
+        recipe_page_data(request), db_task(shopping_cart_count)(request))
+    return render({
+        'user': user,
+        'tags': tags,
+        'recipes': with_recipe_list_links(recipes),
+        'shopping_cart_count': cart_count,
+    })
+
+
+def event_stream_user(scope):
+    """Пользователь по токену из заголовка Authorization или по билету
+    из параметра ticket: EventSource в браузере не умеет задавать
+    заголовки, а постоянный токен в адресе попал бы в журналы запросов"""
+
+    headers = dict(scope['headers'])
+    words = headers.get(b'authorization', b'').decode('latin-1').split()
+    if words:
+        if len(words) != 2 or words[0].lower() != 'token':
+            raise exceptions.AuthenticationFailed(
+                'Недопустимый заголовок токена.')
+        return CachedTokenAuthentication().authenticate_credentials(
+            words[1])[0]
+    tickets = parse_qs(scope['query_string'].decode('latin-1')).get('ticket')
+    if not tickets:
+        raise exceptions.NotAuthenticated
+    return read_ticket(tickets[0])
+
+
+async def send_json(send, status, data, headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), *headers],
+    })
+    await send({
+        'type': 'http.response.body',
+        'body': json.dumps(data, ensure_ascii=False).encode(),
+    })
+
+
+async def recipe_events(scope, receive, send):
+    """ASGI-приложение потока Server-Sent Events: новые рецепты авторов,
+    на которых подписан пользователь. Событие recipe содержит краткие
+    данные рецепта, событие overflow означает, что клиент не успевал
+    читать и часть событий отброшена. Раз в EVENTS_KEEPALIVE_SECONDS
+    без событий отправляется комментарий, чтобы соединение не закрылось
+    по простою"""
+
+    if scope['method'] != 'GET':
+        await send_json(
+            send, 405, {'detail': f'Метод "{scope["method"]}" не разрешен.'},
+            [(b'allow', b'GET')])
+        return
+    try:
+        user = await db_task(event_stream_user)(scope)
+    except exceptions.APIException as exc:
+        await send_json(
+            send, exc.status_code, {'detail': exc.detail},
+            [(b'www-authenticate', b'Token')])
+        return
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            # gateway не должен буферизовать поток
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+    stream = broker.connect(user.pk)
+
+    async def wait_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+    disconnected = asyncio.ensure_future(wait_disconnect())
+    event = asyncio.ensure_future(stream.queue.get())
+    try:
+        while True:
+            await asyncio.wait(
+                {disconnected, event},
+                timeout=settings.EVENTS_KEEPALIVE_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                break
+            if event.done():
+                data = event.result()
+                message = 'event: {}\ndata: {}\n\n'.format(
+                    data['type'], json.dumps(data, ensure_ascii=False))
+                event = asyncio.ensure_future(stream.queue.get())
+            else:
+                message = ': ping\n\n'
+            await send({
+                'type': 'http.response.body',
+                'body': message.encode(),
+                'more_body': True,
+            })
+    finally:
+        disconnected.cancel()
+        event.cancel()
+        broker.disconnect(stream)
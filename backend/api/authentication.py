@@ -0,0 +1,105 @@
+import copy
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+
+from .metrics import TOKEN_CACHE_HITS, TOKEN_CACHE_MISSES
+
+
+class TokenCache:
+    """LRU-кэш соответствия токена пользователю с ограниченным временем
+    жизни записей. Записи хранятся в памяти процесса, а номер версии
+    пользователя — в кэше Django: сброс увеличивает версию, и запись
+    с другой версией не используется. С общим для процессов кэшем
+    выход, смена пароля и деактивация видны всем процессам сразу,
+    с локальным — остальные процессы принимают токен до TOKEN_CACHE_TTL"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        # ключи записей каждого пользователя для сброса без перебора кэша
+        self.user_keys = defaultdict(set)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def version_key(user_id):
+        return f'token_cache:user:{user_id}'
+
+    def version(self, user_id):
+        return cache.get(self.version_key(user_id), 0)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, version, credentials = entry
+            if expires < time.monotonic():
+                self.remove(key)
+                return None
+            self.entries.move_to_end(key)
+        if version != self.version(credentials[0].pk):
+            with self.lock:
+                if self.entries.get(key) is entry:
+                    self.remove(key)
+            return None
+        return credentials
+
+    def set(self, key, credentials):
+        user_id = credentials[0].pk
+        version = self.version(user_id)
+        with self.lock:
+            self.remove(key)
+            self.entries[key] = (
+                time.monotonic() + self.ttl, version, credentials)
+            self.user_keys[user_id].add(key)
+            while len(self.entries) > self.maxsize:
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        """Удаление записи, вызывается под блокировкой"""
+
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            user_id = entry[2][0].pk
+            keys = self.user_keys[user_id]
+            keys.discard(key)
+            if not keys:
+                del self.user_keys[user_id]
+
+    def invalidate_user(self, user_id):
+        cache.add(self.version_key(user_id), 0, timeout=None)
+        cache.incr(self.version_key(user_id))
+        with self.lock:
+            for key in list(self.user_keys.get(user_id, ())):
+                self.remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.user_keys.clear()
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Аутентификация по токену с кэшированием пользователя:
+    повторные запросы с тем же токеном не обращаются к БД"""
+
+    def authenticate_credentials(self, key):
+        credentials = token_cache.get(key)
+        if credentials is None:
+            TOKEN_CACHE_MISSES.inc()
+            credentials = super().authenticate_credentials(key)
+            token_cache.set(key, credentials)
+        else:
+            TOKEN_CACHE_HITS.inc()
+        user, token = credentials
+        # копия защищает кэш от изменений объекта в ходе запроса
+        return copy.copy(user), token
@@ -0,0 +1,100 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from recipes.models import DeletedRecipe, Recipe
+from .fast_serializers import serialize_recipe_map
+
+TOKEN_SALT = 'api.changes'
+
+
+class TokenExpired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = (
+        'Токен синхронизации устарел: загрузите рецепты заново '
+        'без параметра since.')
+
+
+def make_token(**state):
+    return signing.dumps(
+        {key: value.isoformat() if hasattr(value, 'isoformat') else value
+         for key, value in state.items()}, salt=TOKEN_SALT)
+
+
+def read_token(token):
+    """Состояние синхронизации из токена: since — начало интервала
+    изменений, для продолжения интервала также until — его конец
+    и after — дата изменения и id последнего отданного рецепта"""
+
+    try:
+        state = signing.loads(token, salt=TOKEN_SALT)
+        # при первой синхронизации начала интервала нет
+        since = state['since'] and parse_datetime(state['since'])
+        until = after = None
+        if 'after' in state:
+            until = parse_datetime(state['until'])
+            after = (parse_datetime(state['after'][0]), state['after'][1])
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        raise ValidationError({'since': 'Неверный токен синхронизации.'})
+    return since, until, after
+
+
+def recipe_changes(request):
+    """Рецепты, созданные или изменённые после момента из токена since,
+    и id удалённых за это время рецептов. Без since отдаются все рецепты.
+    Рецепты упорядочены по дате изменения и отдаются пакетами
+    по MAX_PAGE_SIZE: если has_more, следующий пакет запрашивается
+    с новым токеном сразу, иначе — при следующей синхронизации"""
+
+    token = request.query_params.get('since')
+    since = until = after = None
+    if token:
+        since, until, after = read_token(token)
+    if until is None:
+        until = timezone.now()
+        if since is not None:
+            if since < until - timedelta(
+                    days=settings.DELETED_RECIPES_DAYS):
+                raise TokenExpired
+            # изменение с более ранней датой могло стать видимым после
+            # выдачи токена, поэтому интервалы синхронизаций перекрываются
+            since -= timedelta(seconds=settings.CHANGES_OVERLAP_SECONDS)
+
+    recipes = Recipe.objects.filter(updated_at__lte=until)
+    if since is not None:
+        recipes = recipes.filter(updated_at__gt=since)
+    if after is not None:
+        recipes = recipes.filter(
+            Q(updated_at__gt=after[0])
+            | Q(updated_at=after[0], id__gt=after[1]))
+    rows = list(recipes.order_by('updated_at', 'id').values_list(
+        'id', 'updated_at')[:settings.MAX_PAGE_SIZE + 1])
+    has_more = len(rows) > settings.MAX_PAGE_SIZE
+    rows = rows[:settings.MAX_PAGE_SIZE]
+
+    deleted = []
+    if since is not None and after is None:
+        deleted = list(DeletedRecipe.objects.filter(
+            deleted_at__gt=since, deleted_at__lte=until).values_list(
+            'recipe_id', flat=True))
+    if has_more:
+        last_id, last_updated_at = rows[-1]
+        token = make_token(
+            since=since, until=until, after=[
+                last_updated_at.isoformat(), last_id])
+    else:
+        token = make_token(since=until)
+    recipes = serialize_recipe_map([recipe_id for recipe_id, _ in rows],
+                                   request)
+    return {
+        'results': list(recipes.values()),
+        'deleted': deleted,
+        'has_more': has_more,
+        'since': token,
+    }
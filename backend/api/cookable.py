@@ -0,0 +1,384 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict, deque
+from itertools import groupby, repeat
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Count, F, FloatField, Q
+from django.db.models.functions import Cast
+
+from recipes.models import IngredientRecipe, Recipe
+
+# Ингредиенты, которые есть хотя бы у 1/LANE_DENSITY рецептов сегмента,
+# хранятся готовыми дорожками, остальные — списками позиций
+LANE_DENSITY = 32
+# Сколько изменённых рецептов учитывается поверх снимка индекса,
+# прежде чем он будет перестроен
+OVERLAY_LIMIT = 1000
+# Через сколько секунд пропуск в журнале изменений считается потерей
+# записи, а не записью, которая ещё не добавлена в кэш
+GAP_TIMEOUT = 5
+CHANGES_TIMEOUT = 24 * 60 * 60
+# запись журнала, после которой индекс строится заново
+REBUILD = 0
+
+
+class ChangeLog:
+    """Журнал изменений в кэше Django, общий для процессов: номер
+    последней записи хранится по ключу {prefix}:version, записи —
+    по ключам {prefix}:change:{номер}"""
+
+    def __init__(self, prefix):
+        self.version_key = f'{prefix}:version'
+        self.change_key = prefix + ':change:{}'
+        self.gap_since = None
+
+    def version(self):
+        return cache.get(self.version_key, 0)
+
+    def write(self, value):
+        cache.add(self.version_key, 0, timeout=None)
+        version = cache.incr(self.version_key)
+        cache.set(self.change_key.format(version), value, CHANGES_TIMEOUT)
+
+    def read(self, since, version):
+        """Записи с номерами от since + 1 до version подряд до первой
+        отсутствующей или None, если пропуск не заполняется дольше
+        GAP_TIMEOUT и журнал нужно считать потерянным"""
+
+        keys = [
+            self.change_key.format(number)
+            for number in range(since + 1, version + 1)]
+        changes = cache.get_many(keys)
+        applied = []
+        for key in keys:
+            if key not in changes:
+                break
+            applied.append(changes[key])
+        if len(applied) < len(keys):
+            # запись могла ещё не попасть в кэш после увеличения версии
+            self.gap_since = self.gap_since or time.monotonic()
+            if time.monotonic() - self.gap_since > GAP_TIMEOUT:
+                return None
+        else:
+            self.gap_since = None
+        return applied
+
+
+class Segment:
+    """Рецепты с одинаковым количеством ингредиентов size, расположенные
+    по возрастанию id. Ингредиент хранится списком позиций рецептов,
+    в которые он входит, или дорожкой — целым числом, в котором байт
+    с номером позиции рецепта равен 1. Сумма дорожек ингредиентов
+    из запроса даёт в каждом байте количество имеющихся ингредиентов
+    рецепта, а сложение длинных целых выполняется без цикла на Python"""
+
+    def __init__(self, size):
+        self.size = size
+        self.recipe_ids = array('q')
+        self.positions = {}
+        self.lanes = {}
+
+    def add(self, recipe_id, ingredients):
+        position = len(self.recipe_ids)
+        self.recipe_ids.append(recipe_id)
+        for ingredient_id in ingredients:
+            self.positions.setdefault(
+                ingredient_id, array('i')).append(position)
+
+    def freeze(self):
+        """Перевод частых ингредиентов в дорожки после заполнения"""
+
+        threshold = len(self.recipe_ids) / LANE_DENSITY
+        for ingredient_id, positions in list(self.positions.items()):
+            if len(positions) >= threshold:
+                self.lanes[ingredient_id] = self.make_lane(positions)
+                del self.positions[ingredient_id]
+
+    def make_lane(self, positions):
+        lane = bytearray(len(self.recipe_ids))
+        deque(map(lane.__setitem__, positions, repeat(1)), maxlen=0)
+        return int.from_bytes(lane, 'little')
+
+    def counts(self, ingredients):
+        """Байты с количеством ингредиентов из ingredients у рецептов"""
+
+        total = 0
+        for ingredient_id in ingredients:
+            lane = self.lanes.get(ingredient_id)
+            if lane is None and ingredient_id in self.positions:
+                lane = self.make_lane(self.positions[ingredient_id])
+            if lane is not None:
+                total += lane
+        return total.to_bytes(len(self.recipe_ids), 'little')
+
+    def position(self, recipe_id):
+        position = bisect_left(self.recipe_ids, recipe_id)
+        if (position < len(self.recipe_ids)
+                and self.recipe_ids[position] == recipe_id):
+            return position
+        return None
+
+
+class Snapshot:
+    """Индекс рецептов, построенный по строкам (id рецепта, id
+    ингредиента), упорядоченным по id рецепта"""
+
+    def __init__(self, rows):
+        self.segments = {}
+        for recipe_id, group in groupby(rows, itemgetter(0)):
+            ingredients = {ingredient_id for _, ingredient_id in group}
+            size = len(ingredients)
+            if size not in self.segments:
+                self.segments[size] = Segment(size)
+            self.segments[size].add(recipe_id, ingredients)
+        for segment in self.segments.values():
+            segment.freeze()
+
+    @classmethod
+    def load(cls):
+        return cls(IngredientRecipe.objects.order_by(
+            'recipe_id').values_list('recipe_id', 'ingredient_id').iterator(
+            chunk_size=10000))
+
+    def locate(self, recipe_id):
+        for segment in self.segments.values():
+            position = segment.position(recipe_id)
+            if position is not None:
+                return segment.size, position
+        return None
+
+
+def coverage(count, size):
+    """Доля имеющихся ингредиентов рецепта"""
+
+    return count / size
+
+
+class Ranking:
+    """Рецепты, в которых есть хотя бы один ингредиент из запроса,
+    по убыванию оценки score(количество ингредиентов из запроса
+    в рецепте, количество ингредиентов рецепта), по умолчанию — покрытия,
+    при равной оценке — по убыванию id. Поддерживает len() и срезы,
+    поэтому подходит для постраничного вывода; срез содержит пары
+    (id рецепта, оценка). Рецепты выбираются поиском байтов
+    в результате Segment.counts, поэтому на каждое значение оценки
+    приходится один просмотр сегмента без цикла на Python"""
+
+    def __init__(self, snapshot, removed, overlay, ingredients,
+                 score=coverage):
+        self.removed = removed
+        self.classes = defaultdict(list)
+        self.extra = defaultdict(list)
+        self.total = 0
+        for size, segment in snapshot.segments.items():
+            counts = segment.counts(ingredients)
+            found = len(counts) - counts.count(0) - sum(
+                1 for position in removed.get(size, ()) if counts[position])
+            if not found:
+                continue
+            self.total += found
+            for count in range(1, min(size, len(ingredients)) + 1):
+                if count in counts:
+                    self.classes[score(count, size)].append(
+                        (segment, counts, count))
+        for recipe_id, recipe_ingredients in overlay.items():
+            count = len(recipe_ingredients & ingredients)
+            if count:
+                self.extra[score(count, len(recipe_ingredients))].append(
+                    recipe_id)
+                self.total += 1
+        self.values = sorted(
+            self.classes.keys() | self.extra.keys(), reverse=True)
+
+    def __len__(self):
+        return self.total
+
+    def __iter__(self):
+        for value in self.values:
+            for recipe_id in self.group(value):
+                yield recipe_id, value
+
+    def group_size(self, value):
+        size = len(self.extra.get(value, ()))
+        for segment, counts, count in self.classes.get(value, ()):
+            size += counts.count(count) - sum(
+                1 for position in self.removed.get(segment.size, ())
+                if counts[position] == count)
+        return size
+
+    def group(self, value):
+        recipe_ids = list(self.extra.get(value, ()))
+        for segment, counts, count in self.classes.get(value, ()):
+            removed = self.removed.get(segment.size, ())
+            position = counts.find(count)
+            while position != -1:
+                if position not in removed:
+                    recipe_ids.append(segment.recipe_ids[position])
+                position = counts.find(count, position + 1)
+        recipe_ids.sort(reverse=True)
+        return recipe_ids
+
+    def __getitem__(self, index):
+        start, stop, _ = index.indices(self.total)
+        needed = stop - start
+        result = []
+        # место первого рецепта текущей группы в общем порядке
+        rank = 0
+        for value in self.values:
+            if len(result) >= needed:
+                break
+            if rank < start:
+                size = self.group_size(value)
+                if rank + size <= start:
+                    rank += size
+                    continue
+            recipe_ids = self.group(value)
+            offset = max(start - rank, 0)
+            result.extend(
+                (recipe_id, value) for recipe_id in
+                recipe_ids[offset:offset + needed - len(result)])
+            rank += len(recipe_ids)
+        return result
+
+
+def query_ranking(ingredients):
+    """Пары (id рецепта, покрытие) в порядке Ranking, вычисленные
+    запросом к БД, пока в процессе нет снимка индекса"""
+
+    if not ingredients:
+        return Recipe.objects.none().values_list('id')
+    return Recipe.objects.annotate(
+        found=Count('ingredientrecipe', filter=Q(
+            ingredientrecipe__ingredient__in=ingredients)),
+        size=Count('ingredientrecipe'),
+    ).filter(found__gt=0).annotate(
+        coverage=Cast(F('found'), FloatField()) / F('size'),
+    ).order_by('-coverage', '-id').values_list('id', 'coverage')
+
+
+class CookableIndex:
+    """Инвертированный индекс ингредиент -> рецепты для поиска рецептов
+    по имеющимся ингредиентам. Первый снимок индекса строится в фоне
+    при запуске процесса (warm_up) или при первом поиске, а до его
+    готовности поиск выполняется запросом к БД. Изменённые после этого
+    рецепты учитываются поверх снимка по журналу изменений в кэше Django,
+    а при переполнении или потере журнала снимок перестраивается в фоне.
+    Как и для ReferenceIds, с локальным кэшем изменения из других
+    процессов становятся видны после перестроения по истечении
+    COOKABLE_INDEX_TTL"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.version = 0
+        self.removed = {}
+        self.overlay = {}
+        self.expires = 0
+        self.changes = ChangeLog('cookable_index')
+        self.rebuilding = False
+
+    def search(self, ingredients):
+        """Ranking по индексу или query_ranking, пока снимок строится"""
+
+        with self.lock:
+            self.refresh()
+            snapshot, removed, overlay = (
+                self.snapshot, self.removed, self.overlay)
+        if snapshot is None:
+            return query_ranking(ingredients)
+        return Ranking(snapshot, removed, overlay, frozenset(ingredients))
+
+    def warm_up(self):
+        with self.lock:
+            if self.snapshot is None:
+                self.start_rebuild()
+
+    def refresh(self):
+        if self.snapshot is None:
+            self.start_rebuild()
+            return
+        version = self.changes.version()
+        if self.expires < time.monotonic() or version < self.version:
+            self.start_rebuild()
+        if version <= self.version:
+            return
+        if version - self.version > OVERLAY_LIMIT:
+            self.start_rebuild()
+            return
+
+        applied = self.changes.read(self.version, version)
+        if applied is None or REBUILD in applied:
+            self.start_rebuild()
+            return
+        if applied:
+            self.apply(set(applied))
+            self.version += len(applied)
+
+    def apply(self, recipe_ids):
+        """Учёт текущего состава изменённых рецептов поверх снимка"""
+
+        ingredients = defaultdict(set)
+        for recipe_id, ingredient_id in IngredientRecipe.objects.filter(
+                recipe_id__in=recipe_ids).values_list(
+                'recipe_id', 'ingredient_id'):
+            ingredients[recipe_id].add(ingredient_id)
+        overlay = dict(self.overlay)
+        removed = {size: set(positions)
+                   for size, positions in self.removed.items()}
+        for recipe_id in recipe_ids:
+            overlay[recipe_id] = frozenset(ingredients[recipe_id])
+            location = self.snapshot.locate(recipe_id)
+            if location is not None:
+                size, position = location
+                removed.setdefault(size, set()).add(position)
+        # состояния заменяются целиком: их могут читать текущие поиски
+        self.overlay, self.removed = overlay, removed
+        if len(overlay) > OVERLAY_LIMIT:
+            self.start_rebuild()
+
+    def install(self, snapshot, version):
+        self.snapshot = snapshot
+        self.version = version
+        self.removed = {}
+        self.overlay = {}
+        self.changes.gap_since = None
+        self.expires = time.monotonic() + settings.COOKABLE_INDEX_TTL
+
+    def start_rebuild(self):
+        if not self.rebuilding:
+            self.rebuilding = True
+            threading.Thread(target=self.rebuild, daemon=True).start()
+
+    def rebuild(self):
+        """Построение нового снимка в фоне: до замены поиск работает
+        по предыдущему. Изменения, внесённые во время построения,
+        учитываются поверх нового снимка по журналу"""
+
+        try:
+            self.build()
+        finally:
+            self.rebuilding = False
+            connections.close_all()
+
+    def build(self):
+        """Построение снимка в текущем потоке"""
+
+        version = self.changes.version()
+        snapshot = Snapshot.load()
+        with self.lock:
+            self.install(snapshot, version)
+
+    def recipe_changed(self, recipe_id):
+        self.changes.write(recipe_id)
+
+    def invalidate(self):
+        self.changes.write(REBUILD)
+
+
+cookable_index = CookableIndex()
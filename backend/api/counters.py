@@ -0,0 +1,42 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from recipes.models import Recipe
+from users.models import CustomUser, Subscription
+from .reference import ReferenceIds
+
+
+class ModelCount(ReferenceIds):
+    """Количество объектов модели, которое кэшируется и сбрасывается
+    так же, как множества id справочников"""
+
+    def __init__(self, model):
+        super().__init__(model)
+        self.version_key = f'count:{model._meta.label_lower}'
+
+    def load(self):
+        return self.model.objects.count()
+
+
+user_count = ModelCount(CustomUser)
+
+
+def change_counter(user_id, field, delta):
+    CustomUser.objects.filter(pk=user_id).update(
+        **{field: Greatest(F(field) + delta, 0)})
+
+
+def count_by(queryset, field):
+    return Coalesce(Subquery(queryset.filter(
+        **{field: OuterRef('pk')}).order_by().values(field).annotate(
+        count=Count('pk')).values('count')), 0)
+
+
+def update_user_counters():
+    """Пересчёт счётчиков рецептов и подписчиков всех пользователей
+    после пакетной вставки, которая не отправляет сигналы моделей"""
+
+    CustomUser.objects.update(
+        recipes_count=count_by(Recipe.objects, 'author'),
+        followers_count=count_by(Subscription.objects, 'subscription'))
+    user_count.invalidate()
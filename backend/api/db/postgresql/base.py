@@ -0,0 +1,224 @@
+import threading
+import time
+from collections import deque
+
+from django.db import connections
+from django.db.backends.postgresql import base
+from django.utils.asyncio import async_unsafe
+from psycopg2 import extensions
+
+from api.metrics import (
+    DB_CONNECTION_FAILURES, DB_CONNECTION_REUSES, DB_CONNECTION_WAIT,
+    DB_CONNECTIONS)
+
+Database = base.Database
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def is_usable(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except Database.Error:
+        return False
+    return True
+
+
+class ConnectionPool:
+    """Пул соединений процесса, общий для всех его потоков: для воркеров
+    с потоками и ASGI. Соединение старше max_age секунд закрывается,
+    при исчерпании пула поток ждёт освобождения соединения до timeout
+    секунд"""
+
+    def __init__(self, size, timeout, max_age):
+        self.timeout = timeout
+        self.max_age = max_age
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = deque()
+        self.created = {}
+        self.lock = threading.Lock()
+
+    def expired(self, connection):
+        return self.max_age is not None and (
+            time.monotonic() - self.created[connection] >= self.max_age)
+
+    def acquire(self, connect, check):
+        """Соединение из пула или новое, если свободных нет. Возвращает
+        пару (соединение, признак повторного использования)"""
+
+        if not self.slots.acquire(timeout=self.timeout):
+            raise Database.OperationalError(
+                f'Нет свободных соединений в пуле за {self.timeout} с')
+        try:
+            while True:
+                with self.lock:
+                    if not self.idle:
+                        break
+                    connection = self.idle.pop()
+                if (connection.closed or self.expired(connection)
+                        or not check(connection)):
+                    self.discard(connection)
+                    continue
+                return connection, True
+            connection = connect()
+            with self.lock:
+                self.created[connection] = time.monotonic()
+            return connection, False
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, connection):
+        try:
+            if not connection.closed and (
+                    connection.info.transaction_status
+                    != extensions.TRANSACTION_STATUS_IDLE):
+                connection.rollback()
+            if connection.closed or self.expired(connection):
+                self.discard(connection)
+            else:
+                with self.lock:
+                    self.idle.append(connection)
+        except Database.Error:
+            self.discard(connection)
+        finally:
+            self.slots.release()
+
+    def discard(self, connection):
+        with self.lock:
+            self.created.pop(connection, None)
+        try:
+            connection.close()
+        except Database.Error:
+            pass
+
+
+def get_pool(alias, settings_dict):
+    key = (alias, settings_dict['NAME'])
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(
+                settings_dict['POOL_SIZE'],
+                settings_dict.get('POOL_TIMEOUT', 10),
+                settings_dict['CONN_MAX_AGE'])
+        return pools[key]
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """Бэкенд PostgreSQL с управлением соединениями.
+
+    CONN_HEALTH_CHECKS: постоянное соединение (CONN_MAX_AGE) проверяется
+    перед первым использованием в каждом запросе, и разорванное
+    соединение переоткрывается вместо ошибки запроса. Повторяет
+    одноимённую настройку Django 4.1.
+
+    POOL_SIZE: соединения берутся из пула процесса и возвращаются в него
+    в конце запроса, CONN_MAX_AGE ограничивает время жизни соединения
+    в пуле.
+
+    Количество новых и повторно использованных соединений, время
+    получения соединения и ошибки отдаются в метриках /metrics"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.health_check_done = False
+        self.request_scope = None
+
+    @property
+    def health_check_enabled(self):
+        return self.settings_dict.get('CONN_HEALTH_CHECKS', False)
+
+    def check(self, connection):
+        if not self.health_check_enabled or is_usable(connection):
+            return True
+        DB_CONNECTION_FAILURES.labels(self.alias, 'health_check').inc()
+        return False
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        start = time.perf_counter()
+        try:
+            if self.settings_dict.get('POOL_SIZE'):
+                self.pool = get_pool(self.alias, self.settings_dict)
+                connection, reused = self.pool.acquire(
+                    lambda: super(DatabaseWrapper, self).get_new_connection(
+                        conn_params),
+                    self.check)
+            else:
+                connection = super().get_new_connection(conn_params)
+                reused = False
+        except Database.Error:
+            DB_CONNECTION_FAILURES.labels(self.alias, 'connect').inc()
+            raise
+        DB_CONNECTION_WAIT.labels(self.alias).observe(
+            time.perf_counter() - start)
+        if reused:
+            DB_CONNECTION_REUSES.labels(self.alias).inc()
+            self.isolation_level = self.settings_dict['OPTIONS'].get(
+                'isolation_level', connection.isolation_level)
+        else:
+            DB_CONNECTIONS.labels(self.alias).inc()
+        return connection
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = True
+        if self.pool is not None:
+            # соединение возвращается в пул в конце каждого запроса
+            self.close_at = time.monotonic()
+
+    def _close(self):
+        if self.pool is None:
+            return super()._close()
+        self.pool.release(self.connection)
+
+    def close_if_unusable_or_obsolete(self, reset_health_check=True):
+        super().close_if_unusable_or_obsolete()
+        if self.connection is not None and reset_health_check:
+            self.health_check_done = False
+
+    def start_request_scope(self, scope):
+        if scope is None or scope is not self.request_scope:
+            self.request_scope = scope
+            self.health_check_done = False
+
+    def close_if_health_check_failed(self):
+        """Проверка постоянного соединения перед первым использованием
+        в запросе"""
+
+        if self.connection is None or self.health_check_done:
+            return
+        DB_CONNECTION_REUSES.labels(self.alias).inc()
+        if not self.check(self.connection):
+            self.close()
+        self.health_check_done = True
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
+
+
+def start_task(scope):
+    """Начало задачи в потоке, который выполняет задачи разных запросов
+    вперемежку (db_task асинхронных представлений): соединение потока
+    проверяется перед первым использованием в каждом запросе scope,
+    а не в каждой задаче. Без scope проверяется каждая задача"""
+
+    for connection in connections.all():
+        if isinstance(connection, DatabaseWrapper):
+            connection.start_request_scope(scope)
+
+
+def finish_task():
+    """Конец задачи: соединение закрывается или возвращается в пул,
+    если этого требует его возраст или ошибка, как в конце запроса"""
+
+    for connection in connections.all():
+        if isinstance(connection, DatabaseWrapper):
+            connection.close_if_unusable_or_obsolete(
+                reset_health_check=False)
+        else:
+            connection.close_if_unusable_or_obsolete()
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+
+import psycopg2
+from django.conf import settings
+from django.core import signing
+from django.db import close_old_connections, connection, connections
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import AuthenticationFailed
+
+from users.models import CustomUser, Subscription
+from .metrics import EVENT_STREAMS, EVENTS_DROPPED
+
+logger = logging.getLogger(__name__)
+
+# Событие, которое заменяет накопленные события при переполнении очереди
+# подключения: клиент догружает пропущенное через /api/recipes/changes/
+OVERFLOW = {'type': 'overflow'}
+# Сколько id подключённых пользователей передаётся в одном запросе
+# при поиске подписчиков автора
+FOLLOWERS_BATCH_SIZE = 500
+CHANNEL = 'recipe_events'
+RECONNECT_DELAY = 5
+TICKET_SALT = 'api.events'
+
+
+def make_ticket(user_id):
+    return signing.dumps(user_id, salt=TICKET_SALT)
+
+
+def read_ticket(ticket):
+    """Пользователь из билета на подключение к потоку событий, выданного
+    не раньше чем EVENTS_TICKET_MAX_AGE секунд назад"""
+
+    try:
+        user_id = signing.loads(
+            ticket, salt=TICKET_SALT, max_age=settings.EVENTS_TICKET_MAX_AGE)
+    except signing.BadSignature:
+        raise AuthenticationFailed('Недействительный или просроченный билет.')
+    user = CustomUser.objects.filter(pk=user_id, is_active=True).first()
+    if user is None:
+        raise AuthenticationFailed('Пользователь неактивен или удален.')
+    return user
+
+
+class Connection:
+    """Подключение пользователя к потоку событий с очередью,
+    ограниченной EVENTS_QUEUE_SIZE. События кладутся в очередь
+    в цикле событий подключения"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(settings.EVENTS_QUEUE_SIZE)
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # клиент не успевает читать: вместо всех событий очереди
+            # он получит одно событие о переполнении
+            EVENTS_DROPPED.inc(self.queue.qsize() + 1)
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(OVERFLOW)
+
+
+class InProcessBackend:
+    """Доставка событий подключениям текущего процесса: подходит
+    для одного процесса ASGI и для локальной проверки"""
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+
+    def send(self, author_id, event):
+        self.deliver(author_id, event)
+
+    def start(self):
+        pass
+
+
+class PostgresBackend:
+    """Доставка событий подключениям всех процессов через LISTEN/NOTIFY
+    PostgreSQL. Поток, слушающий канал, запускается при первом
+    подключении к потоку событий в процессе"""
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+        self.lock = threading.Lock()
+        self.started = False
+
+    def send(self, author_id, event):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [
+                CHANNEL, json.dumps([author_id, event])])
+
+    def start(self):
+        with self.lock:
+            if not self.started:
+                self.started = True
+                threading.Thread(target=self.listen, daemon=True).start()
+
+    def listen(self):
+        while True:
+            listener = None
+            try:
+                listener = psycopg2.connect(
+                    **connections['default'].get_connection_params())
+                listener.autocommit = True
+                with listener.cursor() as cursor:
+                    cursor.execute(f'LISTEN {CHANNEL}')
+                while True:
+                    if not select.select([listener], [], [], 60)[0]:
+                        continue
+                    listener.poll()
+                    while listener.notifies:
+                        self.deliver(*json.loads(
+                            listener.notifies.pop(0).payload))
+                    close_old_connections()
+            except Exception:
+                logger.exception('Ошибка получения событий из канала')
+                time.sleep(RECONNECT_DELAY)
+            finally:
+                if listener is not None:
+                    listener.close()
+
+
+class Broker:
+    """Рассылка событий о новых рецептах подписчикам автора, подключённым
+    к потоку событий. Событие передаётся через бэкенд EVENTS_BACKEND
+    в каждый процесс, а процесс выбирает подписчиков автора среди своих
+    подключений, поэтому подписки учитываются на момент доставки"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = defaultdict(set)
+        self.backend = None
+
+    def get_backend(self):
+        with self.lock:
+            if self.backend is None:
+                self.backend = import_string(settings.EVENTS_BACKEND)(
+                    self.deliver)
+            return self.backend
+
+    def connect(self, user_id):
+        backend = self.get_backend()
+        stream = Connection(user_id)
+        with self.lock:
+            self.connections[user_id].add(stream)
+        EVENT_STREAMS.inc()
+        backend.start()
+        return stream
+
+    def disconnect(self, stream):
+        with self.lock:
+            streams = self.connections[stream.user_id]
+            streams.discard(stream)
+            if not streams:
+                del self.connections[stream.user_id]
+        EVENT_STREAMS.dec()
+
+    def publish(self, author_id, event):
+        try:
+            self.get_backend().send(author_id, event)
+        except Exception:
+            # рецепт уже сохранён, а событие клиент восполнит лентой
+            # изменений, поэтому ошибка рассылки не прерывает запрос
+            logger.exception('Не удалось отправить событие')
+
+    def publish_recipe(self, recipe, request):
+        self.publish(recipe.author_id, {
+            'type': 'recipe',
+            'id': recipe.id,
+            'name': recipe.name,
+            # абсолютный URL, как в ответах API
+            'image': request.build_absolute_uri(
+                recipe.image.url) if recipe.image else None,
+            'cooking_time': recipe.cooking_time,
+            'author': recipe.author_id,
+        })
+
+    def deliver(self, author_id, event):
+        with self.lock:
+            user_ids = list(self.connections)
+        followers = []
+        for start in range(0, len(user_ids), FOLLOWERS_BATCH_SIZE):
+            followers.extend(Subscription.objects.filter(
+                subscription_id=author_id,
+                subscriber_id__in=user_ids[
+                    start:start + FOLLOWERS_BATCH_SIZE]).values_list(
+                'subscriber_id', flat=True))
+        with self.lock:
+            streams = [
+                stream for user_id in followers
+                for stream in self.connections.get(user_id, ())]
+        for stream in streams:
+            try:
+                stream.loop.call_soon_threadsafe(stream.put, event)
+            except RuntimeError:
+                # цикл событий подключения уже закрыт
+                pass
+
+
+broker = Broker()
@@ -0,0 +1,141 @@
+from collections import defaultdict
+
+from recipes.models import (
+    Favorite, Ingredient, IngredientRecipe, Recipe, ShoppingCart, TagRecipe)
+from users.models import CustomUser, Subscription
+from .serializers import RecipeSerializer
+
+RECIPE_COLUMNS = ('name', 'image', 'text', 'cooking_time')
+AUTHOR_COLUMNS = ('email', 'username', 'first_name', 'last_name', 'avatar')
+
+
+def group(pairs):
+    """Словарь id рецепта -> список значений из пар (id рецепта, значение)"""
+
+    groups = defaultdict(list)
+    for recipe_id, value in pairs:
+        groups[recipe_id].append(value)
+    return groups
+
+
+def file_url(request, storage, name):
+    """URL файла как у ImageField DRF: абсолютный, None для пустого"""
+
+    return request.build_absolute_uri(storage.url(name)) if name else None
+
+
+def user_recipe_ids(model, user, recipe_ids):
+    return set(model.objects.filter(
+        user=user, recipe_id__in=recipe_ids).values_list(
+        'recipe_id', flat=True))
+
+
+def serialize_recipes(ids, request):
+    """Данные рецептов с id из ids в том же виде, что и у RecipeSerializer
+    с учётом параметров fields и expand, но без полей DRF: строки рецептов,
+    тегов и ингредиентов читаются через values() и собираются в словари
+    напрямую. Рецепты выводятся в порядке ids, отсутствующие в БД
+    пропускаются. Количество запросов к БД не зависит от количества
+    рецептов"""
+
+    return list(serialize_recipe_map(ids, request).values())
+
+
+def serialize_recipe_map(ids, request):
+    """Словарь id рецепта -> данные рецепта в порядке ids,
+    как в serialize_recipes"""
+
+    fields, expand = RecipeSerializer.selection(request)
+    user = request.user
+    authenticated = user.is_authenticated
+
+    columns = ['id', 'author_id']
+    columns += [name for name in RECIPE_COLUMNS if name in fields]
+    if 'author' in expand:
+        columns += [f'author__{name}' for name in AUTHOR_COLUMNS]
+    rows = {
+        row['id']: row
+        for row in Recipe.objects.filter(id__in=ids).values(*columns)}
+    if not rows:
+        return {}
+
+    if 'tags' in expand:
+        # порядок тегов как у Tag.Meta.ordering
+        tags = group(
+            (recipe_id, {'id': tag_id, 'name': name, 'slug': slug})
+            for recipe_id, tag_id, name, slug in TagRecipe.objects.filter(
+                recipe_id__in=rows).order_by('tag__name').values_list(
+                'recipe_id', 'tag_id', 'tag__name', 'tag__slug'))
+    elif 'tags' in fields:
+        tags = group(TagRecipe.objects.filter(
+            recipe_id__in=rows).order_by('tag__name').values_list(
+            'recipe_id', 'tag_id'))
+
+    if 'ingredients' in fields:
+        entries = IngredientRecipe.objects.filter(
+            recipe_id__in=rows).values_list(
+            'recipe_id', 'ingredient_id', 'amount')
+        if 'ingredients' in expand:
+            entries = list(entries)
+            names = {
+                ingredient_id: (name, unit)
+                for ingredient_id, name, unit in Ingredient.objects.filter(
+                    id__in={entry[1] for entry in entries}).values_list(
+                    'id', 'name', 'measurement_unit')}
+            ingredients = group(
+                (recipe_id, {
+                    'id': ingredient_id,
+                    'name': names[ingredient_id][0],
+                    'measurement_unit': names[ingredient_id][1],
+                    'amount': amount})
+                for recipe_id, ingredient_id, amount in entries)
+        else:
+            ingredients = group(
+                (recipe_id, ingredient_id)
+                for recipe_id, ingredient_id, amount in entries)
+
+    favorited = in_cart = subscribed = set()
+    if authenticated and 'is_favorited' in fields:
+        favorited = user_recipe_ids(Favorite, user, rows)
+    if authenticated and 'is_in_shopping_cart' in fields:
+        in_cart = user_recipe_ids(ShoppingCart, user, rows)
+    if authenticated and 'author' in expand:
+        subscribed = set(Subscription.objects.filter(
+            subscriber=user,
+            subscription_id__in={row['author_id'] for row in rows.values()}
+        ).values_list('subscription_id', flat=True))
+
+    image_storage = Recipe._meta.get_field('image').storage
+    avatar_storage = CustomUser._meta.get_field('avatar').storage
+
+    def author(row):
+        return {
+            'email': row['author__email'],
+            'id': row['author_id'],
+            'username': row['author__username'],
+            'first_name': row['author__first_name'],
+            'last_name': row['author__last_name'],
+            'is_subscribed': row['author_id'] in subscribed,
+            'avatar': file_url(
+                request, avatar_storage, row['author__avatar']),
+        }
+
+    builders = {
+        'id': lambda row: row['id'],
+        'tags': lambda row: tags.get(row['id'], []),
+        'author': (
+            author if 'author' in expand else lambda row: row['author_id']),
+        'ingredients': lambda row: ingredients.get(row['id'], []),
+        'is_favorited': lambda row: row['id'] in favorited,
+        'is_in_shopping_cart': lambda row: row['id'] in in_cart,
+        'name': lambda row: row['name'],
+        'image': lambda row: file_url(request, image_storage, row['image']),
+        'text': lambda row: row['text'],
+        'cooking_time': lambda row: row['cooking_time'],
+    }
+    output = [
+        (name, builders[name])
+        for name in RecipeSerializer.Meta.fields if name in fields]
+    return {
+        recipe_id: {name: build(rows[recipe_id]) for name, build in output}
+        for recipe_id in ids if recipe_id in rows}
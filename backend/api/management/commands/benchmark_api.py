@@ -0,0 +1,411 @@
+import json
+import os
+import statistics
+import tempfile
+import time
+from collections import namedtuple
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (
+    Favorite, Ingredient, IngredientRecipe, Recipe, ShoppingCart, Tag,
+    TagRecipe)
+from users.models import CustomUser, Subscription
+from ...changes import make_token
+from ...cookable import cookable_index
+from .generate_data import PASSWORD, PLACEHOLDER_IMAGE
+
+BUDGETS_FILE = os.path.normpath(os.path.join(
+    os.path.dirname(__file__), '../../benchmark_budgets.json'))
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg==')
+# Количество ингредиентов и тегов в рецептах, которые создаются
+# и изменяются при замерах, авторов в подписках и рецептов в избранном
+# пользователя, от которого выполняются запросы: бюджеты не зависят
+# от данных БД
+PAYLOAD_INGREDIENTS = 10
+PAYLOAD_TAGS = 2
+FOLLOWED_AUTHORS = 6
+FAVORITES = 10
+
+Endpoint = namedtuple(
+    'Endpoint', ('name', 'method', 'path', 'auth', 'data'),
+    defaults=(None,))
+
+
+class Command(BaseCommand):
+    """Команда для замера производительности эндпоинтов API
+    на текущих данных БД с проверкой бюджетов по количеству запросов
+    к БД и задержке"""
+
+    help = ('Замер задержки, количества запросов к БД и размера ответа '
+            'эндпоинтов API с проверкой бюджетов')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations', type=int, default=20,
+            help='Количество замеров на эндпоинт (по умолчанию 20)')
+        parser.add_argument(
+            '--warmup', type=int, default=2,
+            help='Количество прогревочных запросов (по умолчанию 2)')
+        parser.add_argument(
+            '--budgets', default=BUDGETS_FILE,
+            help='Файл с бюджетами (по умолчанию api/benchmark_budgets.json)')
+        parser.add_argument(
+            '--update-budgets', action='store_true',
+            help='Записать бюджеты по результатам текущего замера')
+        parser.add_argument(
+            '--latency-tolerance', type=float, default=1.0,
+            help='Множитель для бюджетов задержки: задержка зависит '
+                 'от машины, количество запросов — нет')
+        parser.add_argument(
+            '--only', nargs='+', default=(),
+            help='Замерить только перечисленные эндпоинты')
+        parser.add_argument(
+            '--output', help='Файл для сохранения результатов в JSON')
+
+    def handle(self, *args, **options):
+        # тестовые данные создаются в транзакции на основной БД,
+        # поэтому чтение с реплики отключается
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                MEDIA_ROOT=media_root, DATABASE_ROUTERS=[]):
+            with transaction.atomic():
+                results = self.run_benchmarks(options)
+                transaction.set_rollback(True)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+        if options['update_budgets']:
+            self.write_budgets(options['budgets'], results)
+            return
+        self.check_budgets(
+            options['budgets'], results, options['latency_tolerance'])
+
+    def setup_data(self):
+        """Подготовка пользователя и рецептов для запросов.
+        Изменения откатываются по завершении замеров"""
+
+        user_id = ShoppingCart.objects.values('user').annotate(
+            count=Count('id')).order_by('-count').values_list(
+            'user', flat=True).first()
+        user = CustomUser.objects.filter(id=user_id).first()
+        recipe = Recipe.objects.exclude(author=user).order_by('id').first()
+        if user is None or recipe is None:
+            raise CommandError(
+                'Недостаточно данных для замеров: выполните import_data '
+                'или generate_data.')
+        ingredient_ids = list(Ingredient.objects.order_by('id').values_list(
+            'id', flat=True)[:PAYLOAD_INGREDIENTS * 3 // 2])
+        tag_ids = list(Tag.objects.order_by('id').values_list(
+            'id', flat=True)[:PAYLOAD_TAGS * 3 // 2])
+        if (len(ingredient_ids) < PAYLOAD_INGREDIENTS * 3 // 2
+                or len(tag_ids) < PAYLOAD_TAGS * 3 // 2):
+            raise CommandError(
+                'Недостаточно ингредиентов или тегов для замеров.')
+        user.set_password(PASSWORD)
+        user.save(update_fields=('password',))
+        # рецепт пользователя отличается от данных запроса recipe_update
+        # половиной ингредиентов и тегов, поэтому изменение на любых данных
+        # удаляет, обновляет и добавляет одинаковое количество связей
+        own_recipe = Recipe.objects.create(
+            author=user, name='Бенчмарк', text='Рецепт для замеров',
+            cooking_time=10, image=PLACEHOLDER_IMAGE)
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe=own_recipe, ingredient_id=ingredient_id, amount=50)
+            for ingredient_id in ingredient_ids[PAYLOAD_INGREDIENTS // 2:])
+        TagRecipe.objects.bulk_create(
+            TagRecipe(recipe=own_recipe, tag_id=tag_id)
+            for tag_id in tag_ids[PAYLOAD_TAGS // 2:])
+        Favorite.objects.filter(user=user).delete()
+        Favorite.objects.bulk_create(
+            Favorite(user=user, recipe_id=recipe_id)
+            for recipe_id in [recipe.id, *Recipe.objects.exclude(
+                id__in=[recipe.id, own_recipe.id]).order_by('id').values_list(
+                'id', flat=True)[:FAVORITES - 1]])
+        ShoppingCart.objects.get_or_create(user=user, recipe=recipe)
+        Subscription.objects.filter(subscriber=user).delete()
+        authors = [recipe.author_id, *CustomUser.objects.filter(
+            recipe__isnull=False).exclude(
+            id__in=[user.id, recipe.author_id]).distinct().order_by(
+            'id').values_list('id', flat=True)[:FOLLOWED_AUTHORS - 1]]
+        for author_id in authors:
+            Subscription.objects.create(
+                subscriber=user, subscription_id=author_id)
+        other_author = CustomUser.objects.exclude(
+            id__in=[user.id, *authors]).order_by('id').first()
+        if other_author is None:
+            raise CommandError(
+                'Недостаточно пользователей для замеров: выполните '
+                'import_data или generate_data.')
+        # фоновое построение не увидело бы данных из транзакции замеров
+        cookable_index.build()
+        return {
+            'user': user,
+            'token': Token.objects.get_or_create(user=user)[0].key,
+            'recipe': recipe,
+            'own_recipe': own_recipe,
+            'ingredient_ids': ingredient_ids[:PAYLOAD_INGREDIENTS],
+            'tag_ids': tag_ids[:PAYLOAD_TAGS],
+            'other_author': other_author,
+            'tag': Tag.objects.first(),
+            'ingredient': recipe.ingredients.first(),
+            # последний id отсутствует в БД
+            'batch_ids': [
+                *Recipe.objects.values_list('id', flat=True)[:11], 0],
+            'cookable_ids': list(recipe.ingredientrecipe.values_list(
+                'ingredient_id', flat=True)),
+            'search': next(
+                (word for word in recipe.text.split() if len(word) > 3),
+                recipe.name),
+        }
+
+    def get_endpoints(self, data):
+        """Перечень эндпоинтов с параметрами запросов: все маршруты
+        api/urls.py, кроме скачивания профиля (нужен сохранённый профиль
+        cProfile) и потока событий /api/recipes/events/ (только ASGI,
+        ответ не завершается)"""
+
+        recipe, own_recipe = data['recipe'], data['own_recipe']
+        user, other_author = data['user'], data['other_author']
+        recipe_payload = {
+            'ingredients': [
+                {'id': ingredient_id, 'amount': 100}
+                for ingredient_id in data['ingredient_ids']],
+            'tags': data['tag_ids'],
+            'image': IMAGE,
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 15,
+        }
+        return [
+            Endpoint('users_list', 'get', reverse('api:users-list'), False),
+            Endpoint('users_list_auth', 'get', reverse('api:users-list'),
+                     True),
+            # количество запросов не должно зависеть от размера страницы
+            Endpoint('users_list_max_page', 'get',
+                     reverse('api:users-list')
+                     + f'?limit={settings.MAX_PAGE_SIZE}', True),
+            Endpoint('users_list_counters', 'get',
+                     reverse('api:users-list') + '?limit=20&fields=id,'
+                     'username,is_subscribed,recipes_count,followers_count',
+                     True),
+            Endpoint('users_detail', 'get',
+                     reverse('api:users-detail', args=[other_author.id]),
+                     True),
+            Endpoint('users_me', 'get', reverse('api:users-me'), True),
+            Endpoint('users_create', 'post', reverse('api:users-list'),
+                     False, {
+                         'email': 'benchmark@example.com',
+                         'username': 'benchmark', 'first_name': 'Имя',
+                         'last_name': 'Фамилия', 'password': PASSWORD}),
+            Endpoint('token_login', 'post', reverse('api:login'), False,
+                     {'email': user.email, 'password': PASSWORD}),
+            Endpoint('token_logout', 'post', reverse('api:logout'), True),
+            Endpoint('avatar_put', 'put', reverse('api:avatar'), True,
+                     {'avatar': IMAGE}),
+            Endpoint('avatar_delete', 'delete', reverse('api:avatar'), True),
+            Endpoint('subscriptions', 'get',
+                     reverse('api:subscriptions') + '?recipes_limit=3',
+                     True),
+            Endpoint('subscribe', 'post',
+                     reverse('api:subscribe', args=[other_author.id])
+                     + '?recipes_limit=3', True),
+            Endpoint('unsubscribe', 'delete',
+                     reverse('api:subscribe', args=[recipe.author_id]),
+                     True),
+            Endpoint('bootstrap', 'get', reverse('api:bootstrap'), True),
+            Endpoint('tags', 'get', reverse('api:tags'), False),
+            Endpoint('tag', 'get', reverse('api:tag', args=[data['tag'].id]),
+                     False),
+            Endpoint('ingredients', 'get', reverse('api:ingredients'),
+                     False),
+            Endpoint('ingredients_search', 'get',
+                     reverse('api:ingredients') + '?name=мо', False),
+            Endpoint('ingredient', 'get',
+                     reverse('api:ingredient',
+                             args=[data['ingredient'].id]), False),
+            Endpoint('recipes', 'get', reverse('api:recipes'), False),
+            Endpoint('recipes_auth', 'get', reverse('api:recipes'), True),
+            Endpoint('recipes_filtered', 'get',
+                     reverse('api:recipes') + '?tags={}&limit=6'.format(
+                         data['tag'].slug), True),
+            Endpoint('recipes_favorited', 'get',
+                     reverse('api:recipes') + '?is_favorited=1', True),
+            Endpoint('recipes_in_cart', 'get',
+                     reverse('api:recipes') + '?is_in_shopping_cart=1',
+                     True),
+            Endpoint('recipes_by_author', 'get',
+                     reverse('api:recipes') + f'?author={recipe.author_id}',
+                     False),
+            Endpoint('recipes_cards', 'get',
+                     reverse('api:recipes') + '?fields=id,name,image,'
+                     'cooking_time,is_favorited,is_in_shopping_cart', True),
+            Endpoint('recipes_batch', 'get',
+                     reverse('api:recipes_batch') + '?ids={}'.format(
+                         ','.join(map(str, data['batch_ids']))), True),
+            Endpoint('recipes_search', 'get',
+                     reverse('api:recipes') + '?' + urlencode(
+                         {'search': data['search']}), True),
+            Endpoint('recipes_cookable', 'get',
+                     reverse('api:recipes_cookable')
+                     + '?ingredients={}'.format(
+                         ','.join(map(str, data['cookable_ids']))), True),
+            Endpoint('recipes_changes', 'get',
+                     reverse('api:recipes_changes') + '?' + urlencode(
+                         {'since': make_token(
+                             since=timezone.now() - timedelta(days=1))}),
+                     True),
+            # избранное пользователя меньше одного пакета выгрузки
+            Endpoint('recipes_export', 'get',
+                     reverse('api:recipes_export') + '?is_favorited=1',
+                     True),
+            Endpoint('recipes_events_ticket', 'post',
+                     reverse('api:recipes_events_ticket'), True),
+            Endpoint('recipe_create', 'post', reverse('api:recipes'), True,
+                     recipe_payload),
+            Endpoint('recipe', 'get', reverse('api:recipe', args=[recipe.id]),
+                     False),
+            Endpoint('recipe_similar', 'get',
+                     reverse('api:recipe_similar', args=[recipe.id]), False),
+            Endpoint('recipe_auth', 'get',
+                     reverse('api:recipe', args=[recipe.id]), True),
+            Endpoint('recipe_update', 'patch',
+                     reverse('api:recipe', args=[own_recipe.id]), True,
+                     {**recipe_payload, 'name': 'Изменённый рецепт'}),
+            Endpoint('recipe_delete', 'delete',
+                     reverse('api:recipe', args=[own_recipe.id]), True),
+            Endpoint('get_short_link', 'get',
+                     reverse('api:get_short_link', args=[recipe.id]),
+                     False),
+            Endpoint('short_link_redirect', 'get',
+                     reverse('shortlink', args=[recipe.id]), False),
+            Endpoint('favorite_add', 'post',
+                     reverse('api:favorite', args=[own_recipe.id]), True),
+            Endpoint('favorite_delete', 'delete',
+                     reverse('api:favorite', args=[recipe.id]), True),
+            Endpoint('shopping_cart_add', 'post',
+                     reverse('api:shopping_cart', args=[own_recipe.id]),
+                     True),
+            Endpoint('shopping_cart_delete', 'delete',
+                     reverse('api:shopping_cart', args=[recipe.id]), True),
+            Endpoint('download_shopping_cart', 'get',
+                     reverse('api:download_shopping_cart_pdf'), True),
+        ]
+
+    def request(self, client, endpoint, token):
+        """Выполнение запроса в точке сохранения, которая откатывается,
+        чтобы изменяющие запросы можно было повторять"""
+
+        headers = {}
+        if endpoint.auth:
+            headers['HTTP_AUTHORIZATION'] = f'Token {token}'
+        with transaction.atomic():
+            response = getattr(client, endpoint.method)(
+                endpoint.path,
+                data=None if endpoint.data is None else json.dumps(
+                    endpoint.data),
+                content_type='application/json', **headers)
+            size = (
+                sum(len(chunk) for chunk in response.streaming_content)
+                if response.streaming else len(response.content))
+            transaction.set_rollback(True)
+        if response.status_code >= 400:
+            raise CommandError(
+                f'{endpoint.name}: {endpoint.method.upper()} '
+                f'{endpoint.path} вернул {response.status_code}: '
+                f'{response.content[:200]!r}')
+        return size
+
+    def run_benchmarks(self, options):
+        data = self.setup_data()
+        client = Client()
+        results = {}
+        for endpoint in self.get_endpoints(data):
+            if options['only'] and endpoint.name not in options['only']:
+                continue
+            for _ in range(options['warmup']):
+                self.request(client, endpoint, data['token'])
+            # журнал запросов очищается в начале каждого запроса
+            reset_queries()
+            with CaptureQueriesContext(connection) as queries:
+                size = self.request(client, endpoint, data['token'])
+            timings = []
+            for _ in range(options['iterations']):
+                start = time.perf_counter()
+                self.request(client, endpoint, data['token'])
+                timings.append((time.perf_counter() - start) * 1000)
+            percentiles = statistics.quantiles(
+                timings, n=100, method='inclusive')
+            results[endpoint.name] = {
+                'p50_ms': round(percentiles[49], 2),
+                'p95_ms': round(percentiles[94], 2),
+                # точки сохранения для отката не относятся к запросу
+                'queries': sum(
+                    1 for query in queries.captured_queries
+                    if 'SAVEPOINT' not in query['sql']),
+                'bytes': size,
+            }
+            self.stdout.write(
+                '{:<24} p50 {p50_ms:>9.2f} мс  p95 {p95_ms:>9.2f} мс  '
+                'запросов {queries:>5}  байт {bytes:>9}'.format(
+                    endpoint.name, **results[endpoint.name]))
+        return results
+
+    def write_budgets(self, path, results):
+        """Бюджеты: количество запросов — по замеру, задержка —
+        с двукратным запасом"""
+
+        budgets = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                budgets = json.load(f)
+        for name, result in results.items():
+            budgets[name] = {
+                'queries': result['queries'],
+                'p95_ms': round(result['p95_ms'] * 2, 1),
+            }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(budgets, f, indent=2, sort_keys=True)
+            f.write('\n')
+        self.stdout.write(self.style.SUCCESS(f'Бюджеты записаны в {path}'))
+
+    def check_budgets(self, path, results, latency_tolerance):
+        with open(path, encoding='utf-8') as f:
+            budgets = json.load(f)
+        failures = []
+        for name, result in results.items():
+            budget = budgets.get(name)
+            if budget is None:
+                failures.append(f'{name}: бюджет не задан')
+                continue
+            if result['queries'] > budget['queries']:
+                failures.append(
+                    f'{name}: запросов к БД {result["queries"]}, '
+                    f'бюджет {budget["queries"]}')
+            if result['p95_ms'] > budget['p95_ms'] * latency_tolerance:
+                failures.append(
+                    f'{name}: p95 {result["p95_ms"]} мс, '
+                    f'бюджет {budget["p95_ms"] * latency_tolerance} мс')
+            if 'bytes' in budget and result['bytes'] > budget['bytes']:
+                failures.append(
+                    f'{name}: размер ответа {result["bytes"]} байт, '
+                    f'бюджет {budget["bytes"]} байт')
+        if failures:
+            raise CommandError(
+                'Превышены бюджеты производительности:\n'
+                + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Все бюджеты соблюдены.'))
@@ -0,0 +1,226 @@
+import http.client
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from itertools import cycle, islice
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import Recipe
+
+SERVERS = {
+    'wsgi': ('foodgram.wsgi',),
+    'asgi': (
+        '--worker-class', 'uvicorn.workers.UvicornWorker',
+        'foodgram.asgi:application'),
+}
+STARTUP_TIMEOUT = 30
+
+
+class Command(BaseCommand):
+    """Команда для сравнения пропускной способности WSGI и ASGI
+    развёртываний: запускает gunicorn с синхронными воркерами и с
+    воркерами uvicorn на текущей БД и нагружает их заданным числом
+    одновременных соединений"""
+
+    help = ('Сравнение пропускной способности WSGI и ASGI при разном '
+            'количестве одновременных соединений')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--servers', nargs='+', choices=SERVERS, default=list(SERVERS),
+            help='Варианты развёртывания (по умолчанию wsgi и asgi)')
+        parser.add_argument(
+            '--workers', type=int, default=2,
+            help='Количество процессов gunicorn (по умолчанию 2)')
+        parser.add_argument(
+            '--concurrency', type=int, nargs='+', default=(1, 10, 50),
+            help='Количество одновременных соединений (по умолчанию '
+                 '1 10 50)')
+        parser.add_argument(
+            '--duration', type=float, default=10,
+            help='Длительность нагрузки на каждом уровне, с')
+        parser.add_argument(
+            '--port', type=int, default=8100,
+            help='Порт для запуска серверов (по умолчанию 8100)')
+        parser.add_argument(
+            '--path', action='append', dest='paths',
+            help='Адрес для нагрузки, можно указать несколько раз '
+                 '(по умолчанию основные GET-эндпоинты)')
+        parser.add_argument(
+            '--token', help='Токен для заголовка Authorization')
+        parser.add_argument(
+            '--output', help='Файл для сохранения результатов в JSON')
+
+    def handle(self, *args, **options):
+        paths = [
+            quote(path, safe='/?=&')
+            for path in options['paths'] or self.default_paths()]
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+
+        results = {}
+        for server in options['servers']:
+            results[server] = {}
+            with self.run_server(server, options):
+                for concurrency in options['concurrency']:
+                    result = self.load(
+                        options['port'], paths, headers, concurrency,
+                        options['duration'])
+                    results[server][concurrency] = result
+                    self.stdout.write(
+                        '{:<5} соединений {:>4}  {rps:>8.1f} запр/с  '
+                        'p50 {p50_ms:>8.2f} мс  p95 {p95_ms:>8.2f} мс  '
+                        'ошибок {errors}'.format(
+                            server, concurrency, **result))
+
+        if {'wsgi', 'asgi'} <= results.keys():
+            for concurrency in options['concurrency']:
+                wsgi = results['wsgi'][concurrency]['rps']
+                asgi = results['asgi'][concurrency]['rps']
+                self.stdout.write(self.style.SUCCESS(
+                    f'{concurrency} соединений: ASGI/WSGI '
+                    f'{asgi / wsgi if wsgi else 0:.2f}'))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+
+    def default_paths(self):
+        recipe_id = Recipe.objects.values_list('id', flat=True).first()
+        if recipe_id is None:
+            raise CommandError(
+                'В БД нет рецептов: заполните её командой generate_data.')
+        return [
+            '/api/recipes/', f'/api/recipes/{recipe_id}/', '/api/tags/',
+            '/api/ingredients/?name=мо']
+
+    def run_server(self, server, options):
+        """Запуск gunicorn в отдельном процессе. Журнал и метрики
+        Prometheus пишутся во временную директорию, чтобы не затронуть
+        метрики работающего сервера"""
+
+        command = [
+            sys.executable, '-m', 'gunicorn',
+            '--config', 'gunicorn.conf.py',
+            '--bind', f'127.0.0.1:{options["port"]}',
+            '--workers', str(options['workers']),
+            *SERVERS[server]]
+        directory = tempfile.mkdtemp()
+        env = {
+            **os.environ,
+            'ASYNC_VIEWS': str(int(server == 'asgi')),
+            'PROMETHEUS_MULTIPROC_DIR': os.path.join(directory, 'metrics'),
+            'PROFILING_SAMPLE_RATE': '0',
+        }
+        log = open(os.path.join(directory, 'server.log'), 'w+b')
+        process = subprocess.Popen(
+            command, cwd=settings.BASE_DIR, env=env,
+            stdout=log, stderr=subprocess.STDOUT)
+        return ServerProcess(process, options['port'], directory, log)
+
+    def load(self, port, paths, headers, concurrency, duration):
+        """Нагрузка: каждое соединение отправляет запросы по кругу
+        по адресам paths, пока не истечёт duration секунд"""
+
+        timings = []
+        errors = []
+        deadline = time.monotonic() + duration
+
+        def client(offset):
+            connection = http.client.HTTPConnection('127.0.0.1', port)
+            own_timings = []
+            own_errors = 0
+            for path in islice(cycle(paths), offset % len(paths), None):
+                if time.monotonic() >= deadline:
+                    break
+                start = time.perf_counter()
+                try:
+                    connection.request('GET', path, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                except (OSError, http.client.HTTPException):
+                    own_errors += 1
+                    connection.close()
+                    continue
+                own_timings.append((time.perf_counter() - start) * 1000)
+                if response.status >= 400:
+                    own_errors += 1
+            connection.close()
+            timings.extend(own_timings)
+            errors.append(own_errors)
+
+        threads = [
+            threading.Thread(target=client, args=(offset,))
+            for offset in range(concurrency)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+
+        if len(timings) < 2:
+            raise CommandError('Сервер не ответил ни на один запрос.')
+        percentiles = statistics.quantiles(
+            timings, n=100, method='inclusive')
+        return {
+            'rps': round(len(timings) / elapsed, 1),
+            'p50_ms': round(percentiles[49], 2),
+            'p95_ms': round(percentiles[94], 2),
+            'errors': sum(errors),
+        }
+
+
+class ServerProcess:
+    """Запущенный сервер: ожидание готовности при входе в контекст
+    и остановка при выходе"""
+
+    def __init__(self, process, port, directory, log):
+        self.process = process
+        self.port = port
+        self.directory = directory
+        self.log = log
+
+    def __enter__(self):
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                self.log.seek(0)
+                output = self.log.read().decode(errors='replace')
+                self.stop()
+                raise CommandError(f'Сервер завершился при запуске:\n{output}')
+            try:
+                connection = http.client.HTTPConnection(
+                    '127.0.0.1', self.port, timeout=1)
+                connection.request('GET', '/api/tags/')
+                connection.getresponse().read()
+                connection.close()
+                return self
+            except (OSError, http.client.HTTPException):
+                time.sleep(0.2)
+        self.stop()
+        raise CommandError(
+            f'Сервер не запустился за {STARTUP_TIMEOUT} с.')
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=STARTUP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.log.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
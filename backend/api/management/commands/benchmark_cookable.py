@@ -0,0 +1,100 @@
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...cookable import Ranking, Snapshot
+from .generate_data import ZipfSampler
+
+
+class Command(BaseCommand):
+    """Команда для замера поиска рецептов по ингредиентам на синтетическом
+    индексе: рецепты и их ингредиенты генерируются в памяти с тем же
+    распределением, что и у generate_data, поэтому БД не нужна.
+    Результат первого запроса каждого размера сверяется с полным
+    перебором"""
+
+    help = ('Замер поиска рецептов по имеющимся ингредиентам '
+            'на синтетическом индексе')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=1000000,
+            help='Количество рецептов (по умолчанию 1000000)')
+        parser.add_argument(
+            '--ingredients', type=int, default=2000,
+            help='Количество ингредиентов в справочнике (по умолчанию 2000)')
+        parser.add_argument(
+            '--query-sizes', type=int, nargs='+', default=[3, 10, 30],
+            help='Количество ингредиентов в поисковых запросах')
+        parser.add_argument(
+            '--queries', type=int, default=10,
+            help='Количество запросов каждого размера (по умолчанию 10)')
+        parser.add_argument('--zipf', type=float, default=1.1)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--output', help='Файл для сохранения результатов в JSON')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        ingredients = ZipfSampler(
+            range(1, options['ingredients'] + 1), options['zipf'], rng)
+        recipes = {
+            recipe_id: set(ingredients.sample_unique(
+                max(1, round(rng.lognormvariate(2, 0.4)))))
+            for recipe_id in range(1, options['recipes'] + 1)}
+
+        start = time.perf_counter()
+        snapshot = Snapshot(
+            (recipe_id, ingredient_id)
+            for recipe_id, recipe_ingredients in recipes.items()
+            for ingredient_id in recipe_ingredients)
+        results = {'build_s': round(time.perf_counter() - start, 2)}
+        self.stdout.write(
+            f'Индекс {len(recipes)} рецептов построен '
+            f'за {results["build_s"]} с')
+
+        for size in options['query_sizes']:
+            queries = [
+                frozenset(ingredients.sample_unique(size))
+                for _ in range(options['queries'])]
+            self.check_results(recipes, snapshot, queries[0])
+            samples = {'first_page': [], 'last_page': []}
+            for query in queries:
+                start = time.perf_counter()
+                ranking = Ranking(snapshot, {}, {}, query)
+                ranking[0:6]
+                samples['first_page'].append(time.perf_counter() - start)
+                start = time.perf_counter()
+                ranking = Ranking(snapshot, {}, {}, query)
+                ranking[len(ranking) - 6:len(ranking)]
+                samples['last_page'].append(time.perf_counter() - start)
+            name = f'ingredients_{size}'
+            results[name] = {
+                f'{key}_ms': round(statistics.median(values) * 1000, 1)
+                for key, values in samples.items()}
+            self.stdout.write(
+                '{:<16} первая страница {first_page_ms:>7.1f} мс  '
+                'последняя страница {last_page_ms:>7.1f} мс'.format(
+                    name, **results[name]))
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+
+    def check_results(self, recipes, snapshot, query):
+        expected = sorted(
+            ((len(recipe_ingredients & query) / len(recipe_ingredients),
+              recipe_id)
+             for recipe_id, recipe_ingredients in recipes.items()
+             if recipe_ingredients & query),
+            reverse=True)
+        ranking = Ranking(snapshot, {}, {}, query)
+        actual = [(coverage, recipe_id)
+                  for recipe_id, coverage in ranking[0:100]]
+        if len(ranking) != len(expected) or actual != expected[:100]:
+            raise CommandError(
+                'Результат поиска не совпадает с полным перебором '
+                f'для ингредиентов {sorted(query)}')
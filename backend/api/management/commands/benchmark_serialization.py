@@ -0,0 +1,144 @@
+import json
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import override_settings
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from recipes.models import Recipe
+from users.models import CustomUser
+from ...fast_serializers import serialize_recipes
+from ...serializers import RecipeSerializer
+
+# Варианты параметров запроса для проверки совпадения и замеров
+VARIANTS = {
+    'full': {},
+    'cards': {
+        'fields': 'id,name,image,cooking_time,is_favorited,'
+                  'is_in_shopping_cart'},
+    'ids': {'fields': 'id,tags,author,ingredients'},
+    'expanded': {'fields': 'id,name', 'expand': 'author,tags,ingredients'},
+}
+
+
+class Command(BaseCommand):
+    """Команда для сравнения вывода рецептов через RecipeSerializer
+    и через serialize_recipes: проверяет, что данные совпадают,
+    и замеряет время сериализации в микросекундах на рецепт"""
+
+    help = ('Проверка совпадения и замер скорости вывода рецептов '
+            'через RecipeSerializer и serialize_recipes')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=300,
+            help='Количество рецептов в замере (по умолчанию 300)')
+        parser.add_argument(
+            '--iterations', type=int, default=10,
+            help='Количество замеров на вариант (по умолчанию 10)')
+        parser.add_argument(
+            '--variants', nargs='+', choices=VARIANTS, default=list(VARIANTS),
+            help='Варианты параметров fields и expand')
+        parser.add_argument(
+            '--output', help='Файл для сохранения результатов в JSON')
+
+    def handle(self, *args, **options):
+        ids = list(Recipe.objects.values_list(
+            'id', flat=True)[:options['recipes']])
+        if not ids:
+            raise CommandError(
+                'В БД нет рецептов: заполните её командой generate_data.')
+        user = CustomUser.objects.annotate(
+            count=Count('favorite')).order_by('-count').first()
+
+        results = {}
+        with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for variant in options['variants']:
+                for auth, request_user in (
+                        ('anonymous', AnonymousUser()), ('user', user)):
+                    request = self.make_request(
+                        VARIANTS[variant], request_user)
+                    name = f'{variant}_{auth}'
+                    self.check_parity(name, ids, request)
+                    results[name] = self.measure(
+                        ids, request, options['iterations'])
+                    self.stdout.write(
+                        '{:<20} DRF {drf_us:>8.1f} мкс ({drf_queries:>3} '
+                        'запр.)  на объектах {drf_render_us:>8.1f} мкс  '
+                        'values() {fast_us:>8.1f} мкс ({fast_queries:>3} '
+                        'запр.)  ускорение {speedup:>5.1f}'.format(
+                            name, **results[name]))
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+
+    def make_request(self, params, user):
+        request = Request(APIRequestFactory().get('/api/recipes/', params))
+        request.user = user
+        return request
+
+    def serializer_data(self, ids, request):
+        recipes = RecipeSerializer.prepare_queryset(
+            Recipe.objects.filter(id__in=ids), request)
+        return self.render(ids, list(recipes), request)
+
+    def render(self, ids, recipes, request):
+        order = {recipe_id: index for index, recipe_id in enumerate(ids)}
+        recipes.sort(key=lambda recipe: order[recipe.id])
+        return RecipeSerializer(
+            recipes, many=True, context={'request': request}).data
+
+    def check_parity(self, name, ids, request):
+        expected = json.loads(json.dumps(self.serializer_data(ids, request)))
+        actual = json.loads(json.dumps(serialize_recipes(ids, request)))
+        for recipe, fast in zip(expected, actual):
+            if recipe != fast:
+                raise CommandError(
+                    f'{name}: данные рецепта {recipe.get("id")} не '
+                    f'совпадают:\n{recipe}\n{fast}')
+        if len(expected) != len(actual):
+            raise CommandError(
+                f'{name}: {len(expected)} рецептов через RecipeSerializer, '
+                f'{len(actual)} через serialize_recipes')
+
+    def measure(self, ids, request, iterations):
+        """Время на рецепт: полное (с запросами к БД) для обоих способов
+        и отдельно для RecipeSerializer на загруженных заранее объектах,
+        где остаются только запросы полей-методов"""
+
+        recipes = list(RecipeSerializer.prepare_queryset(
+            Recipe.objects.filter(id__in=ids), request))
+        timings = {
+            'drf': lambda: self.serializer_data(ids, request),
+            'drf_render': lambda: self.render(ids, recipes, request),
+            'fast': lambda: serialize_recipes(ids, request),
+        }
+        result = {}
+        queries = []
+
+        def count_query(execute, sql, *args):
+            queries.append(sql)
+            return execute(sql, *args)
+
+        for key, function in timings.items():
+            queries.clear()
+            with connection.execute_wrapper(count_query):
+                function()
+            samples = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                function()
+                samples.append((time.perf_counter() - start) * 1e6)
+            result[f'{key}_us'] = round(
+                statistics.median(samples) / len(ids), 1)
+            result[f'{key}_queries'] = len(queries)
+        result['speedup'] = round(result['drf_us'] / result['fast_us'], 1)
+        return result
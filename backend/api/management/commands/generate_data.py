@@ -0,0 +1,269 @@
+import csv
+import os
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from recipes.models import (
+    Favorite, Ingredient, IngredientRecipe, Recipe,
+    ShoppingCart, Tag, TagRecipe)
+from users.models import CustomUser, Subscription
+from ... import reference
+from ...cookable import cookable_index
+from ...counters import update_user_counters
+from ...search import search_index
+from .import_data import DATA_DIR
+
+PLACEHOLDER_IMAGE = 'recipes/images/generated.png'
+PASSWORD = 'foodgram789456123'
+
+
+class ZipfSampler:
+    """Выборка элементов с распределением Ципфа: вероятность выбрать
+    элемент с рангом k пропорциональна 1 / k ** exponent.
+    Ранги назначаются элементам в случайном порядке"""
+
+    def __init__(self, items, exponent, rng):
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.cum_weights = list(accumulate(
+            1 / rank ** exponent for rank in range(1, len(self.items) + 1)))
+        self.rng = rng
+
+    def sample(self, k):
+        return self.rng.choices(
+            self.items, cum_weights=self.cum_weights, k=k)
+
+    def sample_unique(self, k, exclude=None):
+        """Выборка не более k различных элементов"""
+
+        k = min(k, len(self.items) - (exclude is not None))
+        result = set()
+        for _ in range(10):
+            result.update(self.sample(2 * (k - len(result))))
+            result.discard(exclude)
+            if len(result) >= k:
+                break
+        return list(islice(result, k))
+
+
+class Command(BaseCommand):
+    """Команда для генерации синтетических данных для нагрузочного
+    тестирования: пользователей, рецептов, избранного, списков покупок
+    и подписок с распределением популярности по закону Ципфа"""
+
+    help = 'Генерация синтетических данных для нагрузочного тестирования'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=1000,
+            help='Количество пользователей (по умолчанию 1000)')
+        parser.add_argument(
+            '--recipes', type=int, default=10000,
+            help='Количество рецептов (по умолчанию 10000)')
+        parser.add_argument(
+            '--favorites', type=float, default=20,
+            help='Среднее количество избранных рецептов на пользователя')
+        parser.add_argument(
+            '--carts', type=float, default=5,
+            help='Среднее количество рецептов в списке покупок')
+        parser.add_argument(
+            '--subscriptions', type=float, default=10,
+            help='Среднее количество подписок на пользователя')
+        parser.add_argument(
+            '--zipf', type=float, default=1.1,
+            help='Показатель распределения Ципфа (по умолчанию 1.1)')
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Начальное значение генератора случайных чисел')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Количество записей в одном запросе к БД')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.zipf = options['zipf']
+        self.prefix = f'gen{options["seed"]}'
+        if CustomUser.objects.filter(
+                username__startswith=f'{self.prefix}_').exists():
+            raise CommandError(
+                f'Данные с seed {options["seed"]} уже сгенерированы.')
+
+        tag_ids, ingredient_ids = self.stage(
+            'справочники', self.load_reference_data)
+        user_ids = self.stage(
+            'пользователи', self.generate_users, options['users'])
+        authors = ZipfSampler(user_ids, self.zipf, self.rng)
+        recipe_ids = self.stage(
+            'рецепты', self.generate_recipes, options['recipes'],
+            authors, tag_ids, ingredient_ids)
+        # пакетная вставка не отправляет сигналы моделей
+        cookable_index.invalidate()
+        search_index.invalidate()
+        recipes = ZipfSampler(recipe_ids, self.zipf, self.rng)
+        self.stage(
+            'избранное', self.generate_user_recipes, Favorite,
+            user_ids, recipes, options['favorites'])
+        self.stage(
+            'списки покупок', self.generate_user_recipes, ShoppingCart,
+            user_ids, recipes, options['carts'])
+        self.stage(
+            'подписки', self.generate_subscriptions,
+            user_ids, authors, options['subscriptions'])
+        self.stage('счётчики пользователей', update_user_counters)
+        self.stdout.write(
+            self.style.SUCCESS('Генерация данных завершена.'))
+
+    def stage(self, name, function, *args):
+        """Выполнение этапа генерации в транзакции с замером времени"""
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            result = function(*args)
+        self.stdout.write(self.style.SUCCESS(
+            f'{name}: {time.perf_counter() - start:.2f} с'))
+        return result
+
+    def bulk_create(self, model, objects):
+        """Пакетная вставка объектов из итератора"""
+
+        while True:
+            batch = list(islice(objects, self.batch_size))
+            if not batch:
+                return
+            model.objects.bulk_create(batch, batch_size=self.batch_size)
+
+    def bulk_insert(self, model, fields, rows):
+        """Пакетная вставка кортежей значений без создания объектов
+        моделей: для таблиц на миллионы строк создание экземпляров
+        и компиляция запроса ORM занимают большую часть времени"""
+
+        fields = [model._meta.get_field(name) for name in fields]
+        batch_size = connection.ops.bulk_batch_size(
+            fields, range(self.batch_size)) or self.batch_size
+        qn = connection.ops.quote_name
+        insert = 'INSERT INTO {} ({}) VALUES '.format(
+            qn(model._meta.db_table),
+            ', '.join(qn(field.column) for field in fields))
+        placeholder = '({})'.format(', '.join(['%s'] * len(fields)))
+        with connection.cursor() as cursor:
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    return
+                cursor.execute(
+                    insert + ', '.join([placeholder] * len(batch)),
+                    [value for row in batch for value in row])
+
+    def activity(self, average):
+        """Количество действий пользователя: распределение Парето
+        со средним значением average"""
+
+        return int(average * self.rng.paretovariate(1.5) / 3)
+
+    def load_reference_data(self):
+        """Загрузка тегов и ингредиентов из CSV файлов, если они ещё
+        не импортированы, и словаря для текстов рецептов"""
+
+        for model, file_name in (
+                (Tag, 'tags.csv'), (Ingredient, 'ingredients.csv')):
+            if not model.objects.exists():
+                with open(
+                        os.path.join(DATA_DIR, file_name),
+                        encoding='utf-8', newline='') as csvfile:
+                    model.objects.bulk_create(
+                        [model(**row) for row in csv.DictReader(csvfile)],
+                        batch_size=self.batch_size)
+        reference.ingredient_ids.invalidate()
+        reference.tag_ids.invalidate()
+        with open(
+                os.path.join(DATA_DIR, 'recipes.csv'),
+                encoding='utf-8', newline='') as csvfile:
+            self.words = sorted({
+                word for row in csv.DictReader(csvfile)
+                for word in row['text'].split()})
+        if not default_storage.exists(PLACEHOLDER_IMAGE):
+            with open(os.path.join(
+                    DATA_DIR, 'images/recipes/recipe_1.png'), 'rb') as f:
+                default_storage.save(
+                    PLACEHOLDER_IMAGE, ContentFile(f.read()))
+        return (
+            list(Tag.objects.order_by('id').values_list('id', flat=True)),
+            list(Ingredient.objects.order_by('id').values_list(
+                'id', flat=True)))
+
+    def new_ids(self, model, last_id):
+        return list(model.objects.filter(id__gt=last_id).order_by(
+            'id').values_list('id', flat=True))
+
+    def last_id(self, model):
+        return model.objects.order_by('-id').values_list(
+            'id', flat=True).first() or 0
+
+    def generate_users(self, count):
+        last_id = self.last_id(CustomUser)
+        password = make_password(PASSWORD)
+        self.bulk_create(CustomUser, (
+            CustomUser(
+                email=f'{self.prefix}_{i}@example.com',
+                username=f'{self.prefix}_{i}',
+                first_name=f'Имя{i}', last_name=f'Фамилия{i}',
+                password=password)
+            for i in range(count)))
+        return self.new_ids(CustomUser, last_id)
+
+    def recipe_text(self):
+        return ' '.join(self.rng.choices(
+            self.words, k=self.rng.randint(30, 200)))
+
+    def generate_recipes(self, count, authors, tag_ids, ingredient_ids):
+        last_id = self.last_id(Recipe)
+        now = timezone.now()
+        self.bulk_insert(
+            Recipe,
+            ('author', 'name', 'text', 'image', 'cooking_time', 'pub_date',
+             'updated_at'),
+            # дата изменения совпадает с датой публикации
+            ((*row, row[-1]) for row in (
+                (author_id, f'Рецепт {i}', self.recipe_text(),
+                 PLACEHOLDER_IMAGE, self.rng.randint(5, 180),
+                 connection.ops.adapt_datetimefield_value(now - timedelta(
+                     seconds=self.rng.randint(0, 365 * 86400))))
+                for i, author_id in enumerate(authors.sample(count)))))
+        recipe_ids = self.new_ids(Recipe, last_id)
+
+        tags = ZipfSampler(tag_ids, self.zipf, self.rng)
+        ingredients = ZipfSampler(ingredient_ids, self.zipf, self.rng)
+        self.bulk_insert(TagRecipe, ('recipe', 'tag'), (
+            (recipe_id, tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in tags.sample_unique(self.rng.randint(1, 3))))
+        self.bulk_insert(
+            IngredientRecipe, ('recipe', 'ingredient', 'amount'), (
+                (recipe_id, ingredient_id, self.rng.randint(1, 1000))
+                for recipe_id in recipe_ids
+                for ingredient_id in ingredients.sample_unique(
+                    max(1, round(self.rng.lognormvariate(2, 0.4))))))
+        return recipe_ids
+
+    def generate_user_recipes(self, model, user_ids, recipes, average):
+        self.bulk_insert(model, ('user', 'recipe'), (
+            (user_id, recipe_id)
+            for user_id in user_ids
+            for recipe_id in recipes.sample_unique(self.activity(average))))
+
+    def generate_subscriptions(self, user_ids, authors, average):
+        self.bulk_insert(Subscription, ('subscriber', 'subscription'), (
+            (user_id, author_id)
+            for user_id in user_ids
+            for author_id in authors.sample_unique(
+                self.activity(average), exclude=user_id)))
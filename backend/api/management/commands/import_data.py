@@ -1,143 +1,441 @@
 import csv
+import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from itertools import islice
 
+import django
 from django.contrib.auth.hashers import make_password
 from django.core.files.base import ContentFile
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, DataError, IntegrityError, transaction
 
 from recipes.models import (
     Favorite, Ingredient, IngredientRecipe, Recipe,
     ShoppingCart, Tag, TagRecipe)
 from users.models import CustomUser, Subscription
+from ... import reference
+from ...cookable import cookable_index
+from ...counters import update_user_counters
+from ...search import search_index
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '../../../data')
+CHECKPOINT_FILE = '.import_checkpoint.json'
+PROGRESS_INTERVAL = 5
+
+# Ошибки в данных отдельной строки: такие строки откладываются
+# в файл отклонённых строк, импорт при этом продолжается
+ROW_ERRORS = (
+    KeyError, ValueError, TypeError, FileNotFoundError,
+    IntegrityError, DataError)
+
+
+def read_image(path):
+    """Чтение изображения в память в виде файла Django"""
+
+    with open(path, 'rb') as f:
+        return ContentFile(f.read(), name=os.path.basename(path))
 
 
 class Command(BaseCommand):
     """Команда для импорта данных из CSV файлов по указанной
     директории в определённые модели"""
 
-    def handle(self, *args, **kwargs):
+    help = 'Импорт тестовых данных из CSV файлов пакетными запросами'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--directory', default=DATA_DIR,
+            help='Директория с CSV файлами и изображениями '
+                 '(по умолчанию data/)')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество строк CSV файла, обрабатываемых за один '
+                 'запрос к БД (по умолчанию 1000)')
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Количество процессов для хеширования паролей и потоков '
+                 'для чтения изображений (по умолчанию 1)')
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Продолжить импорт с последней контрольной точки')
+        parser.add_argument(
+            '--checkpoint',
+            help='Файл контрольной точки (по умолчанию '
+                 f'{CHECKPOINT_FILE} в директории с данными)')
+
+    def handle(self, *args, **options):
+        with ExitStack() as stack:
+            self.start_workers(stack, options['workers'])
+            self.run_import(options)
+
+    def start_workers(self, stack, workers):
+        """Запуск пулов процессов и потоков для импорта.
+        При одном обработчике работа выполняется последовательно"""
+
+        self.workers = workers
+        self.process_pool = self.thread_pool = None
+        if workers > 1:
+            self.process_pool = stack.enter_context(ProcessPoolExecutor(
+                max_workers=workers, initializer=django.setup))
+            self.thread_pool = stack.enter_context(
+                ThreadPoolExecutor(max_workers=workers))
+
+    def run_import(self, options):
+        self.directory = options['directory']
+        self.batch_size = options['batch_size']
+        self.checkpoint = options['checkpoint'] or os.path.join(
+            self.directory, CHECKPOINT_FILE)
+        self.user_ids = {}
+        self.tag_ids = {}
+        self.ingredient_ids = {}
+        self.recipe_ids = {}
+
+        files = (
+            ('users.csv', self.import_users, self.map_users, CustomUser),
+            ('subscriptions.csv', self.import_subscriptions, None,
+             Subscription),
+            ('tags.csv', self.import_tags, self.map_tags, Tag),
+            ('ingredients.csv', self.import_ingredients,
+             self.map_ingredients, Ingredient),
+            ('recipes.csv', self.import_recipes, self.map_recipes, Recipe),
+            ('favorites.csv', self.import_favorites, None, Favorite),
+            ('shopping_cart.csv', self.import_shoppingcart, None,
+             ShoppingCart),
+        )
+        resume_file, resume_row = self.load_checkpoint(options['resume'])
+        if resume_file is None:
+            for file_name, *_ in files:
+                if os.path.exists(self.rejected_path(file_name)):
+                    os.remove(self.rejected_path(file_name))
+        completed = resume_file is not None
         try:
-            directory = os.path.join(
-                os.path.dirname(__file__), '../../../data')
-            os.chdir(directory)
-
-            self.import_data('users.csv', self.import_users)
-            self.import_data('subscriptions.csv', self.import_subscriptions)
-            self.import_data('tags.csv', self.import_tags)
-            self.import_data('ingredients.csv', self.import_ingredients)
-            self.import_data('recipes.csv', self.import_recipes)
-            self.import_data('favorites.csv', self.import_favorites)
-            self.import_data('shopping_cart.csv', self.import_shoppingcart)
+            for file_name, import_function, map_function, model in files:
+                if file_name == resume_file:
+                    completed = False
+                if completed:
+                    self.restore_ids(file_name, map_function)
+                    continue
+                self.import_data(
+                    file_name, import_function, map_function, model,
+                    resume_row if file_name == resume_file else 0)
+        except (OSError, DatabaseError) as e:
+            raise CommandError(
+                f'Произошла ошибка при импорте данных: {e}. Для продолжения '
+                'импорта запустите команду повторно с флагом --resume.')
+        finally:
+            # пакетная вставка не отправляет сигналы моделей
+            reference.ingredient_ids.invalidate()
+            reference.tag_ids.invalidate()
+            cookable_index.invalidate()
+            search_index.invalidate()
+            update_user_counters()
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
 
-            self.stdout.write(
-                self.style.SUCCESS('Импорт данных из CSV файлов завершен.'))
+        self.stdout.write(
+            self.style.SUCCESS('Импорт данных из CSV файлов завершен.'))
+
+    def load_checkpoint(self, resume):
+        """Чтение контрольной точки: файл и номер последней
+        обработанной строки"""
 
-        except Exception as e:
+        if not resume:
+            return None, 0
+        try:
+            with open(self.checkpoint, encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
             self.stdout.write(
-                self.style.ERROR(f'Произошла ошибка при импорте данных: {e}'))
+                'Контрольная точка не найдена, импорт начат с начала.')
+            return None, 0
+        self.stdout.write(
+            f'Продолжение импорта с файла {checkpoint["file"]}, '
+            f'строка {checkpoint["row"] + 1}.')
+        return checkpoint['file'], checkpoint['row']
+
+    def save_checkpoint(self, file_name, row):
+        """Атомарная запись контрольной точки после фиксации пакета"""
+
+        temp_path = f'{self.checkpoint}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'file': file_name, 'row': row}, f)
+        os.replace(temp_path, self.checkpoint)
+
+    def read_rows(self, file_name):
+        """Потоковое чтение CSV файла пакетами пронумерованных строк"""
 
-    def import_data(self, file_name, import_function):
-        """Общий метод для импорта данных из CSV файла"""
         with open(
-                file_name, mode='r', encoding='utf-8', newline='') as csvfile:
-            csv_reader = csv.DictReader(csvfile)
-            for row in csv_reader:
-                import_function(row)
+                os.path.join(self.directory, file_name),
+                mode='r', encoding='utf-8', newline='') as csvfile:
+            reader = csv.DictReader(csvfile)
+            rows = enumerate(reader, start=1)
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    return
+                yield reader.fieldnames, batch
+
+    def restore_ids(self, file_name, map_function):
+        """Восстановление соответствия идентификаторов для файла,
+        импортированного до контрольной точки"""
+
+        if map_function is None:
+            return
+        for _, batch in self.read_rows(file_name):
+            map_function(batch)
+
+    def import_data(
+            self, file_name, import_function, map_function, model,
+            skip_rows=0):
+        """Общий метод для потокового импорта данных из CSV файла:
+        каждый пакет строк фиксируется отдельной транзакцией, после
+        чего сохраняется контрольная точка"""
+
+        start = last_report = time.perf_counter()
+        count_before = model.objects.count()
+        rows_count = rejected = 0
+        for fieldnames, batch in self.read_rows(file_name):
+            done = [item for item in batch if item[0] <= skip_rows]
+            if done and map_function is not None:
+                map_function(done)
+            batch = batch[len(done):]
+            if not batch:
+                continue
+            rejected += self.import_batch(
+                file_name, fieldnames, import_function, batch)
+            self.save_checkpoint(file_name, batch[-1][0])
+            rows_count += len(batch)
+            if time.perf_counter() - last_report >= PROGRESS_INTERVAL:
+                last_report = time.perf_counter()
+                self.stdout.write(
+                    f'{file_name}: обработано строк — {rows_count} '
+                    f'({rows_count / (last_report - start):.0f} строк/с)')
+        self.log_result(
+            file_name, rows_count, model.objects.count() - count_before,
+            rejected, time.perf_counter() - start)
+
+    def import_batch(self, file_name, fieldnames, import_function, batch):
+        """Импорт пакета строк. При ошибке пакет повторяется построчно,
+        а строки с ошибками записываются в файл отклонённых строк.
+        Возвращает количество отклонённых строк"""
+
+        try:
+            with transaction.atomic():
+                import_function(batch)
+            return 0
+        except ROW_ERRORS:
+            pass
+        rejected = 0
+        for item in batch:
+            try:
+                with transaction.atomic():
+                    import_function([item])
+            except ROW_ERRORS as error:
+                self.reject(file_name, fieldnames, item, error)
+                rejected += 1
+        return rejected
+
+    def rejected_path(self, file_name):
+        return os.path.join(
+            os.path.dirname(self.checkpoint), f'{file_name}.rejected.csv')
+
+    def reject(self, file_name, fieldnames, item, error):
+        """Запись отклонённой строки с указанием номера и ошибки"""
+
+        path = self.rejected_path(file_name)
+        write_header = not os.path.exists(path)
+        with open(path, 'a', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(
+                f, fieldnames=['row', *fieldnames, 'error'])
+            if write_header:
+                writer.writeheader()
+            number, row = item
+            writer.writerow({
+                **row, 'row': number,
+                'error': f'{type(error).__name__}: {error}'})
 
-    def import_users(self, row):
+    def bulk_create(self, model, objects):
+        """Пакетная вставка объектов без учёта уже существующих записей"""
+
+        model.objects.bulk_create(
+            objects, batch_size=self.batch_size, ignore_conflicts=True)
+
+    def hash_passwords(self, passwords):
+        """Хеширование паролей, при наличии пула — в отдельных процессах"""
+
+        if self.process_pool is None:
+            return [make_password(password) for password in passwords]
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return list(self.process_pool.map(
+            make_password, passwords, chunksize=chunksize))
+
+    def read_images(self, folder, filenames):
+        """Предварительное чтение изображений из директории с тестовыми
+        данными, при наличии пула — в отдельных потоках.
+        Возвращает итератор, файлы читаются в фоне"""
+
+        paths = [
+            os.path.join(self.directory, 'images', folder, filename)
+            for filename in filenames]
+        if self.thread_pool is None:
+            return map(read_image, paths)
+        return self.thread_pool.map(read_image, paths)
+
+    def import_users(self, batch):
         """Импорт данных в модель CustomUser"""
 
-        password = make_password(row.get('password'))
-        avatar_filename = f'avatar_{row.get("id")}.png'
-        avatar_path = os.path.join(
-            os.path.dirname(__file__),
-            '../../../data/images/avatars',
-            avatar_filename)
-        with open(avatar_path, 'rb') as f:
-            avatar = ContentFile(f.read(), name=avatar_filename)
-        user, created = CustomUser.objects.get_or_create(
-            email=row['email'], username=row['username'],
-            first_name=row['first_name'], last_name=row['last_name'],
-            password=password, avatar=avatar)
-        self.log_result(user, created, 'пользователь')
-
-    def import_subscriptions(self, row):
+        existing = set(CustomUser.objects.filter(
+            email__in=[row['email'] for _, row in batch]
+        ).values_list('email', flat=True))
+        new_rows = [row for _, row in batch if row['email'] not in existing]
+        avatars = self.read_images(
+            'avatars', [f'avatar_{row["id"]}.png' for row in new_rows])
+        passwords = self.hash_passwords(
+            [row['password'] for row in new_rows])
+        self.bulk_create(CustomUser, [
+            CustomUser(
+                email=row['email'], username=row['username'],
+                first_name=row['first_name'], last_name=row['last_name'],
+                password=password, avatar=avatar)
+            for row, password, avatar in zip(new_rows, passwords, avatars)])
+        self.map_users(batch)
+        for _, row in batch:
+            if row['id'] not in self.user_ids:
+                raise IntegrityError(
+                    f'Пользователь {row["email"]} не добавлен: '
+                    'имя пользователя уже занято.')
+
+    def map_users(self, batch):
+        user_ids = dict(CustomUser.objects.filter(
+            email__in=[row['email'] for _, row in batch]
+        ).values_list('email', 'id'))
+        for _, row in batch:
+            if row['email'] in user_ids:
+                self.user_ids[row['id']] = user_ids[row['email']]
+
+    def import_subscriptions(self, batch):
         """Импорт данных в модель Subscription"""
 
-        for subscription_id in row['subscriptions'].split(','):
-            subscription, created = Subscription.objects.get_or_create(
-                subscription_id=subscription_id,
-                subscriber_id=row['subscriber'])
-        self.log_result(
-            subscription, created,
-            'перечень подписок для пользователя'
-            f' {CustomUser.objects.get(id=row["subscriber"]).username}')
-
-    def import_tags(self, row):
-        """Импорт данных в модель Tags"""
-
-        tag, created = Tag.objects.get_or_create(
-            name=row['name'], slug=row['slug'])
-        self.log_result(tag, created, 'тег')
-
-    def import_ingredients(self, row):
-        """Импорт данных в модель Ingredients"""
-
-        ingredient, created = Ingredient.objects.get_or_create(
-            name=row['name'], measurement_unit=row['measurement_unit'])
-        self.log_result(ingredient, created, 'ингредиент')
-
-    def import_recipes(self, row):
-        """Импорт данных в модель Recipes"""
-
-        image_filename = f'recipe_{row.get("id")}.png'
-        image_path = os.path.join(
-            os.path.dirname(__file__),
-            '../../../data/images/recipes',
-            image_filename)
-        with open(image_path, 'rb') as f:
-            image = ContentFile(f.read(), name=image_filename)
-        recipe, created = Recipe.objects.get_or_create(
-            image=image, name=row['name'], text=row['text'],
-            cooking_time=row['cooking_time'],
-            author=CustomUser.objects.get(id=row['author']))
-        ingredients_list = row['ingredients'].split(',')
-        for ingredient_info in ingredients_list:
-            ingredient_id, amount = ingredient_info.split(':')
-            ingredient = Ingredient.objects.get(id=ingredient_id)
-            IngredientRecipe.objects.get_or_create(
-                recipe=recipe, ingredient=ingredient, amount=amount)
-        for tag_id in row['tags'].split(','):
-            tag = Tag.objects.get(id=tag_id)
-            TagRecipe.objects.get_or_create(recipe=recipe, tag=tag)
-        self.log_result(recipe, created, 'рецепт')
-
-    def import_favorites(self, row):
+        self.bulk_create(Subscription, [
+            Subscription(
+                subscriber_id=self.user_ids[row['subscriber']],
+                subscription_id=self.user_ids[subscription_id])
+            for _, row in batch
+            for subscription_id in row['subscriptions'].split(',')])
+
+    def import_tags(self, batch):
+        """Импорт данных в модель Tag"""
+
+        self.bulk_create(Tag, [
+            Tag(name=row['name'], slug=row['slug']) for _, row in batch])
+        self.map_tags(batch)
+
+    def map_tags(self, batch):
+        numbers = {row['slug']: str(number) for number, row in batch}
+        for slug, tag_id in Tag.objects.filter(
+                slug__in=numbers).values_list('slug', 'id'):
+            self.tag_ids[numbers[slug]] = tag_id
+
+    def import_ingredients(self, batch):
+        """Импорт данных в модель Ingredient"""
+
+        self.bulk_create(Ingredient, [
+            Ingredient(
+                name=row['name'], measurement_unit=row['measurement_unit'])
+            for _, row in batch])
+        self.map_ingredients(batch)
+
+    def map_ingredients(self, batch):
+        numbers = {row['name']: str(number) for number, row in batch}
+        for name, ingredient_id in Ingredient.objects.filter(
+                name__in=numbers).values_list('name', 'id'):
+            self.ingredient_ids[numbers[name]] = ingredient_id
+
+    def get_recipe_ids(self, keys):
+        """Идентификаторы рецептов по паре (автор, название)"""
+
+        return {
+            (author_id, name): recipe_id
+            for author_id, name, recipe_id in Recipe.objects.filter(
+                author_id__in={author_id for author_id, _ in keys},
+                name__in={name for _, name in keys}
+            ).values_list('author_id', 'name', 'id')
+            if (author_id, name) in keys}
+
+    def import_recipes(self, batch):
+        """Импорт данных в модель Recipe и связанные с ней модели
+        IngredientRecipe и TagRecipe"""
+
+        rows = {
+            (self.user_ids[row['author']], row['name']): row
+            for _, row in batch}
+        existing = self.get_recipe_ids(rows)
+        new_rows = {
+            key: row for key, row in rows.items() if key not in existing}
+        images = self.read_images(
+            'recipes',
+            [f'recipe_{row["id"]}.png' for row in new_rows.values()])
+        self.bulk_create(Recipe, [
+            Recipe(
+                author_id=author_id, name=name, text=row['text'],
+                cooking_time=int(row['cooking_time']), image=image)
+            for ((author_id, name), row), image in zip(
+                new_rows.items(), images)])
+
+        recipe_ids = self.get_recipe_ids(rows)
+        ingredients, tags = [], []
+        for key, row in rows.items():
+            recipe_id = recipe_ids[key]
+            for ingredient_info in row['ingredients'].split(','):
+                ingredient_id, amount = ingredient_info.split(':')
+                ingredients.append(IngredientRecipe(
+                    recipe_id=recipe_id,
+                    ingredient_id=self.ingredient_ids[ingredient_id],
+                    amount=int(amount)))
+            for tag_id in row['tags'].split(','):
+                tags.append(TagRecipe(
+                    recipe_id=recipe_id, tag_id=self.tag_ids[tag_id]))
+        self.bulk_create(IngredientRecipe, ingredients)
+        self.bulk_create(TagRecipe, tags)
+        for key, row in rows.items():
+            self.recipe_ids[row['id']] = recipe_ids[key]
+
+    def map_recipes(self, batch):
+        rows = {
+            (self.user_ids[row['author']], row['name']): row
+            for _, row in batch if row['author'] in self.user_ids}
+        for key, recipe_id in self.get_recipe_ids(rows).items():
+            self.recipe_ids[rows[key]['id']] = recipe_id
+
+    def import_user_recipes(self, batch, model):
+        """Общий метод для импорта связей пользователя с рецептами"""
+
+        pairs = {
+            (self.user_ids[row['user']], self.recipe_ids[recipe_id])
+            for _, row in batch for recipe_id in row['recipes'].split(',')}
+        existing = set(model.objects.filter(
+            user_id__in={user_id for user_id, _ in pairs}
+        ).values_list('user_id', 'recipe_id'))
+        self.bulk_create(model, [
+            model(user_id=user_id, recipe_id=recipe_id)
+            for user_id, recipe_id in pairs - existing])
+
+    def import_favorites(self, batch):
         """Импорт данных в модель Favorite"""
 
-        for recipe_id in row['recipes'].split(','):
-            favorite, created = Favorite.objects.get_or_create(
-                recipe_id=recipe_id, user_id=row['user'])
-        self.log_result(
-            favorite, created,
-            'перечень рецептов в избранное для пользователя'
-            f' {CustomUser.objects.get(id=row["user"]).username}')
+        self.import_user_recipes(batch, Favorite)
 
-    def import_shoppingcart(self, row):
+    def import_shoppingcart(self, batch):
         """Импорт данных в модель ShoppingCart"""
 
-        for recipe_id in row['recipes'].split(','):
-            shopping_cart, created = ShoppingCart.objects.get_or_create(
-                recipe_id=recipe_id, user_id=row['user'])
-        self.log_result(
-            shopping_cart, created,
-            'список покупок для пользователя'
-            f' {CustomUser.objects.get(id=row["user"]).username}')
+        self.import_user_recipes(batch, ShoppingCart)
 
-    def log_result(self, obj, created, model_name):
-        if created:
-            self.stdout.write(
-                self.style.SUCCESS(f'Добавлен {model_name} "{obj}"'))
-        else:
-            self.stdout.write(
-                f'{model_name.capitalize()} "{obj}" уже существует!')
+    def log_result(self, file_name, rows_count, created, rejected, elapsed):
+        self.stdout.write(self.style.SUCCESS(
+            f'{file_name}: обработано строк — {rows_count}, '
+            f'добавлено записей — {created}, отклонено строк — {rejected} '
+            f'за {elapsed:.2f} с '
+            f'({rows_count / max(elapsed, 1e-6):.0f} строк/с)'))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...similar import update_similar_recipes
+
+
+class Command(BaseCommand):
+    """Команда для пересчёта таблицы похожих рецептов. По умолчанию
+    пересчитываются только списки, затронутые изменениями рецептов
+    с прошлого запуска, поэтому её можно запускать по расписанию"""
+
+    help = 'Пересчёт похожих рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Пересчитать списки всех рецептов, например после '
+                 'удаления ингредиентов или тегов')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        updated, extended = update_similar_recipes(
+            options['full'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано списков: {updated}, дополнено: {extended} '
+            f'за {time.perf_counter() - start:.2f} с'))
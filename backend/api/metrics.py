@@ -0,0 +1,61 @@
+import os
+
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,
+    Histogram, generate_latest, multiprocess)
+
+# Метрики сохраняются в общую директорию PROMETHEUS_MULTIPROC_DIR,
+# если она задана (gunicorn.conf.py), поэтому при нескольких процессах
+# gunicorn эндпоинт /metrics отдаёт сумму по всем процессам. Метрики без
+# меток создают файлы при импорте, поэтому директория создаётся заранее
+if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+REQUEST_DURATION = Histogram(
+    'foodgram_request_duration_seconds', 'Время обработки запроса',
+    ('view', 'method', 'status'))
+RESPONSE_SIZE = Histogram(
+    'foodgram_response_size_bytes', 'Размер тела ответа',
+    ('view', 'method'),
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304))
+DB_QUERIES = Histogram(
+    'foodgram_db_queries', 'Количество запросов к БД за запрос',
+    ('view',), buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500))
+DB_DURATION = Histogram(
+    'foodgram_db_duration_seconds', 'Время запросов к БД за запрос',
+    ('view',))
+TOKEN_CACHE_HITS = Counter(
+    'foodgram_token_cache_hits', 'Попадания в кэш токенов')
+TOKEN_CACHE_MISSES = Counter(
+    'foodgram_token_cache_misses', 'Промахи кэша токенов')
+DB_CONNECTIONS = Counter(
+    'foodgram_db_connections', 'Установленные соединения с БД', ('alias',))
+DB_CONNECTION_REUSES = Counter(
+    'foodgram_db_connection_reuses',
+    'Повторные использования открытых соединений с БД', ('alias',))
+DB_CONNECTION_WAIT = Histogram(
+    'foodgram_db_connection_wait_seconds',
+    'Время получения соединения с БД: подключение или ожидание в пуле',
+    ('alias',), buckets=(
+        0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+DB_CONNECTION_FAILURES = Counter(
+    'foodgram_db_connection_failures', 'Ошибки соединений с БД',
+    ('alias', 'stage'))
+EVENT_STREAMS = Gauge(
+    'foodgram_event_streams', 'Открытые потоки событий о новых рецептах',
+    multiprocess_mode='livesum')
+EVENTS_DROPPED = Counter(
+    'foodgram_events_dropped',
+    'События, отброшенные из-за переполнения очереди подключения')
+
+
+def metrics_view(request):
+    """Метрики в текстовом формате Prometheus"""
+
+    registry = REGISTRY
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(
+        generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
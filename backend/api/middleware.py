@@ -0,0 +1,320 @@
+import asyncio
+import cProfile
+import logging
+import os
+import random
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .metrics import DB_DURATION, DB_QUERIES, REQUEST_DURATION, RESPONSE_SIZE
+from .profiling import is_staff, save_profile, summarize
+from .routers import read_from_replica, replica_enabled
+
+logger = logging.getLogger('foodgram.db')
+
+
+class QueryMetrics:
+    """Обёртка выполнения запросов к БД, подсчитывающая их количество
+    и суммарное время"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+# Обёртки выполнения запросов текущего запроса к API. ContextVar
+# передаётся в потоки sync_to_async, поэтому при ASGI учитываются
+# и запросы к БД из асинхронных представлений
+query_wrappers = ContextVar('query_wrappers', default=())
+
+
+def run_wrappers(execute, sql, params, many, context):
+    for wrapper in reversed(query_wrappers.get()):
+        execute = partial(wrapper, execute)
+    return execute(sql, params, many, context)
+
+
+def install_wrapper(connection, **kwargs):
+    if run_wrappers not in connection.execute_wrappers:
+        connection.execute_wrappers.append(run_wrappers)
+
+
+connection_created.connect(install_wrapper)
+
+
+@contextmanager
+def track_queries(queries):
+    """Подключение обёртки к соединениям с БД во всех потоках,
+    выполняющих текущий запрос к API"""
+
+    for connection in connections.all():
+        install_wrapper(connection)
+    token = query_wrappers.set((*query_wrappers.get(), queries))
+    try:
+        yield
+    finally:
+        query_wrappers.reset(token)
+
+
+class AsyncCapableMiddleware:
+    """Основа промежуточного слоя, работающего и при WSGI, и при ASGI:
+    если следующий обработчик асинхронный, вызов экземпляра возвращает
+    корутину __acall__"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # признак, по которому Django распознаёт асинхронный обработчик
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.handle(request)
+
+
+def view_name(request):
+    match = request.resolver_match
+    return match.view_name if match else request.path
+
+
+def call_site():
+    """Ближайший к месту выполнения запроса кадр стека из кода проекта"""
+
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if (filename.startswith(str(settings.BASE_DIR))
+                and filename != __file__
+                and 'site-packages' not in filename):
+            return (
+                f'{os.path.relpath(filename, settings.BASE_DIR)}:'
+                f'{frame.f_lineno} in {frame.f_code.co_name}')
+        frame = frame.f_back
+    return 'вне кода проекта'
+
+
+class QueryLog:
+    """Обёртка выполнения запросов к БД: журналирует медленные запросы
+    и подсчитывает повторы одинаковых запросов для поиска проблемы N+1.
+    Запросы журналируются без параметров"""
+
+    def __init__(self, request):
+        self.request = request
+        self.repeats = Counter()
+        self.call_sites = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            self.repeats[sql] += 1
+            if self.repeats[sql] == settings.N_PLUS_ONE_THRESHOLD:
+                self.call_sites[sql] = call_site()
+            if duration >= settings.SLOW_QUERY_THRESHOLD_MS:
+                logger.warning(
+                    'Медленный запрос %.1f мс в %s (%s): %s', duration,
+                    view_name(self.request), call_site(), sql)
+
+    def report(self):
+        for sql, count in self.repeats.items():
+            if count >= settings.N_PLUS_ONE_THRESHOLD:
+                logger.warning(
+                    'Возможная проблема N+1: запрос выполнен %d раз в %s '
+                    '(%s): %s', count, view_name(self.request),
+                    self.call_sites[sql], sql)
+
+
+class QueryLogMiddleware(AsyncCapableMiddleware):
+    """Журнал медленных запросов к БД и повторяющихся в рамках одного
+    запроса к API обращений к БД с указанием представления
+    и места вызова в коде проекта"""
+
+    def handle(self, request):
+        if not settings.QUERY_LOG:
+            return self.get_response(request)
+        queries = QueryLog(request)
+        with track_queries(queries):
+            response = self.get_response(request)
+        queries.report()
+        return response
+
+    async def __acall__(self, request):
+        if not settings.QUERY_LOG:
+            return await self.get_response(request)
+        queries = QueryLog(request)
+        with track_queries(queries):
+            response = await self.get_response(request)
+        queries.report()
+        return response
+
+
+class MetricsMiddleware(AsyncCapableMiddleware):
+    """Сбор метрик по каждому маршруту: время обработки, количество
+    и время запросов к БД, размер и статус ответа"""
+
+    def handle(self, request):
+        queries = QueryMetrics()
+        start = time.perf_counter()
+        with track_queries(queries):
+            response = self.get_response(request)
+        return self.process_response(request, response, queries, start)
+
+    async def __acall__(self, request):
+        queries = QueryMetrics()
+        start = time.perf_counter()
+        with track_queries(queries):
+            response = await self.get_response(request)
+        return self.process_response(request, response, queries, start)
+
+    def process_response(self, request, response, queries, start):
+        if getattr(response, 'is_async', False):
+            response.streaming_content = self.astream(
+                request, response, response.streaming_content, queries,
+                start)
+        elif response.streaming:
+            response.streaming_content = self.stream(
+                request, response, response.streaming_content, queries,
+                start)
+        else:
+            self.observe(
+                request, response, queries, start, len(response.content))
+        return response
+
+    def stream(self, request, response, content, queries, start):
+        """Потоковый ответ учитывается после отправки последнего фрагмента:
+        запросы к БД выполняются в процессе формирования ответа"""
+
+        size = 0
+        with track_queries(queries):
+            for chunk in content:
+                size += len(chunk)
+                yield chunk
+        self.observe(request, response, queries, start, size)
+
+    async def astream(self, request, response, content, queries, start):
+        size = 0
+        with track_queries(queries):
+            async for chunk in content:
+                size += len(chunk)
+                yield chunk
+        self.observe(request, response, queries, start, size)
+
+    def observe(self, request, response, queries, start, size):
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        REQUEST_DURATION.labels(
+            view, request.method, response.status_code).observe(
+            time.perf_counter() - start)
+        RESPONSE_SIZE.labels(view, request.method).observe(size)
+        DB_QUERIES.labels(view).observe(queries.count)
+        DB_DURATION.labels(view).observe(queries.duration)
+
+
+class ProfilingMiddleware(AsyncCapableMiddleware):
+    """Профилирование запроса через cProfile по флагу ?profile=1
+    (только для персонала) или для доли случайных запросов
+    PROFILING_SAMPLE_RATE. Профиль сохраняется для скачивания,
+    а по флагу в ответ добавляются заголовки X-Profile-Id
+    и X-Profile-Summary.
+
+    При ASGI запрос обрабатывается в нескольких потоках, а cProfile
+    видит только свой поток, поэтому профилирование выполняется
+    только при WSGI"""
+
+    def handle(self, request):
+        requested = (
+            request.GET.get('profile') == '1' and is_staff(request))
+        if not requested and (
+                random.random() >= settings.PROFILING_SAMPLE_RATE):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        queries = QueryMetrics()
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+        except ValueError:
+            # в процессе уже работает другой профилировщик
+            return self.get_response(request)
+        try:
+            with track_queries(queries):
+                response = self.get_response(request)
+        finally:
+            profiler.disable()
+        total = time.perf_counter() - start
+
+        profile_id = save_profile(profiler)
+        if requested:
+            response['X-Profile-Id'] = profile_id
+            response['X-Profile-Summary'] = summarize(
+                profiler, total, queries)
+        return response
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+
+class ReplicaRoutingMiddleware(AsyncCapableMiddleware):
+    """Направление чтения в безопасных (GET, HEAD, OPTIONS) запросах
+    на реплику БД. После успешного изменяющего запроса клиент получает
+    cookie, и на REPLICA_PIN_SECONDS его запросы обслуживает основная БД,
+    чтобы он видел собственные изменения несмотря на отставание реплики"""
+
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def handle(self, request):
+        if not replica_enabled():
+            return self.get_response(request)
+        token = read_from_replica.set(self.replica_readable(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            read_from_replica.reset(token)
+        return self.pin_primary(request, response)
+
+    async def __acall__(self, request):
+        if not replica_enabled():
+            return await self.get_response(request)
+        token = read_from_replica.set(self.replica_readable(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            read_from_replica.reset(token)
+        return self.pin_primary(request, response)
+
+    def replica_readable(self, request):
+        return (
+            request.method in self.safe_methods
+            and settings.REPLICA_PIN_COOKIE not in request.COOKIES)
+
+    def pin_primary(self, request, response):
+        if (request.method not in self.safe_methods
+                and response.status_code < 400):
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS, httponly=True,
+                samesite='Lax')
+        return response
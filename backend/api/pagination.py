@@ -0,0 +1,27 @@
+from django.conf import settings
+from rest_framework.pagination import (
+    LimitOffsetPagination, PageNumberPagination)
+
+from .counters import user_count
+
+
+class LimitPageNumberPagination(PageNumberPagination):
+    """Постраничный вывод с размером страницы из параметра limit,
+    ограниченным MAX_PAGE_SIZE. Для выгрузки большего количества
+    объектов предназначены потоковые эндпоинты"""
+
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = settings.MAX_PAGE_SIZE
+
+
+class UserLimitOffsetPagination(LimitOffsetPagination):
+    """Постраничный вывод пользователей по параметрам limit и offset
+    с размером страницы, ограниченным MAX_PAGE_SIZE. Список
+    пользователей не фильтруется, поэтому их количество берётся
+    из кэша, а не считается запросом по всей таблице"""
+
+    max_limit = settings.MAX_PAGE_SIZE
+
+    def get_count(self, queryset):
+        return user_count.get()
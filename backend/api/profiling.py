@@ -0,0 +1,61 @@
+import os
+import pstats
+import uuid
+
+from django.conf import settings
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+
+def is_staff(request):
+    """Проверка прав персонала до вызова представления: по сессии
+    или по токену из заголовка Authorization"""
+
+    if request.user.is_staff:
+        return True
+    drf_request = Request(request, authenticators=[
+        authentication()
+        for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        return drf_request.user.is_staff
+    except APIException:
+        return False
+
+
+def profile_path(profile_id):
+    return os.path.join(settings.PROFILING_DIR, f'{profile_id}.prof')
+
+
+def save_profile(profiler):
+    """Сохранение профиля в PROFILING_DIR с удалением самых старых
+    профилей сверх PROFILING_MAX_FILES. Возвращает идентификатор"""
+
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    profile_id = str(uuid.uuid4())
+    profiler.dump_stats(profile_path(profile_id))
+    profiles = sorted(
+        (entry for entry in os.scandir(settings.PROFILING_DIR)
+         if entry.name.endswith('.prof')),
+        key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in profiles[settings.PROFILING_MAX_FILES:]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+    return profile_id
+
+
+def summarize(profiler, total, queries):
+    """Краткая сводка для заголовка ответа: общее время, запросы к БД
+    и функция с наибольшим собственным временем"""
+
+    stats = pstats.Stats(profiler).stats
+    (filename, line, function), (*_, own_time, _, _) = max(
+        stats.items(), key=lambda item: item[1][2])
+    if filename != '~':
+        function = f'{os.path.basename(filename)}:{line}({function})'
+    return (
+        f'total={total * 1000:.1f}ms; '
+        f'db={queries.count} queries/{queries.duration * 1000:.1f}ms; '
+        f'top={function} {own_time * 1000:.1f}ms')
@@ -0,0 +1,64 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from recipes.models import Ingredient, Tag
+
+
+class ReferenceIds:
+    """Кэш множества id справочной модели для проверки ссылок без
+    запросов к БД. Номер версии хранится в кэше Django и увеличивается
+    при изменении модели: с общим для процессов кэшем сброс виден всем
+    процессам сразу, с локальным — остальные перечитают множество
+    по истечении REFERENCE_IDS_TTL. Поэтому id, которых нет в множестве,
+    перед отказом перепроверяются в БД"""
+
+    def __init__(self, model):
+        self.model = model
+        self.version_key = f'reference_ids:{model._meta.label_lower}'
+        self.ids = None
+        self.version = None
+        self.expires = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        version = cache.get(self.version_key, 0)
+        with self.lock:
+            if (self.ids is None or version != self.version
+                    or self.expires < time.monotonic()):
+                self.ids = self.load()
+                self.version = version
+                self.expires = time.monotonic() + settings.REFERENCE_IDS_TTL
+            return self.ids
+
+    def contains(self, ids):
+        """Проверка, что все id есть в БД. Запрос выполняется, только если
+        каких-то id нет в кэшированном множестве: если они нашлись,
+        множество устарело и перечитывается"""
+        missing = set(ids) - self.get()
+        if not missing:
+            return True
+        found = set(self.model.objects.filter(
+            id__in=missing).values_list('id', flat=True))
+        if found:
+            self.expire()
+        return missing <= found
+
+    def expire(self):
+        """Множество перечитывается при следующем обращении"""
+
+        with self.lock:
+            self.expires = 0
+
+    def load(self):
+        return frozenset(self.model.objects.values_list('id', flat=True))
+
+    def invalidate(self):
+        cache.add(self.version_key, 0, timeout=None)
+        cache.incr(self.version_key)
+
+
+ingredient_ids = ReferenceIds(Ingredient)
+tag_ids = ReferenceIds(Tag)
@@ -0,0 +1,60 @@
+from contextvars import ContextVar
+
+from django.conf import settings
+
+REPLICA = 'replica'
+PRIMARY = 'default'
+
+# Разрешено ли читать с реплики в текущем запросе. ContextVar вместо
+# threading.local: значение изолировано и для потоков, и для корутин
+read_from_replica = ContextVar('read_from_replica', default=False)
+
+
+def replica_enabled():
+    return settings.REPLICA_ROUTING and REPLICA in settings.DATABASES
+
+
+def keep_routing(iterable):
+    """Перебор iterable с выбором БД для чтения текущего запроса.
+    Потоковый ответ перебирается после выхода из ReplicaRoutingMiddleware,
+    которое уже сбросило флаг, поэтому он устанавливается на время
+    вычисления каждого элемента"""
+
+    replica = read_from_replica.get()
+    iterator = iter(iterable)
+    done = object()
+
+    def items():
+        while True:
+            token = read_from_replica.set(replica)
+            try:
+                item = next(iterator, done)
+            finally:
+                read_from_replica.reset(token)
+            if item is done:
+                return
+            yield item
+    return items()
+
+
+class ReplicaRouter:
+    """Маршрутизатор БД: чтение в запросах, помеченных промежуточным
+    слоем ReplicaRoutingMiddleware, выполняется на реплике, всё
+    остальное, включая запись, на основной БД. После первой записи
+    чтение до конца запроса тоже идёт на основную БД"""
+
+    def db_for_read(self, model, **hints):
+        if read_from_replica.get():
+            return REPLICA
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        read_from_replica.set(False)
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплика содержит те же данные, что и основная БД
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
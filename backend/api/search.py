@@ -0,0 +1,273 @@
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F
+
+from recipes.models import Recipe
+from .cookable import OVERLAY_LIMIT, REBUILD, ChangeLog
+
+# Конфигурация полнотекстового поиска PostgreSQL, как у триггера,
+# заполняющего Recipe.search_vector (миграция recipes 0004)
+SEARCH_CONFIG = 'russian'
+# Веса вхождений слова в название и описание в том же отношении, что
+# и у весов A и B (1 и 0.4) в ts_rank PostgreSQL; целые веса складываются
+# без ошибок округления, поэтому равные ранги не различаются
+NAME_WEIGHT = 5
+TEXT_WEIGHT = 2
+
+VOWELS = 'аеиоуыэюя'
+# Окончания стеммера Snowball для русского языка: окончания первой
+# группы удаляются, только если перед ними стоит «а» или «я»
+PERFECTIVE_GERUND = (
+    ('в', 'вши', 'вшись'),
+    ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'))
+ADJECTIVE = ((), (
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем',
+    'им', 'ым', 'ом', 'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю',
+    'ая', 'яя', 'ою', 'ею'))
+PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+REFLEXIVE = ((), ('ся', 'сь'))
+VERB = (
+    ('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет',
+     'ют', 'ны', 'ть', 'ешь', 'нно'),
+    ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй',
+     'ил', 'ыл', 'им', 'ым', 'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют',
+     'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'))
+NOUN = ((), (
+    'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и',
+    'ией', 'ей', 'ой', 'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о',
+    'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия', 'ья', 'я'))
+# Стоп-слова словаря russian PostgreSQL (списка Snowball)
+STOP_WORDS = frozenset('''
+    и в во не что он на я с со как а то все она так его но да ты к у же вы
+    за бы по только ее мне было вот от меня еще нет о из ему теперь когда
+    даже ну вдруг ли если уже или ни быть был него до вас нибудь опять уж
+    вам ведь там потом себя ничего ей может они тут где есть надо ней для
+    мы тебя их чем была сам чтоб без будто чего раз тоже себе под будет ж
+    тогда кто этот того потому этого какой совсем ним здесь этом один
+    почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при
+    наконец два об другой хоть после над больше тот через эти нас про
+    всего них какая много разве три эту моя впрочем хорошо свою этой
+    перед иногда лучше чуть том нельзя такой им более всегда конечно всю
+    между
+'''.split())
+WORD = re.compile(r'\w+')
+
+
+def remove_ending(word, endings):
+    """Слово без самого длинного из окончаний endings или None,
+    если окончания нет или перед окончанием первой группы нет «а»/«я»"""
+
+    after_a, plain = endings
+    ending = max(
+        (ending for ending in after_a + plain if word.endswith(ending)),
+        key=len, default=None)
+    if ending is None:
+        return None
+    stem = word[:-len(ending)]
+    if ending in plain or stem.endswith(('а', 'я')):
+        return stem
+    return None
+
+
+def adjectival(word):
+    stem = remove_ending(word, ADJECTIVE)
+    if stem is None:
+        return None
+    participle = remove_ending(stem, PARTICIPLE)
+    return stem if participle is None else participle
+
+
+def stem(word):
+    """Основа слова по стеммеру Snowball для русского языка,
+    который использует словарь russian PostgreSQL"""
+
+    word = word.replace('ё', 'е')
+    # окончания ищутся в области RV — после первой гласной
+    rv = next(
+        (index + 1 for index, char in enumerate(word) if char in VOWELS),
+        len(word))
+    # R2 нужна для словообразовательных суффиксов
+    r2 = len(word)
+    boundaries = [
+        index + 1 for index in range(1, len(word))
+        if word[index - 1] in VOWELS and word[index] not in VOWELS]
+    if len(boundaries) > 1:
+        r2 = boundaries[1]
+    head, word = word[:rv], word[rv:]
+
+    result = remove_ending(word, PERFECTIVE_GERUND)
+    if result is None:
+        reflexive = remove_ending(word, REFLEXIVE)
+        if reflexive is not None:
+            word = reflexive
+        for step in (
+                adjectival, lambda word: remove_ending(word, VERB),
+                lambda word: remove_ending(word, NOUN)):
+            result = step(word)
+            if result is not None:
+                break
+    if result is not None:
+        word = result
+
+    if word.endswith('и'):
+        word = word[:-1]
+    for suffix in ('ость', 'ост'):
+        if word.endswith(suffix) and len(head) + len(word) - len(
+                suffix) >= r2:
+            word = word[:-len(suffix)]
+            break
+    if word.endswith(('ейше', 'ейш')):
+        word = word[:word.rindex('ейш')]
+        if word.endswith('нн'):
+            word = word[:-1]
+    elif word.endswith('нн'):
+        word = word[:-1]
+    elif word.endswith('ь'):
+        word = word[:-1]
+    return head + word
+
+
+def terms(text):
+    """Основы слов текста без стоп-слов"""
+
+    return [
+        stem(word) for word in WORD.findall(text.lower().replace('ё', 'е'))
+        if word not in STOP_WORDS]
+
+
+def weights(name, text):
+    """Словарь основа слова -> вес для рецепта"""
+
+    result = defaultdict(int)
+    for term in terms(name):
+        result[term] += NAME_WEIGHT
+    for term in terms(text):
+        result[term] += TEXT_WEIGHT
+    return result
+
+
+class RecipeSearchIndex:
+    """Инвертированный индекс основа слова -> {id рецепта: вес} для поиска
+    по названию и описанию рецептов в БД без полнотекстового поиска
+    (SQLite). Строится в процессе при первом поиске, а изменённые рецепты
+    обновляются в индексе по журналу изменений в кэше Django, как
+    в CookableIndex. При потере журнала или большом количестве изменений
+    индекс строится заново; с локальным кэшем изменения из других
+    процессов становятся видны по истечении REFERENCE_IDS_TTL"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = None
+        # основы слов каждого рецепта для удаления из индекса
+        self.recipe_terms = {}
+        self.version = 0
+        self.expires = 0
+        self.changes = ChangeLog('search_index')
+
+    def get(self):
+        version = self.changes.version()
+        with self.lock:
+            if (self.postings is None or self.expires < time.monotonic()
+                    or version < self.version
+                    or version - self.version > OVERLAY_LIMIT):
+                self.load(version)
+            elif version > self.version:
+                applied = self.changes.read(self.version, version)
+                if applied is None or REBUILD in applied:
+                    self.load(version)
+                elif applied:
+                    self.apply(set(applied))
+                    self.version += len(applied)
+            return self.postings
+
+    def load(self, version):
+        postings = defaultdict(dict)
+        self.recipe_terms = {}
+        for recipe_id, name, text in Recipe.objects.values_list(
+                'id', 'name', 'text').iterator(chunk_size=2000):
+            recipe_weights = weights(name, text)
+            for term, weight in recipe_weights.items():
+                postings[term][recipe_id] = weight
+            self.recipe_terms[recipe_id] = tuple(recipe_weights)
+        self.postings = dict(postings)
+        self.version = version
+        self.changes.gap_since = None
+        self.expires = time.monotonic() + settings.REFERENCE_IDS_TTL
+
+    def apply(self, recipe_ids):
+        """Замена весов изменённых рецептов текущими из БД. Списки
+        рецептов по основам заменяются копиями: их могут читать текущие
+        поиски"""
+
+        changed = {
+            recipe_id: weights(name, text)
+            for recipe_id, name, text in Recipe.objects.filter(
+                id__in=recipe_ids).values_list('id', 'name', 'text')}
+        for recipe_id in recipe_ids:
+            recipe_weights = changed.get(recipe_id, {})
+            for term in {*self.recipe_terms.pop(recipe_id, ()),
+                         *recipe_weights}:
+                posting = dict(self.postings.get(term, {}))
+                posting.pop(recipe_id, None)
+                if term in recipe_weights:
+                    posting[recipe_id] = recipe_weights[term]
+                if posting:
+                    self.postings[term] = posting
+                else:
+                    self.postings.pop(term, None)
+            if recipe_weights:
+                self.recipe_terms[recipe_id] = tuple(recipe_weights)
+
+    def recipe_changed(self, recipe_id):
+        self.changes.write(recipe_id)
+
+    def invalidate(self):
+        self.changes.write(REBUILD)
+
+    def search(self, text):
+        """Словарь id рецепта -> ранг для рецептов, содержащих все слова
+        запроса, кроме стоп-слов"""
+
+        postings = self.get()
+        query = set(terms(text))
+        if not query:
+            return {}
+        lists = sorted(
+            (postings.get(term, {}) for term in query), key=len)
+        ranks = dict(lists[0])
+        for weights in lists[1:]:
+            ranks = {
+                recipe_id: rank + weights[recipe_id]
+                for recipe_id, rank in ranks.items() if recipe_id in weights}
+        return ranks
+
+
+search_index = RecipeSearchIndex()
+
+
+def search_recipe_ids(recipes, text):
+    """Id рецептов из recipes, в названии или описании которых есть все
+    слова запроса text с учётом морфологии, по убыванию ранга, при равном
+    ранге — по убыванию даты публикации. В PostgreSQL поиск выполняется
+    по индексу GIN на Recipe.search_vector и возвращается QuerySet,
+    иначе — по RecipeSearchIndex, и возвращается список"""
+
+    if connections[recipes.db].vendor == 'postgresql':
+        query = SearchQuery(text, config=SEARCH_CONFIG)
+        return recipes.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)).order_by(
+            '-rank', '-pub_date').values_list('id', flat=True)
+
+    ranks = search_index.search(text)
+    if not ranks:
+        return []
+    found = recipes.filter(id__in=list(ranks)).values_list('id', 'pub_date')
+    return [
+        recipe_id for recipe_id, _ in sorted(
+            found, key=lambda row: (ranks[row[0]], row[1]), reverse=True)]
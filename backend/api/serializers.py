@@ -1,10 +1,107 @@
+from functools import partial
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Exists, OuterRef, Prefetch
 from djoser.serializers import UserCreateSerializer as BaseUserCreateSerializer
 from djoser.serializers import UserSerializer as BaseUserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
-from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
+from recipes.models import (
+    Ingredient, IngredientRecipe, Recipe, Tag, TagRecipe)
 from users.models import CustomUser, Subscription
+from .events import broker
+from .reference import ingredient_ids, tag_ids
+
+
+def split_param(request, name):
+    return {value for value in request.query_params.get(
+        name, '').split(',') if value}
+
+
+class SparseFieldsMixin:
+    """Выбор полей ответа на GET-запрос параметрами fields и expand.
+    fields — выводимые поля через запятую, без него выводятся все поля,
+    кроме optional_fields. Связанные объекты из collapsed_fields при
+    заданном fields выводятся полностью, только если перечислены
+    в expand, иначе — своими id. Выбор действует только на сериализатор
+    верхнего уровня без default_fields в контексте (параметры запроса
+    относятся к другим объектам), а prepare_queryset убирает из запроса
+    к БД невыводимые столбцы и связанные объекты"""
+
+    # поле -> фабрика поля для вывода id вместо связанного объекта
+    collapsed_fields = {}
+    # поля, которые выводятся, только если перечислены в fields
+    optional_fields = ()
+
+    @classmethod
+    def selection(cls, request):
+        """Множества выводимых и раскрываемых полей для запроса"""
+
+        names = set(cls.Meta.fields)
+        if (request is None or request.method != 'GET'
+                or not request.query_params.get('fields')):
+            return names - set(cls.optional_fields), set(cls.collapsed_fields)
+        expand = split_param(request, 'expand')
+        fields = split_param(request, 'fields') | expand
+        unknown = fields - names
+        if unknown:
+            raise serializers.ValidationError({
+                'fields': f'Неизвестные поля: {", ".join(sorted(unknown))}.'})
+        unknown = expand - cls.collapsed_fields.keys()
+        if unknown:
+            raise serializers.ValidationError({
+                'expand': 'Поля нельзя раскрыть: '
+                          f'{", ".join(sorted(unknown))}.'})
+        return fields, expand
+
+    @classmethod
+    def related_lookups(cls, fields, expand):
+        """Аргументы select_related и prefetch_related для вывода полей"""
+
+        return [], []
+
+    @classmethod
+    def prepare_queryset(cls, queryset, request):
+        fields, expand = cls.selection(request)
+        select_related, prefetch_related = cls.related_lookups(
+            fields, expand)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        deferred = [
+            name for name in cls.Meta.fields
+            if name not in fields and cls.is_column(name)]
+        return queryset.defer(*deferred) if deferred else queryset
+
+    @classmethod
+    def is_column(cls, name):
+        try:
+            field = cls.Meta.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return False
+        return (
+            field.concrete and not field.primary_key
+            and not field.is_relation)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if parent is not None or self.context.get('default_fields'):
+            for name in self.optional_fields:
+                del fields[name]
+            return fields
+        selected, expand = self.selection(self.context.get('request'))
+        for name in list(fields):
+            if name not in selected:
+                del fields[name]
+            elif name in self.collapsed_fields and name not in expand:
+                fields[name] = self.collapsed_fields[name]()
+        return fields
 
 
 class UserCreateSerializer(BaseUserCreateSerializer):
@@ -23,21 +120,41 @@ class UserCreateSerializer(BaseUserCreateSerializer):
             'last_name', 'password')
 
 
-class UserSerializer(BaseUserSerializer):
-    """Сериализатор для пользователя"""
+class UserSerializer(SparseFieldsMixin, BaseUserSerializer):
+    """Сериализатор для пользователя. Счётчики рецептов и подписчиков
+    выводятся, только если перечислены в fields"""
 
     is_subscribed = serializers.SerializerMethodField()
 
+    optional_fields = ('recipes_count', 'followers_count')
+
     class Meta:
         model = CustomUser
         fields = (
             'email', 'id', 'username', 'first_name',
-            'last_name', 'is_subscribed', 'avatar')
+            'last_name', 'is_subscribed', 'avatar', 'recipes_count',
+            'followers_count')
+
+    @classmethod
+    def prepare_queryset(cls, queryset, request):
+        queryset = super().prepare_queryset(queryset, request)
+        fields, _ = cls.selection(request)
+        if ('is_subscribed' in fields and request is not None
+                and request.user.is_authenticated):
+            queryset = queryset.annotate(is_subscribed=Exists(
+                Subscription.objects.filter(
+                    subscription=OuterRef('pk'), subscriber=request.user)))
+        return queryset
 
     def get_is_subscribed(self, obj):
         request = self.context.get('request')
-        if not request or request.user.is_anonymous:
+        # на самого себя подписаться нельзя
+        if (not request or request.user.is_anonymous
+                or obj.pk == request.user.pk):
             return False
+        if hasattr(obj, 'is_subscribed'):
+            # аннотация из prepare_queryset
+            return obj.is_subscribed
         return Subscription.objects.filter(
             subscription=obj, subscriber=request.user
         ).exists()
@@ -67,23 +184,53 @@ class SubscriptionSerializer(UserSerializer):
     """Сериализатор для подписок"""
 
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+
+    collapsed_fields = {
+        'recipes': partial(
+            serializers.SerializerMethodField, method_name='get_recipe_ids'),
+    }
+    optional_fields = ('followers_count',)
 
     class Meta:
         model = CustomUser
         fields = (
             'email', 'id', 'username', 'first_name', 'last_name',
-            'is_subscribed', 'recipes', 'recipes_count', 'avatar')
+            'is_subscribed', 'recipes', 'recipes_count', 'avatar',
+            'followers_count')
+
+    @staticmethod
+    def recipes_limit(value):
+        """Значение параметра recipes_limit, None — без ограничения"""
+
+        return int(value) if value and value.isdigit() else None
+
+    @classmethod
+    def prepare_queryset(cls, queryset, request):
+        """Рецепты авторов страницы загружаются одним запросом только
+        с выводимыми столбцами, а recipes_limit применяется при выводе:
+        коррелированный подзапрос с LIMIT для каждой строки медленнее
+        чтения всех рецептов авторов одной страницы"""
+
+        queryset = super().prepare_queryset(queryset, request)
+        fields, expand = cls.selection(request)
+        if 'recipes' not in fields:
+            return queryset
+        recipes = Recipe.objects.only(
+            *(ShortRecipeInfoSerializer.Meta.fields
+              if 'recipes' in expand else ('id',)), 'author')
+        return queryset.prefetch_related(Prefetch('recipe', recipes))
+
+    def limit_recipes(self, recipes):
+        limit = self.recipes_limit(self.context.get('recipes_limit'))
+        return recipes if limit is None else recipes[:limit]
 
     def get_recipes(self, obj):
-        recipes = obj.recipe.all()
-        if self.context.get('recipes_limit'):
-            recipes = recipes[:int(self.context.get('recipes_limit'))]
+        recipes = self.limit_recipes(obj.recipe.all())
         return ShortRecipeInfoSerializer(
             recipes, many=True, read_only=True).data
 
-    def get_recipes_count(self, obj):
-        return obj.recipe.count()
+    def get_recipe_ids(self, obj):
+        return [recipe.id for recipe in self.limit_recipes(obj.recipe.all())]
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -115,7 +262,7 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Сериализатор для отображения рецептов с учетом фильтров"""
 
     author = UserSerializer(read_only=True)
@@ -125,6 +272,15 @@ class RecipeSerializer(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
+    collapsed_fields = {
+        'author': partial(serializers.PrimaryKeyRelatedField, read_only=True),
+        'tags': partial(
+            serializers.PrimaryKeyRelatedField, many=True, read_only=True),
+        'ingredients': partial(
+            serializers.SlugRelatedField, source='ingredientrecipe',
+            slug_field='ingredient_id', many=True, read_only=True),
+    }
+
     class Meta:
         model = Recipe
         fields = (
@@ -132,6 +288,16 @@ class RecipeSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart', 'name', 'image', 'text',
             'cooking_time')
 
+    @classmethod
+    def related_lookups(cls, fields, expand):
+        select_related = ['author'] if 'author' in expand else []
+        prefetch_related = ['tags'] if 'tags' in fields else []
+        if 'ingredients' in expand:
+            prefetch_related.append('ingredientrecipe__ingredient')
+        elif 'ingredients' in fields:
+            prefetch_related.append('ingredientrecipe')
+        return select_related, prefetch_related
+
     def get_is_favorited(self, obj):
         user = self.context.get('request').user
         if user.is_anonymous:
@@ -180,42 +346,86 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         amount = {
             ingredient['id']: ingredient['amount']
             for ingredient in ingredients}
-        ingredient_objects = Ingredient.objects.filter(id__in=amount.keys())
-        tag_objects = Tag.objects.filter(id__in=tags)
 
-        if len(ingredient_objects) != len(amount.keys()):
+        if not ingredient_ids.contains(amount):
             raise serializers.ValidationError(
                 {'ingredients': 'Передан неверный ID ингредиента.'})
 
-        if len(tag_objects) != len(tags):
+        if not tag_ids.contains(tags):
             raise serializers.ValidationError(
                 {'tags': 'Передан неверный ID тега.'})
 
         data['amount'] = amount
-        data['ingredients'] = ingredient_objects
-        data['tags'] = tag_objects
+        data['ingredients'] = list(amount)
+        data['tags'] = tags
 
         return data
 
     def save_ingredients_and_tags(self, recipe, ingredients, tags, amount):
-        IngredientRecipe.objects.filter(recipe=recipe).delete()
-        ingredients_bulk = [
+        """Сохранение только изменений состава рецепта по id ингредиентов
+        и тегов: удаляются исключённые ингредиенты, обновляется
+        количество изменённых и добавляются новые. Теги сравнивает
+        с текущими метод set"""
+
+        current = {
+            entry.ingredient_id: entry
+            for entry in IngredientRecipe.objects.filter(recipe=recipe)}
+        IngredientRecipe.objects.filter(id__in=[
+            entry.id for ingredient_id, entry in current.items()
+            if ingredient_id not in amount]).delete()
+
+        changed = []
+        for ingredient_id, entry in current.items():
+            if ingredient_id in amount and (
+                    entry.amount != amount[ingredient_id]):
+                entry.amount = amount[ingredient_id]
+                changed.append(entry)
+        IngredientRecipe.objects.bulk_update(changed, ['amount'])
+
+        IngredientRecipe.objects.bulk_create([
             IngredientRecipe(
-                recipe=recipe, ingredient=ingredient,
-                amount=amount[ingredient.id]) for ingredient in ingredients]
-        IngredientRecipe.objects.bulk_create(ingredients_bulk)
+                recipe=recipe, ingredient_id=ingredient_id,
+                amount=amount[ingredient_id])
+            for ingredient_id in ingredients
+            if ingredient_id not in current])
 
         recipe.tags.set(tags)
+        self.check_references(amount, tags)
+
+    def check_references(self, amount, tags):
+        """Ингредиенты и теги проверяются в validate по кэшу id, который
+        может не знать об удалении в другом процессе. Внешние ключи
+        проверяются сразу, а не при фиксации транзакции, и до её конца
+        удалить записи, на которые ссылается рецепт, нельзя"""
+
+        try:
+            # точка сохранения: после ошибки транзакция остаётся рабочей
+            with transaction.atomic():
+                connection.check_constraints(table_names=[
+                    IngredientRecipe._meta.db_table,
+                    TagRecipe._meta.db_table])
+        except IntegrityError:
+            ingredient_ids.expire()
+            tag_ids.expire()
+            if not ingredient_ids.contains(amount):
+                raise serializers.ValidationError(
+                    {'ingredients': 'Передан неверный ID ингредиента.'})
+            raise serializers.ValidationError(
+                {'tags': 'Передан неверный ID тега.'})
 
+    @transaction.atomic
     def create(self, validated_data):
         amount = validated_data.pop('amount')
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
         self.save_ingredients_and_tags(recipe, ingredients, tags, amount)
+        transaction.on_commit(partial(
+            broker.publish_recipe, recipe, self.context['request']))
 
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         amount = validated_data.pop('amount')
         ingredients = validated_data.pop('ingredients')
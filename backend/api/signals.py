@@ -0,0 +1,132 @@
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (
+    DeletedRecipe, Ingredient, Recipe, SimilarRecipe, SimilarRecipeUpdate,
+    Tag)
+from users.models import CustomUser, Subscription
+from .authentication import token_cache
+from .cookable import cookable_index
+from .counters import change_counter, user_count
+from .reference import ingredient_ids, tag_ids
+from .search import search_index
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    """Выход из системы удаляет токен"""
+
+    token_cache.invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_user(sender, instance, **kwargs):
+    """Смена пароля, деактивация и другие изменения пользователя"""
+
+    token_cache.invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_user_count(sender, created=True, **kwargs):
+    """Количество пользователей меняется при создании и удалении"""
+
+    if created:
+        user_count.invalidate()
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(sender, instance, **kwargs):
+    change_counter(instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Subscription)
+def increment_followers_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(instance.subscription_id, 'followers_count', 1)
+
+
+@receiver(post_delete, sender=Subscription)
+def decrement_followers_count(sender, instance, **kwargs):
+    change_counter(instance.subscription_id, 'followers_count', -1)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_ids(sender, **kwargs):
+    ingredient_ids.invalidate()
+
+
+@receiver(post_delete, sender=Ingredient)
+def invalidate_cookable_index(sender, **kwargs):
+    """Удаление ингредиента меняет состав рецептов"""
+
+    cookable_index.invalidate()
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def update_cookable_index(sender, instance, **kwargs):
+    """Ингредиенты рецепта сохраняются после самого рецепта в той же
+    транзакции, поэтому индекс обновляется после её завершения"""
+
+    transaction.on_commit(
+        partial(cookable_index.recipe_changed, instance.pk))
+
+
+@receiver(post_save, sender=Recipe)
+def queue_similar_recipes(sender, instance, **kwargs):
+    """Похожие рецепты изменённого рецепта пересчитывает команда
+    update_similar_recipes"""
+
+    SimilarRecipeUpdate.objects.bulk_create(
+        [SimilarRecipeUpdate(recipe=instance)], ignore_conflicts=True)
+
+
+@receiver(pre_delete, sender=Recipe)
+def queue_similar_recipes_of_deleted(sender, instance, **kwargs):
+    """Удаляемый рецепт пропадёт из списков похожих рецептов вместе
+    с их строками, поэтому эти списки нужно дополнить"""
+
+    SimilarRecipeUpdate.objects.bulk_create(
+        (SimilarRecipeUpdate(recipe_id=recipe_id)
+         for recipe_id in SimilarRecipe.objects.filter(
+             similar=instance).values_list('recipe_id', flat=True)),
+        ignore_conflicts=True)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def update_search_index(sender, instance, **kwargs):
+    transaction.on_commit(
+        partial(search_index.recipe_changed, instance.pk))
+
+
+@receiver(post_delete, sender=Recipe)
+def add_deleted_recipe(sender, instance, **kwargs):
+    """Удалённые рецепты отдаются в ленте изменений в течение
+    DELETED_RECIPES_DAYS дней"""
+
+    DeletedRecipe.objects.filter(deleted_at__lt=timezone.now() - timedelta(
+        days=settings.DELETED_RECIPES_DAYS)).delete()
+    DeletedRecipe.objects.create(recipe_id=instance.pk)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_ids(sender, **kwargs):
+    tag_ids.invalidate()
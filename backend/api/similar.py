@@ -0,0 +1,188 @@
+from collections import defaultdict
+from heapq import merge
+from itertools import islice
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, Min, OuterRef
+
+from recipes.models import (
+    IngredientRecipe, Recipe, SimilarRecipe, SimilarRecipeUpdate, TagRecipe)
+from .cookable import Ranking, Snapshot
+
+# Количество совпадающих признаков хранится в одном байте дорожки
+MAX_FEATURES = 255
+WRITE_BATCH_SIZE = 1000
+
+
+def feature_rows():
+    """Строки (id рецепта, признак), упорядоченные по id рецепта:
+    признаки — id ингредиентов и id тегов со знаком минус"""
+
+    ingredients = IngredientRecipe.objects.order_by('recipe_id').values_list(
+        'recipe_id', 'ingredient_id').iterator(chunk_size=10000)
+    tags = (
+        (recipe_id, -tag_id)
+        for recipe_id, tag_id in TagRecipe.objects.order_by(
+            'recipe_id').values_list('recipe_id', 'tag_id').iterator(
+            chunk_size=10000))
+    return merge(ingredients, tags, key=itemgetter(0))
+
+
+def jaccard(size):
+    """Мера Жаккара для рецепта с size признаками: количество общих
+    признаков, делённое на количество признаков в объединении"""
+
+    def score(count, other_size):
+        return count / (size + other_size - count)
+    return score
+
+
+class SimilarityIndex:
+    """Признаки рецептов в индексе Snapshot, в котором можно быстро
+    найти рецепты с общими признаками. Признаки отдельных рецептов
+    сохраняются только для рецептов из targets (всех, если не указаны)"""
+
+    def __init__(self, targets=None):
+        self.features = defaultdict(list)
+
+        def rows():
+            for recipe_id, feature in feature_rows():
+                if targets is None or recipe_id in targets:
+                    self.features[recipe_id].append(feature)
+                yield recipe_id, feature
+        self.snapshot = Snapshot(rows())
+
+    def ranking(self, recipe_id):
+        """Рецепты по убыванию сходства с рецептом recipe_id,
+        включая его самого"""
+
+        features = frozenset(
+            sorted(self.features[recipe_id])[:MAX_FEATURES])
+        return Ranking(
+            self.snapshot, {}, {}, features, score=jaccard(len(features)))
+
+    def neighbours(self, recipe_id, count):
+        """count самых похожих рецептов: пары (id рецепта, сходство)"""
+
+        return [
+            (other_id, score)
+            for other_id, score in self.ranking(recipe_id)[0:count + 1]
+            if other_id != recipe_id][:count]
+
+
+def write(lists):
+    """Замена списков похожих рецептов пакетами: lists — пары
+    (id рецепта, список пар (id похожего рецепта, сходство))"""
+
+    lists = iter(lists)
+    while True:
+        batch = list(islice(lists, WRITE_BATCH_SIZE))
+        if not batch:
+            return
+        with transaction.atomic():
+            SimilarRecipe.objects.filter(
+                recipe_id__in=[recipe_id for recipe_id, _ in batch]).delete()
+            SimilarRecipe.objects.bulk_create(
+                SimilarRecipe(
+                    recipe_id=recipe_id, similar_id=similar_id, score=score)
+                for recipe_id, neighbours in batch
+                for similar_id, score in neighbours)
+
+
+def update_similar_recipes(full=False, log=None):
+    """Пересчёт таблицы похожих рецептов. Без full пересчитываются
+    списки изменённых рецептов из очереди SimilarRecipeUpdate, рецептов
+    без списка (добавленных пакетной вставкой) и рецептов, в списках
+    которых есть изменённые; изменённые рецепты затем добавляются
+    в остальные списки, если похожи на рецепт списка сильнее,
+    чем последний рецепт в нём.
+    Возвращает количество пересчитанных и дополненных списков"""
+
+    log = log or (lambda message: None)
+    count = settings.SIMILAR_RECIPES_COUNT
+    with transaction.atomic():
+        queue = list(SimilarRecipeUpdate.objects.values_list(
+            'id', 'recipe_id'))
+        SimilarRecipeUpdate.objects.filter(
+            id__in=[entry_id for entry_id, _ in queue]).delete()
+    try:
+        changed = {recipe_id for _, recipe_id in queue}
+        if not full:
+            changed.update(Recipe.objects.filter(~Exists(
+                SimilarRecipe.objects.filter(recipe=OuterRef('pk')))
+            ).values_list('id', flat=True))
+            targets = changed | set(SimilarRecipe.objects.filter(
+                similar_id__in=changed).values_list('recipe_id', flat=True))
+            # дополнять почти все списки дольше, чем пересчитать их
+            full = 2 * len(targets) > Recipe.objects.count()
+        if full:
+            targets = None
+        elif not targets:
+            return 0, 0
+
+        log('Построение индекса признаков рецептов')
+        index = SimilarityIndex(targets)
+        targets = set(index.features) if full else targets & set(
+            index.features)
+        log(f'Пересчёт списков: {len(targets)}')
+        write(
+            (recipe_id, index.neighbours(recipe_id, count))
+            for recipe_id in targets)
+        if full:
+            return len(targets), 0
+
+        additions = find_additions(
+            index, changed & targets, targets, count)
+        log(f'Дополнение списков: {len(additions)}')
+        write(additions.items())
+        return len(targets), len(additions)
+    except BaseException:
+        # очередь возвращается, чтобы изменения учёл следующий запуск
+        SimilarRecipeUpdate.objects.bulk_create(
+            (SimilarRecipeUpdate(recipe_id=recipe_id)
+             for recipe_id in Recipe.objects.filter(id__in=[
+                 recipe_id for _, recipe_id in queue]).values_list(
+                 'id', flat=True)),
+            ignore_conflicts=True)
+        raise
+
+
+def find_additions(index, changed, targets, count):
+    """Новые списки рецептов не из targets, в которые попадают
+    изменённые рецепты. Сходство симметрично, поэтому такие рецепты
+    находятся по рейтингу изменённого рецепта, который просматривается,
+    пока сходство не опустится ниже порога самого слабого списка"""
+
+    lists = SimilarRecipe.objects.values('recipe_id').annotate(
+        size=Count('id'), low=Min('score')).values_list(
+        'recipe_id', 'size', 'low')
+    thresholds = {
+        recipe_id: low if size >= count else 0
+        for recipe_id, size, low in lists if recipe_id not in targets}
+    if not thresholds:
+        return {}
+    bound = min(thresholds.values())
+    candidates = defaultdict(list)
+    for recipe_id in changed:
+        for other_id, score in index.ranking(recipe_id):
+            if score < bound:
+                break
+            threshold = thresholds.get(other_id)
+            if threshold is not None and score >= threshold:
+                candidates[other_id].append((recipe_id, score))
+
+    additions = {}
+    current = defaultdict(list)
+    for recipe_id, similar_id, score in SimilarRecipe.objects.filter(
+            recipe_id__in=list(candidates)).values_list(
+            'recipe_id', 'similar_id', 'score'):
+        current[recipe_id].append((similar_id, score))
+    for recipe_id, new in candidates.items():
+        neighbours = sorted(
+            current[recipe_id] + new,
+            key=lambda pair: (pair[1], pair[0]), reverse=True)[:count]
+        if set(neighbours) != set(current[recipe_id]):
+            additions[recipe_id] = neighbours
+    return additions
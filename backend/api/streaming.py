@@ -0,0 +1,155 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connections
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+
+# Сколько готовых фрагментов поток-производитель держит в очереди
+QUEUE_SIZE = 2
+PUT_TIMEOUT = 1
+
+
+def stream_json(queryset, serialize, chunk_size):
+    """Потоковая выдача JSON-массива: объекты читаются из БД курсором
+    на стороне сервера (iterator) и сериализуются пакетами по chunk_size,
+    поэтому расход памяти не зависит от количества объектов.
+    serialize получает список объектов пакета и возвращает данные
+    для JSONRenderer. Вместо QuerySet можно передать готовый список"""
+
+    if isinstance(queryset, QuerySet):
+        objects = queryset.iterator(chunk_size=chunk_size)
+    else:
+        objects = iter(queryset)
+    separator = b''
+    yield b'['
+    while True:
+        chunk = list(islice(objects, chunk_size))
+        if not chunk:
+            break
+        yield separator + JSONRenderer().render(serialize(chunk))[1:-1]
+        separator = b','
+    yield b']'
+
+
+async def in_thread(iterable):
+    """Асинхронный перебор итератора, который вычисляется в отдельном
+    потоке. Нужно при ASGI: в потоке цикла событий запросы к БД
+    запрещены, а ожидание фрагмента не должно его блокировать. Весь
+    итератор вычисляется в одном потоке, потому что курсор на стороне
+    сервера привязан к подключению к БД этого потока. Если клиент
+    отключился, поток-производитель завершается"""
+
+    loop = asyncio.get_running_loop()
+    results = asyncio.Queue(QUEUE_SIZE)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item, error=None):
+        try:
+            future = asyncio.run_coroutine_threadsafe(
+                results.put((item, error)), loop)
+        except RuntimeError:
+            # цикл событий уже закрыт
+            return False
+        while not stopped.is_set():
+            try:
+                future.result(timeout=PUT_TIMEOUT)
+                return True
+            except concurrent.futures.TimeoutError:
+                continue
+        future.cancel()
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(done)
+        except Exception as exc:
+            put(done, exc)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+            connections.close_all()
+
+    # поток получает контекст запроса, чтобы его запросы к БД учитывались
+    # обёртками промежуточных слоёв
+    threading.Thread(
+        target=contextvars.copy_context().run, args=(produce,),
+        daemon=True).start()
+    try:
+        while True:
+            item, error = await results.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stopped.set()
+
+
+class AsyncStreamingHttpResponse(StreamingHttpResponse):
+    """Потоковый ответ с асинхронным итератором фрагментов, как
+    StreamingHttpResponse с асинхронным итератором в Django 4.2.
+    Отправляется обработчиком StreamingASGIHandler"""
+
+    is_async = True
+
+    @property
+    def streaming_content(self):
+        return self._iterator
+
+    @streaming_content.setter
+    def streaming_content(self, value):
+        self._iterator = self.encode(value)
+
+    async def encode(self, content):
+        try:
+            async for chunk in content:
+                yield self.make_bytes(chunk)
+        finally:
+            if hasattr(content, 'aclose'):
+                await content.aclose()
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """ASGIHandler, отправляющий ответы AsyncStreamingHttpResponse
+    без блокировки цикла событий: обработчик Django 3.2 перебирает
+    потоковый ответ синхронно в потоке цикла событий"""
+
+    async def send_response(self, response, send):
+        if not getattr(response, 'is_async', False):
+            return await super().send_response(response, send)
+        response_headers = [
+            (header.encode('ascii'), value.encode('latin1'))
+            for header, value in response.items()]
+        response_headers.extend(
+            (b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+            for cookie in response.cookies.values())
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': response_headers,
+        })
+        content = response.streaming_content
+        try:
+            async for part in content:
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    })
+        finally:
+            await content.aclose()
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
@@ -0,0 +1,73 @@
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from users.models import CustomUser
+from ..authentication import CachedTokenAuthentication, TokenCache
+
+
+class TokenCacheTest(TestCase):
+    """Кэш пользователей по токену и его сброс"""
+
+    def setUp(self):
+        cache.clear()
+        self.cache = TokenCache(maxsize=2, ttl=60)
+        self.users = [CustomUser(pk=pk) for pk in (1, 2)]
+
+    def test_user_version_changed_in_other_process(self):
+        self.cache.set('a', (self.users[0], None))
+        # другой процесс с общим кэшем Django увеличивает только версию
+        key = TokenCache.version_key(1)
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.entries, {})
+        self.assertEqual(self.cache.user_keys, {})
+
+    def test_invalidate_user(self):
+        self.cache.set('a', (self.users[0], None))
+        self.cache.set('b', (self.users[1], None))
+        self.cache.invalidate_user(1)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('b'))
+        self.assertEqual(dict(self.cache.user_keys), {2: {'b'}})
+
+    def test_eviction_updates_user_keys(self):
+        self.cache.set('a', (self.users[0], None))
+        self.cache.set('b', (self.users[1], None))
+        self.cache.get('a')
+        self.cache.set('c', (self.users[0], None))
+        self.assertEqual(list(self.cache.entries), ['a', 'c'])
+        self.assertEqual(dict(self.cache.user_keys), {1: {'a', 'c'}})
+
+
+class CachedTokenAuthenticationTest(TestCase):
+    """Отозванный токен и изменённый пользователь не принимаются
+    из кэша"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.authentication = CachedTokenAuthentication()
+        self.authentication.authenticate_credentials(self.token.key)
+
+    def test_cached_token_without_queries(self):
+        with self.assertNumQueries(0):
+            user, _ = self.authentication.authenticate_credentials(
+                self.token.key)
+        self.assertEqual(user, self.user)
+
+    def test_logout(self):
+        self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.token.key)
+
+    def test_deactivation(self):
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authentication.authenticate_credentials(self.token.key)
@@ -0,0 +1,59 @@
+from unittest import mock
+
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, IngredientRecipe, Recipe
+from users.models import CustomUser
+from ..cookable import CookableIndex, Ranking, Snapshot, query_ranking
+
+
+class CookableFallbackTest(TestCase):
+    """Пока снимок индекса строится в фоне, поиск по ингредиентам
+    выполняется запросом к БД с тем же результатом"""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = CustomUser.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Имя', last_name='Фамилия', password='password')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г').id
+            for number in range(5)]
+        for number in range(8):
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {number}', text='Описание',
+                cooking_time=5, image='recipes/images/recipe.png')
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(
+                    recipe=recipe, ingredient_id=ingredient_id, amount=1)
+                for ingredient_id in cls.ingredients[
+                    number % 3:number % 3 + 1 + number % 4])
+
+    def test_query_ranking_matches_index(self):
+        snapshot = Snapshot.load()
+        for ingredients in (
+                [], self.ingredients[:1], self.ingredients[1:3],
+                self.ingredients):
+            with self.subTest(ingredients=ingredients):
+                ranking = Ranking(snapshot, {}, {}, frozenset(ingredients))
+                self.assertEqual(
+                    list(query_ranking(ingredients)), ranking[0:len(ranking)])
+
+    def test_cold_index_does_not_load_in_request(self):
+        index = CookableIndex()
+        with mock.patch.object(index, 'start_rebuild') as start_rebuild, \
+                mock.patch('api.views.cookable_index', index):
+            response = APIClient().get(
+                '/api/recipes/cookable/?ingredients={}'.format(
+                    ','.join(map(str, self.ingredients[:2]))))
+        start_rebuild.assert_called_once()
+        self.assertIsNone(index.snapshot)
+        self.assertEqual(response.status_code, 200)
+        index.build()
+        ranking = index.search(self.ingredients[:2])
+        self.assertEqual(
+            [(row['id'], row['coverage']) for row in response.data['results']],
+            [(recipe_id, round(coverage, 3))
+             for recipe_id, coverage in ranking[0:len(ranking)]])
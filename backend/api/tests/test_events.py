@@ -0,0 +1,94 @@
+import tempfile
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, Tag
+from users.models import CustomUser
+from ..async_views import event_stream_user
+from ..events import broker
+from .test_recipes import IMAGE
+
+
+def scope(query='', headers=()):
+    return {'query_string': query.encode(), 'headers': list(headers)}
+
+
+class EventStreamAuthenticationTest(TestCase):
+    """Подключение к потоку событий: токен принимается только
+    в заголовке, в адресе — короткоживущий подписанный билет"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия', password='password')
+        self.token = Token.objects.create(user=self.user).key
+        self.client = APIClient()
+
+    def get_ticket(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/recipes/events/ticket/')
+        self.assertEqual(response.status_code, 200)
+        return response.data['ticket']
+
+    def test_ticket(self):
+        ticket = self.get_ticket()
+        self.assertEqual(
+            event_stream_user(scope(f'ticket={ticket}')), self.user)
+
+    def test_ticket_requires_authentication(self):
+        response = self.client.post('/api/recipes/events/ticket/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_header_token(self):
+        headers = [(b'authorization', f'Token {self.token}'.encode())]
+        self.assertEqual(event_stream_user(scope(headers=headers)), self.user)
+
+    def test_token_in_query_string(self):
+        with self.assertRaises(NotAuthenticated):
+            event_stream_user(scope(f'token={self.token}'))
+        with self.assertRaises(AuthenticationFailed):
+            event_stream_user(scope(f'ticket={self.token}'))
+
+    def test_expired_ticket(self):
+        ticket = self.get_ticket()
+        with override_settings(EVENTS_TICKET_MAX_AGE=-1), \
+                self.assertRaises(AuthenticationFailed):
+            event_stream_user(scope(f'ticket={ticket}'))
+
+    def test_inactive_user(self):
+        ticket = self.get_ticket()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            event_stream_user(scope(f'ticket={ticket}'))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class PublishRecipeTest(TestCase):
+    """Событие о новом рецепте содержит абсолютный URL изображения,
+    как и ответы API"""
+
+    def test_absolute_image_url(self):
+        user = CustomUser.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Имя', last_name='Фамилия', password='password')
+        ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г')
+        tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        client = APIClient()
+        client.force_authenticate(user)
+        with mock.patch.object(broker, 'publish') as publish, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/recipes/', {
+                'ingredients': [{'id': ingredient.id, 'amount': 10}],
+                'tags': [tag.id], 'image': IMAGE, 'name': 'Рецепт',
+                'text': 'Описание', 'cooking_time': 5}, format='json')
+        self.assertEqual(response.status_code, 201)
+        author_id, event = publish.call_args[0]
+        self.assertEqual(author_id, user.id)
+        self.assertEqual(event['image'], response.data['image'])
+        self.assertTrue(event['image'].startswith('http://testserver/'))
@@ -0,0 +1,75 @@
+import json
+
+from django.contrib.auth.models import AnonymousUser
+from django.test import TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from recipes.models import (
+    Favorite, Ingredient, IngredientRecipe, Recipe, ShoppingCart, Tag)
+from users.models import CustomUser, Subscription
+from ..fast_serializers import serialize_recipes
+from ..management.commands.benchmark_serialization import VARIANTS
+from ..serializers import RecipeSerializer
+
+
+class SerializeRecipesParityTest(TestCase):
+    """serialize_recipes выводит те же данные, что и RecipeSerializer,
+    для всех вариантов fields и expand"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, author, other = [
+            CustomUser.objects.create_user(
+                email=f'{name}@example.com', username=name,
+                first_name='Имя', last_name='Фамилия', password='password')
+            for name in ('user', 'author', 'other')]
+        author.avatar = 'users/avatar.png'
+        author.save()
+        Subscription.objects.create(subscriber=cls.user, subscription=author)
+        tags = [
+            Tag.objects.create(name=name, slug=slug)
+            for name, slug in (('Завтрак', 'breakfast'), ('Обед', 'lunch'))]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(4)]
+        recipes = []
+        for number, recipe_author in enumerate((author, other, author)):
+            recipe = Recipe.objects.create(
+                author=recipe_author, name=f'Рецепт {number}',
+                text='Описание', cooking_time=number + 1,
+                image=f'recipes/images/{number}.png')
+            recipe.tags.set(tags[:number + 1])
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=index + 1)
+                for index, ingredient in enumerate(ingredients[number:]))
+            recipes.append(recipe)
+        Favorite.objects.create(user=cls.user, recipe=recipes[0])
+        ShoppingCart.objects.create(user=cls.user, recipe=recipes[1])
+        # порядок id из запроса сохраняется
+        cls.ids = [recipes[2].id, recipes[0].id, recipes[1].id]
+
+    def request(self, params, user):
+        request = Request(APIRequestFactory().get('/api/recipes/', params))
+        request.user = user
+        return request
+
+    def test_parity(self):
+        for variant, params in VARIANTS.items():
+            for user in AnonymousUser(), self.user:
+                with self.subTest(variant=variant, user=user):
+                    request = self.request(params, user)
+                    recipes = {
+                        recipe.id: recipe
+                        for recipe in RecipeSerializer.prepare_queryset(
+                            Recipe.objects.filter(id__in=self.ids),
+                            request)}
+                    expected = RecipeSerializer(
+                        [recipes[recipe_id] for recipe_id in self.ids],
+                        many=True, context={'request': request}).data
+                    actual = serialize_recipes(self.ids, request)
+                    self.assertEqual(
+                        json.loads(json.dumps(actual)),
+                        json.loads(json.dumps(expected)))
@@ -0,0 +1,93 @@
+import shutil
+import tempfile
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, Tag
+from users.models import CustomUser
+from ..reference import ingredient_ids, tag_ids
+
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg==')
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RecipeWriteQueriesTest(TestCase):
+    """Количество запросов к БД при создании и изменении рецепта
+    не зависит от количества ингредиентов, а ответ совпадает с выводом
+    рецепта на чтение"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Имя', last_name='Фамилия', password='password')
+        cls.tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(20)]
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        # множества id в кэше могли остаться от другой тестовой БД,
+        # а загрузка множеств не должна попадать в подсчёт запросов
+        for reference in (ingredient_ids, tag_ids):
+            reference.invalidate()
+            reference.get()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def payload(self, count):
+        return {
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 10}
+                for ingredient in self.ingredients[:count]],
+            'tags': [self.tag.id],
+            'image': IMAGE,
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 5,
+        }
+
+    def create(self, count):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/recipes/', self.payload(count), format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response, len(queries)
+
+    def test_create_queries(self):
+        _, few = self.create(1)
+        response, many = self.create(17)
+        self.assertEqual(many, few)
+        self.assertEqual(len(response.data['ingredients']), 17)
+        self.assertEqual(
+            response.data,
+            self.client.get(f'/api/recipes/{response.data["id"]}/').data)
+
+    def test_update_queries(self):
+        counts = []
+        for count in (1, 17):
+            recipe_id = self.create(count)[0].data['id']
+            payload = self.payload(count)
+            for ingredient in payload['ingredients']:
+                ingredient['amount'] = 20
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.patch(
+                    f'/api/recipes/{recipe_id}/', payload, format='json')
+            self.assertEqual(response.status_code, 200, response.data)
+            counts.append(len(queries))
+        self.assertEqual(counts[1], counts[0])
+        self.assertEqual(
+            response.data,
+            self.client.get(f'/api/recipes/{recipe_id}/').data)
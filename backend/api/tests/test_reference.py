@@ -0,0 +1,89 @@
+import tempfile
+
+from django.db.models.signals import post_delete
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, Tag
+from users.models import CustomUser
+from ..reference import ingredient_ids, tag_ids
+from ..signals import invalidate_ingredient_ids, invalidate_tag_ids
+from .test_recipes import IMAGE
+
+
+class ReferenceIdsTest(TestCase):
+    """Проверка id по кэшированному множеству, которое устарело,
+    например после добавления записи в другом процессе"""
+
+    def setUp(self):
+        ingredient_ids.invalidate()
+        self.known = Ingredient.objects.create(
+            name='Соль', measurement_unit='г').id
+        ingredient_ids.get()
+        # bulk_create не отправляет сигналы, поэтому множество в кэше
+        # не сбрасывается, как при добавлении из другого процесса
+        Ingredient.objects.bulk_create(
+            [Ingredient(name='Перец', measurement_unit='г')])
+        self.added = Ingredient.objects.get(name='Перец').id
+
+    def test_known_ids_without_queries(self):
+        with self.assertNumQueries(0):
+            self.assertTrue(ingredient_ids.contains([self.known]))
+
+    def test_added_ids_reload_set(self):
+        self.assertTrue(ingredient_ids.contains([self.known, self.added]))
+        self.assertIn(self.added, ingredient_ids.get())
+
+    def test_missing_ids(self):
+        self.assertFalse(ingredient_ids.contains([self.added + 1]))
+        self.assertFalse(
+            ingredient_ids.contains([self.added, self.added + 1]))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class DeletedReferenceTest(TestCase):
+    """Ингредиент или тег, удалённый в другом процессе, ещё есть
+    в кэшированном множестве id: рецепт с ним не сохраняется, а ответ —
+    ошибка валидации, а не ошибка сервера"""
+
+    def setUp(self):
+        user = CustomUser.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Имя', last_name='Фамилия', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г')
+        self.tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        for reference in (ingredient_ids, tag_ids):
+            reference.invalidate()
+            reference.get()
+
+    def delete_in_other_process(self, instance, receiver):
+        # без сигнала версия множества в кэше не меняется
+        post_delete.disconnect(receiver, sender=type(instance))
+        try:
+            type(instance).objects.filter(pk=instance.pk).delete()
+        finally:
+            post_delete.connect(receiver, sender=type(instance))
+
+    def post(self):
+        return self.client.post('/api/recipes/', {
+            'ingredients': [{'id': self.ingredient.id, 'amount': 10}],
+            'tags': [self.tag.id], 'image': IMAGE, 'name': 'Рецепт',
+            'text': 'Описание', 'cooking_time': 5}, format='json')
+
+    def test_deleted_ingredient(self):
+        self.delete_in_other_process(
+            self.ingredient, invalidate_ingredient_ids)
+        self.assertIn(self.ingredient.id, ingredient_ids.get())
+        response = self.post()
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ingredients', response.data)
+        self.assertNotIn(self.ingredient.id, ingredient_ids.get())
+
+    def test_deleted_tag(self):
+        self.delete_in_other_process(self.tag, invalidate_tag_ids)
+        response = self.post()
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('tags', response.data)
@@ -0,0 +1,121 @@
+from unittest import skipUnless
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, Recipe
+from users.models import CustomUser
+from ..middleware import ReplicaRoutingMiddleware
+from ..routers import PRIMARY, REPLICA
+
+
+@skipUnless(REPLICA in settings.DATABASES,
+            'реплика не объявлена: задайте DB_REPLICA_MIRROR=1')
+@override_settings(REPLICA_ROUTING=True)
+class ReplicaRoutingTest(TransactionTestCase):
+    """Выбор БД для чтения в запросах к API. Реплика в тестах — зеркало
+    основной БД с отдельным подключением, поэтому тесты выполняются
+    без общей транзакции: данные должны быть видны на реплике"""
+
+    databases = {PRIMARY, REPLICA}
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия', password='password')
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='Рецепт', text='Описание',
+            cooking_time=5, image='recipes/images/recipe.png')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def request_queries(self, method, path):
+        """Ответ на запрос и количество запросов к каждой БД"""
+
+        with CaptureQueriesContext(connections[PRIMARY]) as primary, \
+                CaptureQueriesContext(connections[REPLICA]) as replica:
+            response = getattr(self.client, method)(path)
+        return response, len(primary), len(replica)
+
+    def favorite(self):
+        return self.request_queries(
+            'post', f'/api/recipes/{self.recipe.id}/favorite/')
+
+    def test_safe_request_reads_from_replica(self):
+        response, primary, replica = self.request_queries(
+            'get', f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_export_stream_reads_from_replica(self):
+        with CaptureQueriesContext(connections[PRIMARY]) as primary, \
+                CaptureQueriesContext(connections[REPLICA]) as replica:
+            response = self.client.get('/api/recipes/export/')
+            content = b''.join(response.streaming_content)
+        self.assertIn(b'"id":%d' % self.recipe.id, content)
+        self.assertEqual(len(primary), 0)
+        self.assertGreater(len(replica), 0)
+
+    def test_unsafe_request_uses_primary(self):
+        response, primary, replica = self.favorite()
+        self.assertEqual(response.status_code, 201)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_reads_after_write_use_primary(self):
+        def get_response(request):
+            Ingredient.objects.exists()
+            Ingredient.objects.create(name='Соль', measurement_unit='г')
+            Ingredient.objects.exists()
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        with CaptureQueriesContext(connections[PRIMARY]) as primary, \
+                CaptureQueriesContext(connections[REPLICA]) as replica:
+            middleware(RequestFactory().get('/api/ingredients/'))
+        self.assertEqual(len(replica), 1)
+        self.assertEqual(
+            [query['sql'].split()[0] for query in primary],
+            ['INSERT', 'SELECT'])
+
+    def test_async_request_reads_from_replica(self):
+        async def get_response(request):
+            await sync_to_async(Ingredient.objects.exists)()
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        with CaptureQueriesContext(connections[REPLICA]) as replica:
+            async_to_sync(middleware)(
+                RequestFactory().get('/api/ingredients/'))
+        self.assertEqual(len(replica), 1)
+
+    def test_unsafe_request_pins_primary(self):
+        response = self.favorite()[0]
+        cookie = response.cookies[settings.REPLICA_PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], settings.REPLICA_PIN_SECONDS)
+
+        response, primary, replica = self.request_queries(
+            'get', f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+        # по истечении max-age браузер удаляет cookie
+        del self.client.cookies[settings.REPLICA_PIN_COOKIE]
+        primary, replica = self.request_queries(
+            'get', f'/api/recipes/{self.recipe.id}/')[1:]
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_failed_unsafe_request_does_not_pin_primary(self):
+        self.favorite()
+        self.client.cookies.clear()
+        response = self.favorite()[0]
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
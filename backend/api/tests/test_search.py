@@ -0,0 +1,96 @@
+from unittest import skipUnless
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from recipes.models import Recipe, Tag
+from users.models import CustomUser
+from ..search import RecipeSearchIndex
+
+
+class SearchTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = CustomUser.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Имя', last_name='Фамилия', password='password')
+
+    def setUp(self):
+        cache.clear()
+
+    def create_recipe(self, name, text):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Recipe.objects.create(
+                author=self.author, name=name, text=text, cooking_time=5,
+                image='recipes/images/recipe.png')
+
+
+class RecipeSearchIndexTest(SearchTestCase):
+    """Изменённые рецепты обновляются в индексе по журналу изменений
+    без построения индекса заново"""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipe('Сырники', 'Творог и мука')
+        self.create_recipe('Блины', 'Мука, молоко и яйца')
+        self.index = RecipeSearchIndex()
+        self.index.get()
+
+    def assert_matches_full_load(self):
+        fresh = RecipeSearchIndex()
+        self.assertEqual(self.index.get(), fresh.get())
+        self.assertEqual(self.index.recipe_terms, fresh.recipe_terms)
+
+    def test_update(self):
+        self.recipe.name = 'Запеканка'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.save()
+        # один запрос за изменённым рецептом
+        with self.assertNumQueries(1):
+            self.assertEqual(self.index.search('сырники'), {})
+        self.assertIn(self.recipe.id, self.index.search('запеканку'))
+        self.assert_matches_full_load()
+
+    def test_create_and_delete(self):
+        recipe = self.create_recipe('Оладьи', 'Кефир и мука')
+        self.assertEqual(list(self.index.search('оладьи')), [recipe.id])
+        self.assertEqual(len(self.index.search('мука')), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertEqual(self.index.search('оладьи'), {})
+        self.assert_matches_full_load()
+
+    def test_invalidate(self):
+        self.index.invalidate()
+        with self.assertNumQueries(1):
+            self.index.get()
+        self.assert_matches_full_load()
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'полнотекстовый поиск PostgreSQL')
+class PostgresSearchTest(SearchTestCase):
+    """Поиск по Recipe.search_vector, который заполняет триггер,
+    вместе с фильтром по тегам, добавляющим distinct"""
+
+    def test_search_with_tags(self):
+        tags = [
+            Tag.objects.create(name=name, slug=slug)
+            for name, slug in (('Завтрак', 'breakfast'), ('Обед', 'lunch'))]
+        by_text = self.create_recipe('Завтрак', 'Сырники со сметаной')
+        by_name = self.create_recipe('Сырники', 'Творог и мука')
+        self.create_recipe('Блины', 'Мука и молоко')
+        for recipe in by_text, by_name:
+            recipe.tags.set(tags)
+        by_name.name = 'Сырники из творога'
+        by_name.save()
+        response = APIClient().get(
+            '/api/recipes/?search=сырник&tags=breakfast&tags=lunch'
+            '&fields=id')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [by_name.id, by_text.id])
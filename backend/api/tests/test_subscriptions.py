@@ -0,0 +1,76 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from recipes.models import Recipe
+from users.models import CustomUser, Subscription
+
+
+def create_user(name):
+    return CustomUser.objects.create_user(
+        email=f'{name}@example.com', username=name,
+        first_name='Имя', last_name='Фамилия', password='password')
+
+
+class SubscriptionListQueriesTest(TestCase):
+    """Список подписок выводится за постоянное количество запросов к БД
+    с рецептами авторов, ограниченными recipes_limit"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('subscriber')
+        cls.authors = [create_user(f'author{number}') for number in range(6)]
+        for author in cls.authors:
+            for number in range(3):
+                Recipe.objects.create(
+                    author=author, name=f'Рецепт {number}', text='Описание',
+                    cooking_time=5, image='recipes/images/recipe.png')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def subscribe(self, authors):
+        Subscription.objects.bulk_create(
+            Subscription(subscriber=self.user, subscription=author)
+            for author in authors)
+
+    def get(self, query=''):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                f'/api/users/subscriptions/?limit=10{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'], len(queries)
+
+    def test_queries_do_not_depend_on_page_size(self):
+        self.subscribe(self.authors[:3])
+        for query in ('', '&recipes_limit=2', '&fields=id,recipes'):
+            with self.subTest(query=query):
+                few = self.get(query)[1]
+                Subscription.objects.filter(
+                    subscription__in=self.authors[3:]).delete()
+                self.subscribe(self.authors[3:])
+                results, many = self.get(query)
+                self.assertEqual(len(results), 6)
+                self.assertEqual(many, few)
+                Subscription.objects.filter(
+                    subscription__in=self.authors[3:]).delete()
+
+    def test_recipes_limit(self):
+        self.subscribe(self.authors[:2])
+        for query, count in (
+                ('', 3), ('&recipes_limit=2', 2), ('&recipes_limit=0', 0),
+                ('&recipes_limit=x', 3)):
+            with self.subTest(query=query):
+                for row in self.get(query)[0]:
+                    expected = list(Recipe.objects.filter(
+                        author=row['id']).values_list('id', flat=True))
+                    self.assertEqual(
+                        [recipe['id'] for recipe in row['recipes']],
+                        expected[:count])
+                    self.assertEqual(row['recipes_count'], 3)
+        rows = self.get('&fields=id,recipes&recipes_limit=1')[0]
+        for row in rows:
+            self.assertEqual(row['recipes'], list(Recipe.objects.filter(
+                author=row['id']).values_list('id', flat=True)[:1]))
@@ -0,0 +1,70 @@
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from recipes.models import Recipe
+from users.models import CustomUser, Subscription
+
+
+class UserQueriesTest(TestCase):
+    """Список и профили пользователей выводятся за постоянное
+    количество запросов к БД"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            CustomUser.objects.create_user(
+                email=f'user{number}@example.com', username=f'user{number}',
+                first_name='Имя', last_name='Фамилия', password='password')
+            for number in range(30)]
+        cls.user = cls.users[0]
+        for author in cls.users[1:10]:
+            Subscription.objects.create(
+                subscriber=cls.user, subscription=author)
+            Recipe.objects.create(
+                author=author, name='Рецепт', text='Описание',
+                cooking_time=5, image='recipes/images/recipe.png')
+
+    def setUp(self):
+        # количество пользователей кэшируется между тестами
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_queries(self, path, count, client=None):
+        with self.assertNumQueries(count):
+            response = (client or self.client).get(path)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_list_queries_do_not_depend_on_limit(self):
+        fields = '&fields=id,is_subscribed,recipes_count,followers_count'
+        for query in ('', fields):
+            with self.subTest(query=query):
+                self.client.get('/api/users/')
+                self.assert_queries(f'/api/users/?limit=1{query}', 1)
+                data = self.assert_queries(
+                    f'/api/users/?limit=100{query}', 1)
+                self.assertEqual(len(data['results']), 30)
+        self.assert_queries('/api/users/?limit=100', 1, APIClient())
+
+    def test_list_values(self):
+        data = self.client.get(
+            '/api/users/?limit=100&fields=id,is_subscribed,'
+            'recipes_count,followers_count').data['results']
+        rows = {row['id']: row for row in data}
+        self.assertFalse(rows[self.user.id]['is_subscribed'])
+        self.assertEqual(rows[self.user.id]['followers_count'], 0)
+        for author in self.users[1:10]:
+            self.assertEqual(rows[author.id], {
+                'id': author.id, 'is_subscribed': True,
+                'recipes_count': 1, 'followers_count': 1})
+        self.assertFalse(rows[self.users[10].id]['is_subscribed'])
+
+    def test_detail_queries(self):
+        for author in self.users[1], self.users[10]:
+            self.assert_queries(f'/api/users/{author.id}/', 1)
+
+    def test_me_queries(self):
+        data = self.assert_queries('/api/users/me/', 0)
+        self.assertEqual(data['id'], self.user.id)
@@ -1,11 +1,15 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from . import async_views
 from .views import (
-    AvatarView, CustomUserViewSet, DownloadShoppingCartView,
+    AvatarView, BootstrapView, CustomUserViewSet, DownloadShoppingCartView,
     FavoriteRecipeView, IngredientDetailView, IngredientListView,
-    RecipeDetailView, RecipeGetShortLinkView, RecipeListView,
-    ShoppingCartRecipeView, SubscribeButtonView,
+    ProfileDownloadView, RecipeBatchView, RecipeChangesView,
+    RecipeCookableView, RecipeDetailView, RecipeEventsTicketView,
+    RecipeExportView, RecipeGetShortLinkView, RecipeListView,
+    RecipeSimilarView, ShoppingCartRecipeView, SubscribeButtonView,
     SubscriptionListView, TagDetailView, TagListView)
 
 app_name = 'api'
@@ -28,7 +32,23 @@ urlpatterns = [
         'ingredients/<int:id>/', IngredientDetailView.as_view(),
         name='ingredient'),
     path('recipes/', RecipeListView.as_view(), name='recipes'),
+    path(
+        'recipes/batch/', RecipeBatchView.as_view(), name='recipes_batch'),
+    path(
+        'recipes/changes/', RecipeChangesView.as_view(),
+        name='recipes_changes'),
+    path(
+        'recipes/cookable/', RecipeCookableView.as_view(),
+        name='recipes_cookable'),
+    path(
+        'recipes/export/', RecipeExportView.as_view(),
+        name='recipes_export'),
+    path(
+        'recipes/events/ticket/', RecipeEventsTicketView.as_view(),
+        name='recipes_events_ticket'),
     path('recipes/<int:id>/', RecipeDetailView.as_view(), name='recipe'),
+    path('recipes/<int:id>/similar/', RecipeSimilarView.as_view(),
+         name='recipe_similar'),
     path('recipes/<int:id>/get-link/', RecipeGetShortLinkView.as_view(),
          name='get_short_link'),
     path('recipes/<int:id>/favorite/', FavoriteRecipeView.as_view(),
@@ -37,7 +57,40 @@ urlpatterns = [
          name='shopping_cart'),
     path('recipes/download_shopping_cart/', DownloadShoppingCartView.as_view(),
          name='download_shopping_cart_pdf'),
+    path('profiles/<uuid:profile_id>/', ProfileDownloadView.as_view(),
+         name='profile'),
+    path('bootstrap/', BootstrapView.as_view(), name='bootstrap'),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
 ]
+
+if settings.ASYNC_VIEWS:
+    # асинхронные представления обрабатывают GET-запросы раньше синхронных
+    urlpatterns = [
+        path('bootstrap/', async_views.bootstrap, name='bootstrap'),
+        path('tags/', async_views.tag_list, name='tags'),
+        path('tags/<int:id>/', async_views.tag_detail, name='tag'),
+        path(
+            'ingredients/', async_views.ingredient_list,
+            name='ingredients'),
+        path(
+            'ingredients/<int:id>/', async_views.ingredient_detail,
+            name='ingredient'),
+        path('recipes/', async_views.recipe_list, name='recipes'),
+        path(
+            'recipes/batch/', async_views.recipe_batch,
+            name='recipes_batch'),
+        path(
+            'recipes/changes/', async_views.recipe_changes_feed,
+            name='recipes_changes'),
+        path(
+            'recipes/cookable/', async_views.recipe_cookable,
+            name='recipes_cookable'),
+        path(
+            'recipes/<int:id>/', async_views.recipe_detail,
+            name='recipe'),
+        path(
+            'recipes/<int:id>/similar/', async_views.recipe_similar,
+            name='recipe_similar'),
+    ] + urlpatterns
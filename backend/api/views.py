@@ -1,38 +1,57 @@
+import os
+import pstats
 from collections import defaultdict
-from io import BytesIO
+from io import BytesIO, StringIO
+from urllib.parse import urlsplit
 
 from django.conf import settings
-from django.http import HttpResponse, HttpResponseRedirect
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse)
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from djoser.views import UserViewSet
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen import canvas
 from rest_framework import status
-from rest_framework.exceptions import NotFound
-from rest_framework.pagination import (
-    LimitOffsetPagination, PageNumberPagination)
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from recipes.models import (
     Favorite, Ingredient, IngredientRecipe, Recipe,
-    ShoppingCart, Tag)
+    ShoppingCart, SimilarRecipe, Tag)
 from users.models import CustomUser, Subscription
+from .changes import recipe_changes
+from .cookable import cookable_index
+from .events import make_ticket
+from .fast_serializers import serialize_recipe_map, serialize_recipes
+from .pagination import LimitPageNumberPagination, UserLimitOffsetPagination
+from .profiling import profile_path
+from .routers import keep_routing
+from .search import search_recipe_ids
 from .serializers import (
-    AvatarImageSerializer, IngredientSerializer,
-    RecipeCreateUpdateSerializer, RecipeSerializer,
-    ShortRecipeInfoSerializer, SubscriptionSerializer,
-    TagSerializer, UserSerializer)
+    AvatarImageSerializer, IngredientSerializer, RecipeCreateUpdateSerializer,
+    ShortRecipeInfoSerializer, SubscriptionSerializer, TagSerializer,
+    UserSerializer)
+from .streaming import AsyncStreamingHttpResponse, in_thread, stream_json
 
 
 class CustomUserViewSet(UserViewSet):
     """Обработчик для пользователей"""
 
     serializer_class = UserSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = UserLimitOffsetPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            queryset = UserSerializer.prepare_queryset(
+                queryset, self.request)
+        return queryset
 
     def get_permissions(self):
         if self.action in ('list', 'create', 'retrieve'):
@@ -64,9 +83,9 @@ class SubscriptionListView(APIView):
 
     def get(self, request):
         user = request.user
-        queryset = CustomUser.objects.filter(subscription__subscriber=user)
-        paginator = PageNumberPagination()
-        paginator.page_size = request.query_params.get('limit', 6)
+        queryset = SubscriptionSerializer.prepare_queryset(
+            CustomUser.objects.filter(subscription__subscriber=user), request)
+        paginator = LimitPageNumberPagination()
         result_page = paginator.paginate_queryset(queryset, request)
         recipes_limit = request.query_params.get('recipes_limit')
         serializer = SubscriptionSerializer(
@@ -174,37 +193,102 @@ class IngredientDetailView(APIView):
         return Response(IngredientSerializer(ingredient).data)
 
 
-class RecipeListView(APIView):
-    """Обработчик для получения списка рецептов с фильтрацией
-    и создания нового рецепта"""
+def filter_recipes(request):
+    """Рецепты с учётом фильтров из параметров запроса"""
 
-    def get(self, request):
-        """Получение списка рецептов"""
+    recipes = Recipe.objects.all()
+
+    is_favorited = request.query_params.get('is_favorited')
+    if is_favorited == '1' and request.user.is_authenticated:
+        recipes = recipes.filter(favorite__user=request.user)
+
+    is_in_shopping_cart = request.query_params.get('is_in_shopping_cart')
+    if is_in_shopping_cart == '1' and request.user.is_authenticated:
+        recipes = recipes.filter(shoppingcart__user=request.user)
+
+    author = request.query_params.get('author')
+    if author:
+        recipes = recipes.filter(author__id=author)
+
+    tags = request.query_params.getlist('tags')
+    if tags:
+        recipes = recipes.filter(tags__slug__in=tags).distinct()
+    return recipes
+
+
+def filtered_recipe_ids(request):
+    """Id рецептов с учётом фильтров и полнотекстового поиска
+    из параметра search: при поиске рецепты упорядочены по рангу"""
+
+    recipes = filter_recipes(request)
+    search = request.query_params.get('search', '').strip()
+    if search:
+        return search_recipe_ids(recipes, search)
+    return recipes.values_list('id', flat=True)
+
+
+def ids_param(request, name):
+    """Id из параметра name (через запятую) без повторов в порядке
+    запроса, не больше MAX_PAGE_SIZE"""
+
+    values = [
+        value.strip()
+        for value in request.query_params.get(name, '').split(',')
+        if value.strip()]
+    if not values:
+        raise ValidationError({name: 'Укажите id через запятую.'})
+    if not all(value.isdigit() for value in values):
+        raise ValidationError({name: 'Передан неверный ID.'})
+    ids = list(dict.fromkeys(int(value) for value in values))
+    if len(ids) > settings.MAX_PAGE_SIZE:
+        raise ValidationError({name: (
+            f'Можно передать не больше {settings.MAX_PAGE_SIZE} id.')})
+    return ids
+
+
+def batch_response_data(ids, request):
+    """Рецепты в порядке запроса и id рецептов, которых нет в БД"""
+
+    recipes = serialize_recipe_map(ids, request)
+    return {
+        'results': list(recipes.values()),
+        'missing': [
+            recipe_id for recipe_id in ids if recipe_id not in recipes],
+    }
+
+
+def cookable_page(request):
+    """Страница рецептов, отсортированных по доле ингредиентов,
+    которые есть у пользователя (параметр ingredients), с этой долей
+    в поле coverage"""
 
-        recipes = Recipe.objects.all()
+    ranking = cookable_index.search(ids_param(request, 'ingredients'))
+    paginator = LimitPageNumberPagination()
+    page = paginator.paginate_queryset(ranking, request)
+    recipes = serialize_recipe_map(
+        [recipe_id for recipe_id, _ in page], request)
+    return paginator, [
+        {**recipes[recipe_id], 'coverage': round(coverage, 3)}
+        for recipe_id, coverage in page if recipe_id in recipes]
 
-        is_favorited = request.query_params.get('is_favorited')
-        if is_favorited == '1' and request.user.is_authenticated:
-            recipes = recipes.filter(favorite__user=request.user)
 
-        is_in_shopping_cart = request.query_params.get('is_in_shopping_cart')
-        if is_in_shopping_cart == '1' and request.user.is_authenticated:
-            recipes = recipes.filter(shoppingcart__user=request.user)
+def recipe_page_data(request):
+    """Страница списка рецептов с учётом параметров запроса"""
 
-        author = request.query_params.get('author')
-        if author:
-            recipes = recipes.filter(author__id=author)
+    paginator = LimitPageNumberPagination()
+    ids = paginator.paginate_queryset(filtered_recipe_ids(request), request)
+    return paginator.get_paginated_response(
+        serialize_recipes(ids, request)).data
 
-        tags = request.query_params.getlist('tags')
-        if tags:
-            recipes = recipes.filter(tags__slug__in=tags).distinct()
 
-        paginator = PageNumberPagination()
-        paginator.page_size = request.query_params.get('limit', 6)
-        paginated_recipes = paginator.paginate_queryset(recipes, request)
+class RecipeListView(APIView):
+    """Обработчик для получения списка рецептов с фильтрацией
+    и создания нового рецепта"""
+
+    def get(self, request):
+        """Получение списка рецептов"""
 
-        return paginator.get_paginated_response(RecipeSerializer(
-            paginated_recipes, many=True, context={'request': request}).data)
+        return Response(recipe_page_data(request))
 
     def post(self, request):
         """Создание нового рецепта"""
@@ -216,8 +300,61 @@ class RecipeListView(APIView):
             data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
         recipe = serializer.save(author=request.user)
-        serializer = RecipeSerializer(recipe, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(
+            serialize_recipes([recipe.id], request)[0],
+            status=status.HTTP_201_CREATED)
+
+
+class RecipeBatchView(APIView):
+    """Обработчик для получения нескольких рецептов по id за один запрос"""
+
+    def get(self, request):
+        return Response(
+            batch_response_data(ids_param(request, 'ids'), request))
+
+
+class RecipeCookableView(APIView):
+    """Обработчик для поиска рецептов по имеющимся ингредиентам"""
+
+    def get(self, request):
+        paginator, data = cookable_page(request)
+        return paginator.get_paginated_response(data)
+
+
+class RecipeChangesView(APIView):
+    """Обработчик ленты изменений рецептов для синхронизации
+    локальной копии на клиенте"""
+
+    def get(self, request):
+        return Response(recipe_changes(request))
+
+
+class RecipeExportView(APIView):
+    """Обработчик для выгрузки всех рецептов с учётом фильтров
+    потоковым JSON-массивом без постраничного вывода"""
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        content = keep_routing(stream_json(
+            filtered_recipe_ids(request),
+            lambda ids: serialize_recipes(ids, request),
+            settings.EXPORT_CHUNK_SIZE))
+        if isinstance(request._request, ASGIRequest):
+            return AsyncStreamingHttpResponse(
+                in_thread(content), content_type='application/json')
+        return StreamingHttpResponse(
+            content, content_type='application/json')
+
+
+class RecipeEventsTicketView(APIView):
+    """Обработчик для получения билета на подключение к потоку событий
+    /api/recipes/events/ через EventSource"""
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        return Response({'ticket': make_ticket(request.user.pk)})
 
 
 class RecipeDetailView(APIView):
@@ -234,9 +371,10 @@ class RecipeDetailView(APIView):
     def get(self, request, id):
         """Получение информации о рецепте по ID"""
 
-        recipe = self.get_recipe_or_404(id)
-        return Response(
-            RecipeSerializer(recipe, context={'request': request}).data)
+        recipes = serialize_recipes([id], request)
+        if not recipes:
+            raise NotFound(detail='Рецепт не найден.')
+        return Response(recipes[0])
 
     def patch(self, request, id):
         """Изменение рецепта"""
@@ -252,8 +390,7 @@ class RecipeDetailView(APIView):
             recipe, data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
         recipe = serializer.save()
-        return Response(RecipeSerializer(
-            recipe, context={'request': request}).data)
+        return Response(serialize_recipes([recipe.id], request)[0])
 
     def delete(self, request, id):
         """Удаление рецепта"""
@@ -274,6 +411,29 @@ class RecipeDetailView(APIView):
         return super().get_permissions()
 
 
+def similar_recipes_data(recipe_id, request):
+    """Похожие рецепты из таблицы, рассчитанной командой
+    update_similar_recipes, по убыванию сходства (поле score)"""
+
+    pairs = list(SimilarRecipe.objects.filter(
+        recipe_id=recipe_id).order_by('-score', '-similar_id').values_list(
+        'similar_id', 'score')[:settings.SIMILAR_RECIPES_COUNT])
+    if not pairs and not Recipe.objects.filter(id=recipe_id).exists():
+        raise NotFound(detail='Рецепт не найден.')
+    recipes = serialize_recipe_map(
+        [similar_id for similar_id, _ in pairs], request)
+    return [
+        {**recipes[similar_id], 'score': round(score, 3)}
+        for similar_id, score in pairs if similar_id in recipes]
+
+
+class RecipeSimilarView(APIView):
+    """Обработчик для получения похожих рецептов"""
+
+    def get(self, request, id):
+        return Response(similar_recipes_data(id, request))
+
+
 class RecipeGetShortLinkView(APIView):
     """Обработчик для получения короткой ссылки на рецепт"""
 
@@ -415,3 +575,69 @@ class DownloadShoppingCartView(APIView):
         response = HttpResponse(pdf, content_type='application/pdf')
         response['Content-Disposition'] = f'attachment; filename="{filename}"'
         return response
+
+
+class ProfileDownloadView(APIView):
+    """Обработчик для скачивания сохранённого профиля запроса"""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, profile_id):
+        path = profile_path(profile_id)
+        if not os.path.exists(path):
+            raise NotFound(detail='Профиль не найден.')
+        if request.query_params.get('output') == 'text':
+            stream = StringIO()
+            pstats.Stats(path, stream=stream).sort_stats(
+                'cumulative').print_stats(50)
+            return HttpResponse(stream.getvalue(), content_type='text/plain')
+        return FileResponse(
+            open(path, 'rb'), as_attachment=True,
+            filename=f'{profile_id}.prof')
+
+
+def current_user_data(request):
+    """Текущий пользователь, как в /api/users/me/, или None
+    для анонимного пользователя"""
+
+    if not request.user.is_authenticated:
+        return None
+    return UserSerializer(
+        request.user,
+        context={'request': request, 'default_fields': True}).data
+
+
+def with_recipe_list_links(page):
+    """Страница рецептов со ссылками на соседние страницы списка
+    рецептов вместо адреса текущего запроса"""
+
+    for key in ('next', 'previous'):
+        if page[key]:
+            page[key] = urlsplit(page[key])._replace(
+                path=reverse('api:recipes')).geturl()
+    return page
+
+
+def tags_data():
+    return TagSerializer(Tag.objects.all(), many=True).data
+
+
+def shopping_cart_count(request):
+    if not request.user.is_authenticated:
+        return 0
+    return ShoppingCart.objects.filter(user=request.user).count()
+
+
+class BootstrapView(APIView):
+    """Обработчик для данных первой отрисовки страницы одним запросом:
+    текущий пользователь, теги, первая страница списка рецептов
+    (параметры запроса — как у списка рецептов) и количество рецептов
+    в списке покупок"""
+
+    def get(self, request):
+        return Response({
+            'user': current_user_data(request),
+            'tags': tags_data(),
+            'recipes': with_recipe_list_links(recipe_page_data(request)),
+            'shopping_cart_count': shopping_cart_count(request),
+        })
@@ -1,7 +1,24 @@
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+os.environ.setdefault('ASYNC_VIEWS', '1')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+# ASGIHandler Django 3.2 читает потоковый ответ синхронно и заблокировал
+# бы цикл событий: выгрузка рецептов отправляется обработчиком
+# с поддержкой асинхронных потоковых ответов, а поток событий — без Django
+from api.async_views import recipe_events  # noqa: E402
+from api.streaming import StreamingASGIHandler  # noqa: E402
+
+django_application = StreamingASGIHandler()
+
+EVENTS_PATH = '/api/recipes/events/'
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+        return await recipe_events(scope, receive, send)
+    return await django_application(scope, receive, send)
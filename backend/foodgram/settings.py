@@ -28,6 +28,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -35,6 +36,9 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ProfilingMiddleware',
+    'api.middleware.QueryLogMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -59,15 +63,35 @@ WSGI_APPLICATION = 'foodgram.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'api.db.postgresql',
         'NAME': os.getenv('POSTGRES_DB', 'django'),
         'USER': os.getenv('POSTGRES_USER', 'django'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', ''),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'PORT': os.getenv('DB_PORT', 5432),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
+        'POOL_SIZE': int(os.getenv('DB_POOL_SIZE', '0')),
+        'POOL_TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', '10')),
     }
 }
 
+# Чтение с реплики включено, если задан её адрес. В тестах реплика —
+# зеркало основной БД; при DB_REPLICA_MIRROR=1 она объявляется и без
+# адреса, чтобы выполнить тесты маршрутизации, которые сами её включают
+REPLICA_ROUTING = bool(os.getenv('DB_REPLICA_HOST'))
+if REPLICA_ROUTING or os.getenv('DB_REPLICA_MIRROR') == '1':
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.getenv('DB_REPLICA_HOST'),
+        'PORT': os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '5'))
+REPLICA_PIN_COOKIE = 'pin_primary'
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -103,13 +127,79 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_DIR = os.getenv('PROFILING_DIR', BASE_DIR / 'profiles')
+PROFILING_MAX_FILES = int(os.getenv('PROFILING_MAX_FILES', '200'))
+
+# Асинхронные варианты GET-представлений включаются при запуске
+# через ASGI (foodgram/asgi.py)
+ASYNC_VIEWS = bool(int(os.getenv('ASYNC_VIEWS', '0')))
+ASYNC_DB_THREADS = int(os.getenv('ASYNC_DB_THREADS', '8'))
+
+# Номера версий кэшей (токенов, справочников) хранятся в кэше Django.
+# С общим для процессов кэшем (например, CACHE_BACKEND=django.core.cache.
+# backends.memcached.PyMemcacheCache) сброс виден всем воркерам сразу,
+# с локальным по умолчанию — только после истечения TTL
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# С локальным кэшем Django другие процессы принимают отозванный токен
+# (выход, смена пароля, деактивация) не дольше TOKEN_CACHE_TTL секунд
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', '60'))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))
+
+REFERENCE_IDS_TTL = int(os.getenv('REFERENCE_IDS_TTL', '300'))
+COOKABLE_INDEX_TTL = int(os.getenv('COOKABLE_INDEX_TTL', '600'))
+SIMILAR_RECIPES_COUNT = int(os.getenv('SIMILAR_RECIPES_COUNT', '10'))
+
+# Наибольший размер страницы (параметр limit); больше объектов за один
+# запрос отдаёт только потоковая выгрузка /api/recipes/export/
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', '100'))
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '500'))
+# Ленту изменений рецептов клиент запрашивает с перекрытием, чтобы
+# не пропустить изменения из транзакций, завершившихся позже следующих
+CHANGES_OVERLAP_SECONDS = int(os.getenv('CHANGES_OVERLAP_SECONDS', '5'))
+DELETED_RECIPES_DAYS = int(os.getenv('DELETED_RECIPES_DAYS', '30'))
+
+# Поток событий о новых рецептах подписок /api/recipes/events/ (только
+# ASGI): api.events.InProcessBackend доставляет события в пределах
+# процесса, api.events.PostgresBackend — во все процессы
+EVENTS_BACKEND = os.getenv('EVENTS_BACKEND', 'api.events.InProcessBackend')
+EVENTS_QUEUE_SIZE = int(os.getenv('EVENTS_QUEUE_SIZE', '100'))
+EVENTS_KEEPALIVE_SECONDS = int(os.getenv('EVENTS_KEEPALIVE_SECONDS', '15'))
+# Срок действия билета для подключения к потоку через EventSource
+EVENTS_TICKET_MAX_AGE = int(os.getenv('EVENTS_TICKET_MAX_AGE', '60'))
+
+QUERY_LOG = bool(int(os.getenv('QUERY_LOG', '1')))
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', '100'))
+N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', '10'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'foodgram': {
+            'handlers': ['console'],
+            'level': os.getenv('LOG_LEVEL', 'INFO'),
+        },
+    },
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
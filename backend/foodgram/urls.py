@@ -3,13 +3,18 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
+from api import async_views
+from api.metrics import metrics_view
 from api.views import ShortLinkRedirectView
 
 urlpatterns = [
     path('api/', include('api.urls')),
-    path('s/<str:short_hash>/', ShortLinkRedirectView.as_view(),
+    path('s/<str:short_hash>/',
+         async_views.short_link_redirect if settings.ASYNC_VIEWS
+         else ShortLinkRedirectView.as_view(),
          name='shortlink'),
-    path('admin/', admin.site.urls)
+    path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG:
@@ -0,0 +1,36 @@
+import os
+import shutil
+
+# Метрики процессов gunicorn собираются в общей директории, которую
+# очищает on_starting. Переменная задаётся здесь, а не в образе,
+# чтобы команды manage.py не оставляли в ней файлы своих процессов
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus')
+
+from prometheus_client import multiprocess  # noqa: E402
+
+bind = '0.0.0.0:8000'
+
+
+def on_starting(server):
+    """Очистка метрик, оставшихся от предыдущего запуска"""
+
+    directory = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def post_worker_init(worker):
+    """Построение индекса поиска по ингредиентам в фоне до первого
+    запроса"""
+
+    from api.cookable import cookable_index
+    cookable_index.warm_up()
+
+
+def child_exit(server, worker):
+    """Исключение метрик-счётчиков текущего значения для завершённого
+    процесса"""
+
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(worker.pid)
@@ -7,6 +7,9 @@ import sys
 def main():
     """Run administrative tasks."""
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+    # метрики Prometheus команд хранятся в памяти процесса, а не в общей
+    # директории метрик gunicorn
+    os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
@@ -0,0 +1,63 @@
+# Generated by Django 3.2.3 on 2026-10-19 09:24
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Поисковый вектор: слова названия с весом A и описания с весом B
+# в конфигурации russian. Триггер поддерживает его при любой вставке
+# и изменении, включая пакетную вставку в import_data и generate_data
+CREATE_SEARCH_INDEX = '''
+CREATE FUNCTION recipes_recipe_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(NEW.name, '')), 'A')
+        || setweight(to_tsvector('russian', coalesce(NEW.text, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER recipes_recipe_search_vector
+    BEFORE INSERT OR UPDATE ON recipes_recipe
+    FOR EACH ROW EXECUTE PROCEDURE recipes_recipe_search_vector();
+
+UPDATE recipes_recipe SET search_vector =
+    setweight(to_tsvector('russian', name), 'A')
+    || setweight(to_tsvector('russian', text), 'B');
+
+CREATE INDEX recipes_recipe_search_vector_gin
+    ON recipes_recipe USING gin (search_vector);
+'''
+
+DROP_SEARCH_INDEX = '''
+DROP INDEX recipes_recipe_search_vector_gin;
+DROP TRIGGER recipes_recipe_search_vector ON recipes_recipe;
+DROP FUNCTION recipes_recipe_search_vector();
+'''
+
+
+def postgresql_only(sql):
+    """Полнотекстовый поиск есть только в PostgreSQL, в остальных БД
+    используется api.search.RecipeSearchIndex"""
+
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_similar_recipes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(
+            postgresql_only(CREATE_SEARCH_INDEX),
+            postgresql_only(DROP_SEARCH_INDEX)),
+    ]
@@ -1,3 +1,4 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
 from django.db import models
 
@@ -49,12 +50,17 @@ class Recipe(models.Model):
     author = models.ForeignKey(
         CustomUser, on_delete=models.CASCADE, verbose_name='автор')
     pub_date = models.DateTimeField('дата публикации', auto_now_add=True)
+    updated_at = models.DateTimeField('дата изменения', auto_now=True)
+    # заполняется триггером PostgreSQL из названия и описания
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         verbose_name = 'рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
         default_related_name = 'recipe'
+        indexes = [models.Index(
+            fields=['updated_at', 'id'], name='recipe_updated_at_id')]
 
     def __str__(self):
         return self.name
@@ -122,3 +128,47 @@ class ShoppingCart(models.Model):
         verbose_name = 'покупку'
         verbose_name_plural = 'Списки покупок'
         default_related_name = 'shoppingcart'
+
+
+class SimilarRecipe(models.Model):
+    """Модель для похожих рецептов, рассчитанных командой
+    update_similar_recipes"""
+
+    recipe = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE, related_name='similar',
+        verbose_name='рецепт')
+    similar = models.ForeignKey(
+        Recipe, on_delete=models.CASCADE, related_name='+',
+        verbose_name='похожий рецепт')
+    score = models.FloatField('сходство')
+
+    class Meta:
+        verbose_name = 'похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [models.UniqueConstraint(
+            fields=['recipe', 'similar'], name='unique_similar_recipe')]
+
+
+class SimilarRecipeUpdate(models.Model):
+    """Модель для рецептов, похожие рецепты которых нужно пересчитать"""
+
+    recipe = models.OneToOneField(
+        Recipe, on_delete=models.CASCADE, related_name='+',
+        verbose_name='рецепт')
+
+    class Meta:
+        verbose_name = 'пересчёт похожих рецептов'
+        verbose_name_plural = 'Пересчёт похожих рецептов'
+
+
+class DeletedRecipe(models.Model):
+    """Модель для удалённых рецептов: по ней клиенты, синхронизирующие
+    рецепты через /api/recipes/changes/, удаляют их из своей копии"""
+
+    recipe_id = models.BigIntegerField('id рецепта')
+    deleted_at = models.DateTimeField(
+        'дата удаления', auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'удалённый рецепт'
+        verbose_name_plural = 'Удалённые рецепты'
@@ -0,0 +1,42 @@
+# Generated by Django 3.2.3 on 2026-10-19 09:48
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_by(queryset, field):
+    return Coalesce(Subquery(queryset.filter(
+        **{field: OuterRef('pk')}).order_by().values(field).annotate(
+        count=Count('pk')).values('count')), 0)
+
+
+def update_counters(apps, schema_editor):
+    apps.get_model('users', 'CustomUser').objects.update(
+        recipes_count=count_by(
+            apps.get_model('recipes', 'Recipe').objects, 'author'),
+        followers_count=count_by(
+            apps.get_model('users', 'Subscription').objects,
+            'subscription'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+        ('recipes', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='количество подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='количество рецептов'),
+        ),
+        migrations.RunPython(update_counters, migrations.RunPython.noop),
+    ]
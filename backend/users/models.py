@@ -8,6 +8,11 @@ class CustomUser(AbstractUser):
     email = models.EmailField('почта', max_length=254, unique=True)
     avatar = models.ImageField(
         upload_to='users/images/', blank=True, null=True, default=None)
+    # счётчики поддерживаются сигналами api.signals
+    recipes_count = models.PositiveIntegerField(
+        'количество рецептов', default=0, editable=False)
+    followers_count = models.PositiveIntegerField(
+        'количество подписчиков', default=0, editable=False)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
@@ -12,16 +12,20 @@ const Cart = ({ updateOrders, orders }) => {
     handleAddToCart
   } = useRecipes()
   
-  const getRecipes = () => {
+  const getRecipes = (page = 1, loaded = []) => {
     api
       .getRecipes({
-        page: 1,
-        limit: 999,
+        page,
+        limit: 100,
         is_in_shopping_cart: Number(true)
       })
       .then(res => {
-        const { results } = res
-        setRecipes(results)
+        const { results, next } = res
+        const recipes = [...loaded, ...results]
+        if (next) {
+          return getRecipes(page + 1, recipes)
+        }
+        setRecipes(recipes)
       })
   }
 